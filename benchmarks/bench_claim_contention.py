@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Scan job claiming benchmark.
+#
+# N worker processes claim scan jobs as fast as they can during a
+# period of time, using get_next_scan_job() (FOR UPDATE NOWAIT +
+# pg_sleep(random())) and claim_scan_jobs() (SKIP LOCKED). All the
+# jobs are defined with execution_interval = 0, so they are always
+# due and every worker competes for the same rows.
+#
+# The benchmark registers the network 198.18.0.0/24 (RFC 2544
+# benchmarking range) and removes it at the end. Run it against a
+# test database, never against a production nmap2db database.
+#
+# Example:
+#
+#   ./bench_claim_contention.py --dsn "dbname=nmap2db_test" --workers 40
+#
+
+import os
+import sys
+import time
+import json
+import argparse
+import multiprocessing
+
+import psycopg2
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from nmap2db.config import *
+
+BENCHMARK_NETWORK = '198.18.0.0/24'
+
+
+# ############################################
+# Function setup_scan_jobs()
+# ############################################
+
+def setup_scan_jobs(dsn,num_jobs):
+    '''Register the benchmark network and num_jobs scan jobs'''
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cleanup_scan_jobs(dsn)
+
+    cur.execute('SELECT register_network(%s,%s)',(BENCHMARK_NETWORK,'nmap2db benchmark'))
+
+    for index in range(num_jobs):
+        cur.execute('INSERT INTO scan_job (network_addr,scan_id,execution_interval,active_status) VALUES (%s,%s,%s,TRUE)',
+                    ('198.18.0.' + str(index + 1) + '/32','sn-traceroute','0 seconds'))
+
+    conn.close()
+
+
+# ############################################
+# Function cleanup_scan_jobs()
+# ############################################
+
+def cleanup_scan_jobs(dsn):
+    '''Remove the benchmark network and its scan jobs'''
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute('DELETE FROM network WHERE network_addr = %s',(BENCHMARK_NETWORK,))
+    conn.close()
+
+
+# ############################################
+# Function run_worker()
+# ############################################
+
+def run_worker(dsn,method,batch,duration,queue):
+    '''Claim scan jobs during duration seconds and report the results'''
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    claims = 0
+    jobs = 0
+    empty = 0
+    latencies = []
+
+    deadline = time.time() + duration
+
+    while time.time() < deadline:
+
+        started = time.time()
+
+        if method == 'nowait':
+            cur.execute('SELECT get_next_scan_job()')
+            claimed = [row for row in cur.fetchall() if row[0] != None]
+        else:
+            cur.execute('SELECT scan_jobid FROM claim_scan_jobs(%s)',(batch,))
+            claimed = cur.fetchall()
+
+        latencies.append(time.time() - started)
+        claims += 1
+
+        if claimed:
+            jobs += len(claimed)
+        else:
+            empty += 1
+
+    conn.close()
+    queue.put({'claims':claims,'jobs':jobs,'empty':empty,'latencies':latencies})
+
+
+# ############################################
+# Function run_benchmark()
+# ############################################
+
+def run_benchmark(dsn,method,workers,batch,duration):
+    '''Run a benchmark with a claiming method and return the results'''
+
+    queue = multiprocessing.Queue()
+    processes = []
+
+    for index in range(workers):
+        process = multiprocessing.Process(target=run_worker,args=(dsn,method,batch,duration,queue))
+        processes.append(process)
+
+    for process in processes:
+        process.start()
+
+    results = [queue.get() for process in processes]
+
+    for process in processes:
+        process.join()
+
+    latencies = []
+
+    for result in results:
+        latencies.extend(result['latencies'])
+
+    latencies.sort()
+
+    claims = sum([result['claims'] for result in results])
+    jobs = sum([result['jobs'] for result in results])
+
+    return {'method':method,
+            'workers':workers,
+            'batch':batch,
+            'duration':duration,
+            'claims':claims,
+            'jobs_claimed':jobs,
+            'empty_claims':sum([result['empty'] for result in results]),
+            'jobs_per_second':round(jobs / float(duration),2),
+            'latency_p50':percentile(latencies,0.50),
+            'latency_p99':percentile(latencies,0.99),
+            'latency_max':percentile(latencies,1.0)}
+
+
+# ############################################
+# Function percentile()
+# ############################################
+
+def percentile(values,fraction):
+    '''Get a percentile from a sorted list of values'''
+
+    if not values:
+        return None
+
+    index = min(len(values) - 1,int(round(fraction * (len(values) - 1))))
+    return round(values[index],6)
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='nmap2db scan job claiming benchmark')
+    parser.add_argument('--dsn',default=None,help='DSN of a test nmap2db database (default: nmap2db.conf)')
+    parser.add_argument('--workers',type=int,default=20,help='Number of concurrent workers')
+    parser.add_argument('--jobs',type=int,default=50,help='Number of scan jobs defined')
+    parser.add_argument('--batch',type=int,default=1,help='Scan jobs claimed per call with claim_scan_jobs()')
+    parser.add_argument('--duration',type=int,default=20,help='Seconds every method is benchmarked')
+    parser.add_argument('--method',choices=['nowait','skip_locked','both'],default='both')
+    args = parser.parse_args()
+
+    if args.dsn == None:
+        dsn = configuration().dsn
+    else:
+        dsn = args.dsn
+
+    if args.method == 'both':
+        methods = ['nowait','skip_locked']
+    else:
+        methods = [args.method]
+
+    setup_scan_jobs(dsn,args.jobs)
+
+    try:
+        for method in methods:
+            print json.dumps(run_benchmark(dsn,method,args.workers,args.batch,args.duration),sort_keys=True)
+            sys.stdout.flush()
+
+    finally:
+        cleanup_scan_jobs(dsn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Report ingest throughput benchmark.
+#
+# Synthetic nmap reports are saved with save_scan_report(), one
+# committed transaction per report as nmap2db_scan does, and
+# the benchmark measures:
+#
+# * throughput: reports, hosts and MB of XML saved per second.
+# * trigger cost: the same reports are saved with the triggers
+#                 of scan_report (mode "triggers") and with
+#                 nmap2db.client_side_ingest = 'on' (mode
+#                 "no_triggers"), where the triggers return at
+#                 once and only the report is saved. The
+#                 difference is the time used by the triggers.
+# * table growth: the size of every table used by the ingest,
+#                 indexes and TOAST included, after the run, and
+#                 the bytes used per report and per host.
+# * index cost: the runs are done with the indexes defined in
+#               sql/nmap2db.sql (index set "current") and with
+#               the btree indexes used before the BRIN and
+#               partial indexes (index set "legacy",
+#               sql/legacy_indexes.sql). The difference is the
+#               time and the space saved by the current indexes.
+#
+# With --native-partitioning the throwaway instance uses native
+# partitioning (sql/nmap2db_native_partitioning.sql), and the
+# sizes include all the partitions of the tables.
+#
+# By default the benchmark creates a throwaway PostgreSQL
+# instance (pg_throwaway.py) that is deleted at the end. With
+# --dsn it uses an existing nmap2db database, whose report tables
+# are TRUNCATED before every run. Never use --dsn with a
+# production nmap2db database.
+#
+# The results are printed as one JSON object per mode, and are
+# written to the file defined with --output too, so they can be
+# compared between releases.
+#
+# Example:
+#
+#   ./bench_ingest_throughput.py --reports 200 --hosts 16 --ports 20 --scripts 2 --output results.json
+#   ./bench_ingest_throughput.py --native-partitioning --modes triggers --index-sets current legacy
+#
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+
+import psycopg2
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from nmap2db.xml_report import get_report_id
+from nmap_xml_generator import *
+from pg_throwaway import *
+from bench_report_ingest import percentile
+
+INGEST_TABLES = ['scan_report','host_info','service_info','host_current','service_current','network_topology','hostaddress']
+
+INDEX_TABLES = ['scan_report','host_info','service_info','host_current','service_current']
+
+LEGACY_INDEXES = os.path.join(os.path.dirname(os.path.abspath(__file__)),'sql','legacy_indexes.sql')
+
+MAX_BENCHMARK_HOSTS = 131070
+
+
+# ############################################
+# Function get_table_sizes()
+# ############################################
+
+def get_table_sizes(cur):
+    """Get the total size, the size of the indexes and the number of rows of the ingest tables"""
+
+    sizes = {}
+
+    for table in INGEST_TABLES:
+        cur.execute('SELECT sum(pg_total_relation_size(a.oid))::bigint, sum(pg_indexes_size(a.oid))::bigint, (SELECT count(*) FROM ' + table + ') '
+                    'FROM pg_class a '
+                    'WHERE a.oid = %s::regclass '
+                    'OR a.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)',(table,table))
+        total_bytes, index_bytes, rows = cur.fetchone()
+
+        sizes[table] = {'bytes':total_bytes,'index_bytes':index_bytes,'rows':rows}
+
+    return sizes
+
+
+# ############################################
+# Function get_indexes()
+#
+# The primary keys are not included. The indexes
+# of a partitioned table are defined with ON ONLY,
+# they are created in all its partitions if this
+# is removed.
+# ############################################
+
+def get_indexes(cur):
+    """Get the names and the definitions of the indexes of the report tables"""
+
+    cur.execute('SELECT b.relname, pg_get_indexdef(a.indexrelid) '
+                'FROM pg_index a '
+                'JOIN pg_class b ON b.oid = a.indexrelid '
+                'WHERE a.indrelid = ANY(%s::regclass[]) '
+                'AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = a.indexrelid) '
+                'ORDER BY b.relname',(INDEX_TABLES,))
+
+    return [(name,definition.replace(' ON ONLY ',' ON ')) for name, definition in cur.fetchall()]
+
+
+# ############################################
+# Function use_index_set()
+# ############################################
+
+def use_index_set(cur,index_set,current_indexes):
+    """Replace the indexes of the report tables with an index set"""
+
+    for name, definition in get_indexes(cur):
+        cur.execute('DROP INDEX ' + name)
+
+    if index_set == 'legacy':
+        cur.execute(open(LEGACY_INDEXES).read())
+    else:
+        for name, definition in current_indexes:
+            cur.execute(definition)
+
+
+# ############################################
+# Function prepare_database()
+#
+# The reports of the previous run are deleted so
+# every run starts with empty tables.
+# ############################################
+
+def prepare_database(cur,num_hosts):
+    """Empty the ingest tables and register the hosts of the reports"""
+
+    cur.execute('TRUNCATE scan_report, host_info, service_info, host_current, service_current, network_topology')
+    cur.execute('DELETE FROM hostaddress WHERE hostaddr <<= %s',(BENCHMARK_NETWORK,))
+
+    cur.execute('INSERT INTO hostaddress (hostaddr) '
+                'SELECT %s::inet + g.offset_ FROM generate_series(0,%s) AS g(offset_) '
+                'ON CONFLICT DO NOTHING',
+                (get_host_address(0),num_hosts - 1))
+
+    cur.execute('VACUUM ANALYZE hostaddress')
+
+
+# ############################################
+# Function run_benchmark()
+# ############################################
+
+def run_benchmark(dsn,mode,index_set,reports,num_hosts):
+    """Save a list of reports with num_hosts hosts each in a mode and return the results"""
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    latencies = []
+
+    try:
+        prepare_database(cur,len(reports) * num_hosts)
+        sizes_before = get_table_sizes(cur)
+
+        if mode == 'no_triggers':
+            cur.execute("SET nmap2db.client_side_ingest = 'on'")
+
+        started = time.time()
+
+        for xml_report in reports:
+            report_started = time.time()
+            cur.execute('SELECT save_scan_report(NULL,%s,%s)',(xml_report,get_report_id(xml_report)))
+            latencies.append(time.time() - report_started)
+
+        elapsed = time.time() - started
+
+        cur.execute('RESET nmap2db.client_side_ingest')
+        sizes_after = get_table_sizes(cur)
+
+    finally:
+        conn.close()
+
+    latencies.sort()
+
+    xml_bytes = sum([len(xml_report) for xml_report in reports])
+    total_hosts = len(reports) * num_hosts
+
+    growth = {}
+
+    for table in INGEST_TABLES:
+        growth[table] = {'bytes':sizes_after[table]['bytes'] - sizes_before[table]['bytes'],
+                         'index_bytes':sizes_after[table]['index_bytes'] - sizes_before[table]['index_bytes'],
+                         'rows':sizes_after[table]['rows'] - sizes_before[table]['rows']}
+
+    growth_bytes = sum([growth[table]['bytes'] for table in INGEST_TABLES])
+    index_growth_bytes = sum([growth[table]['index_bytes'] for table in INGEST_TABLES])
+
+    return {'mode':mode,
+            'index_set':index_set,
+            'reports':len(reports),
+            'hosts':total_hosts,
+            'xml_bytes':xml_bytes,
+            'total_seconds':round(elapsed,3),
+            'reports_per_second':round(len(reports) / elapsed,2),
+            'hosts_per_second':round(total_hosts / elapsed,2),
+            'xml_mb_per_second':round(xml_bytes / elapsed / 1048576,3),
+            'ms_per_report_mean':round(sum(latencies) * 1000 / len(latencies),3),
+            'ms_per_report_p50':percentile(latencies,0.50),
+            'ms_per_report_p95':percentile(latencies,0.95),
+            'ms_per_report_p99':percentile(latencies,0.99),
+            'table_growth':growth,
+            'growth_bytes':growth_bytes,
+            'growth_bytes_per_report':growth_bytes / len(reports),
+            'growth_bytes_per_host':growth_bytes / total_hosts,
+            'index_growth_bytes':index_growth_bytes,
+            'index_growth_bytes_per_host':index_growth_bytes / total_hosts}
+
+
+# ############################################
+# Function get_server_info()
+# ############################################
+
+def get_server_info(dsn):
+    """Get the version and the settings of the PostgreSQL server"""
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+
+    try:
+        cur.execute("SELECT current_setting('server_version'), current_setting('shared_buffers'), current_setting('synchronous_commit')")
+        version, shared_buffers, synchronous_commit = cur.fetchone()
+
+    finally:
+        conn.close()
+
+    return {'server_version':version,
+            'shared_buffers':shared_buffers,
+            'synchronous_commit':synchronous_commit}
+
+
+# ############################################
+# Function run_suite()
+# ############################################
+
+def run_suite(dsn,args,reports):
+    """Run every mode with every index set and return the results"""
+
+    results = []
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    try:
+        current_indexes = get_indexes(cur)
+
+        try:
+            for index_set in args.index_sets:
+                use_index_set(cur,index_set,current_indexes)
+
+                for mode in args.modes:
+                    results.append(run_benchmark(dsn,mode,index_set,reports,args.hosts))
+
+        finally:
+            use_index_set(cur,'current',current_indexes)
+
+    finally:
+        conn.close()
+
+    times = dict([((result['index_set'],result['mode']),result['ms_per_report_mean']) for result in results])
+    index_bytes = dict([((result['index_set'],result['mode']),result['index_growth_bytes']) for result in results])
+
+    for result in results:
+        index_set = result['index_set']
+
+        if (index_set,'triggers') in times and (index_set,'no_triggers') in times and result['mode'] == 'triggers':
+            trigger_ms = times[(index_set,'triggers')] - times[(index_set,'no_triggers')]
+
+            result['trigger_ms_per_report'] = round(trigger_ms,3)
+            result['trigger_ms_per_host'] = round(trigger_ms / args.hosts,3)
+
+            if times[(index_set,'triggers')] > 0:
+                result['trigger_fraction'] = round(trigger_ms / times[(index_set,'triggers')],3)
+
+        if index_set == 'current' and ('legacy',result['mode']) in times:
+            result['index_ms_saved_per_report'] = round(times[('legacy',result['mode'])] - result['ms_per_report_mean'],3)
+            result['index_bytes_saved'] = index_bytes[('legacy',result['mode'])] - result['index_growth_bytes']
+
+            if times[('legacy',result['mode'])] > 0:
+                result['index_time_fraction_saved'] = round(result['index_ms_saved_per_report'] / times[('legacy',result['mode'])],3)
+
+    server = get_server_info(dsn)
+
+    for result in results:
+        result.update(server)
+
+    return results
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='nmap2db report ingest throughput benchmark')
+    parser.add_argument('--dsn',default=None,help='DSN of a test nmap2db database. Its report tables are truncated (default: throwaway instance)')
+    parser.add_argument('--pg-bindir',default=None,help='Directory with initdb, pg_ctl and psql (default: pg_config --bindir)')
+    parser.add_argument('--keep',action='store_true',help='Keep the data directory of the throwaway instance')
+    parser.add_argument('--reports',type=int,default=100,help='Number of reports saved per mode')
+    parser.add_argument('--hosts',type=int,default=4,help='Number of hosts per report')
+    parser.add_argument('--ports',type=int,default=20,help='Number of open ports per host')
+    parser.add_argument('--os-matches',type=int,default=3,help='Number of OS matches per host')
+    parser.add_argument('--hops',type=int,default=8,help='Number of traceroute hops per host')
+    parser.add_argument('--scripts',type=int,default=1,help='Number of NSE script outputs per port and per host')
+    parser.add_argument('--modes',nargs='+',choices=['triggers','no_triggers'],default=['triggers','no_triggers'])
+    parser.add_argument('--index-sets',nargs='+',choices=['current','legacy'],default=['current','legacy'])
+    parser.add_argument('--native-partitioning',action='store_true',help='Use native partitioning in the throwaway instance')
+    parser.add_argument('--output',default=None,help='File where the results are written as JSON')
+    args = parser.parse_args()
+
+    if args.reports * args.hosts > MAX_BENCHMARK_HOSTS:
+        print '[ERROR]: --reports * --hosts can not be bigger than %s' % MAX_BENCHMARK_HOSTS
+        sys.exit(1)
+
+    #
+    # Every report scans different hosts, as a scan job
+    # does with the work units of a network.
+    #
+
+    reports = [generate_nmap_report(args.hosts,args.ports,args.hops,index * args.hosts,index,args.os_matches,args.scripts) for index in range(args.reports)]
+
+    if args.dsn == None:
+        sql_files = args.native_partitioning and [NATIVE_PARTITIONING_SQL] or []
+
+        with throwaway_postgres(args.pg_bindir,keep=args.keep,sql_files=sql_files) as pg:
+            results = run_suite(pg.dsn,args,reports)
+    else:
+        results = run_suite(args.dsn,args,reports)
+
+    parameters = {'reports':args.reports,
+                  'hosts_per_report':args.hosts,
+                  'ports_per_host':args.ports,
+                  'os_matches_per_host':args.os_matches,
+                  'hops_per_host':args.hops,
+                  'scripts_per_port':args.scripts,
+                  'throwaway_instance':args.dsn == None,
+                  'native_partitioning':args.native_partitioning,
+                  'python_version':platform.python_version(),
+                  'timestamp':int(time.time())}
+
+    for result in results:
+        result.update(parameters)
+
+        print json.dumps(result,sort_keys=True)
+        sys.stdout.flush()
+
+    if args.output != None:
+        f = open(args.output,'w')
+
+        try:
+            json.dump(results,f,sort_keys=True,indent=2)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Report ingest benchmark.
+#
+# Synthetic nmap reports are saved with save_scan_report() and
+# the time used by the database to save a report and extract
+# its values is measured per report. Two versions are compared:
+#
+# * legacy: save_scan_report() converting the whole report to 
+#           lowercase and the xpath() based triggers 
+#           (sql/legacy_ingest_triggers.sql).
+# * current: save_scan_report() with the report ID calculated 
+#            by the client and the XMLTABLE triggers defined in
+#            sql/nmap2db.sql.
+#
+# Every method runs in a transaction that is rolled back at the
+# end, including the installation of the legacy functions, so
+# the database is not changed. Run it against a test database
+# anyway, never against a production nmap2db database.
+#
+# Example:
+#
+#   ./bench_report_ingest.py --dsn "dbname=nmap2db_test" --hosts 16 --ports 1000
+#
+
+import os
+import sys
+import time
+import json
+import argparse
+
+import psycopg2
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from nmap2db.config import *
+from nmap2db.xml_report import get_report_id
+from nmap_xml_generator import *
+
+LEGACY_FUNCTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),'sql','legacy_ingest_triggers.sql')
+
+
+# ############################################
+# Function run_benchmark()
+# ############################################
+
+def run_benchmark(dsn,method,reports,num_hosts):
+    """Save a list of reports with a version of the ingest functions and return the results"""
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+
+    latencies = []
+
+    try:
+        if method == 'legacy':
+            cur.execute(open(LEGACY_FUNCTIONS).read())
+
+        cur.execute('INSERT INTO hostaddress (hostaddr) '
+                    'SELECT %s::inet + g.offset_ FROM generate_series(0,%s) AS g(offset_) '
+                    'ON CONFLICT DO NOTHING',
+                    (get_host_address(0),num_hosts - 1))
+
+        for xml_report in reports:
+            started = time.time()
+
+            if method == 'legacy':
+                cur.execute('SELECT save_scan_report(NULL,%s)',(xml_report,))
+            else:
+                cur.execute('SELECT save_scan_report(NULL,%s,%s)',(xml_report,get_report_id(xml_report)))
+
+            latencies.append(time.time() - started)
+
+    finally:
+        conn.rollback()
+        conn.close()
+
+    total = sum(latencies)
+    latencies.sort()
+
+    return {'method':method,
+            'reports':len(reports),
+            'total_seconds':round(total,3),
+            'ms_per_report_mean':round(total * 1000 / len(latencies),3),
+            'ms_per_report_p50':percentile(latencies,0.50),
+            'ms_per_report_p99':percentile(latencies,0.99)}
+
+
+# ############################################
+# Function percentile()
+# ############################################
+
+def percentile(values,fraction):
+    '''Get a percentile in milliseconds from a sorted list of values'''
+
+    if not values:
+        return None
+
+    index = min(len(values) - 1,int(round(fraction * (len(values) - 1))))
+    return round(values[index] * 1000,3)
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='nmap2db report ingest benchmark')
+    parser.add_argument('--dsn',default=None,help='DSN of a test nmap2db database (default: nmap2db.conf)')
+    parser.add_argument('--reports',type=int,default=50,help='Number of reports saved per method')
+    parser.add_argument('--hosts',type=int,default=1,help='Number of hosts per report')
+    parser.add_argument('--ports',type=int,default=100,help='Number of open ports per host')
+    parser.add_argument('--hops',type=int,default=8,help='Number of traceroute hops per host')
+    parser.add_argument('--method',choices=['legacy','current','both'],default='both')
+    args = parser.parse_args()
+
+    if args.dsn == None:
+        dsn = configuration().dsn
+    else:
+        dsn = args.dsn
+
+    if args.method == 'both':
+        methods = ['legacy','current']
+    else:
+        methods = [args.method]
+
+    reports = [generate_nmap_report(args.hosts,args.ports,args.hops,0,seed) for seed in range(args.reports)]
+
+    for method in methods:
+        result = run_benchmark(dsn,method,reports,args.hosts)
+        result.update({'hosts_per_report':args.hosts,'ports_per_host':args.ports,'hops_per_host':args.hops})
+
+        print json.dumps(result,sort_keys=True)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
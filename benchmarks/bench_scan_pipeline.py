@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# End to end scanner benchmark.
+#
+# N bin/nmap2db_scan processes are started with fake_nmap as
+# nmap_binary, so no network is scanned. When all of them are
+# registered and waiting for work, a scan job is registered for
+# a network in 198.18.0.0/15 and the benchmark waits until the
+# execution of the job is complete. It measures:
+#
+# * throughput: hosts saved per second, from the registration of
+#               the scan job to its completion.
+# * dispatch latency: seconds from the registration of the scan
+#                     job to the first claimed work unit, and from
+#                     the registration of every work unit to its
+#                     claim.
+# * database load: transactions, rows and blocks of the nmap2db
+#                  database (pg_stat_database), and the backends
+#                  running a query, sampled while the job runs.
+#
+# The scanners get their own nmap2db.conf, written in a
+# temporary HOME directory with the database, spool and log file
+# of the benchmark. fake_nmap is configured with the --latency,
+# --startup, --down, --ports, --hops and --scripts parameters.
+#
+# By default the benchmark creates a throwaway PostgreSQL
+# instance (pg_throwaway.py). With --dsn it uses an existing test
+# database, where the network of the benchmark, its scan jobs and
+# its hosts are deleted before the run. Never use --dsn with a
+# production nmap2db database.
+#
+# Example:
+#
+#   ./bench_scan_pipeline.py --workers 4 --network 198.18.0.0/22 --max-parallel-hosts 16 --latency lognormal:2,0.5
+#
+
+import os
+import sys
+import time
+import json
+import signal
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import psycopg2
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from pg_throwaway import *
+from bench_report_ingest import percentile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+NMAP2DB_SCAN = os.path.join(BENCHMARK_DIR,'..','bin','nmap2db_scan')
+FAKE_NMAP = os.path.join(BENCHMARK_DIR,'fake_nmap')
+
+DATABASE_STATS = ['xact_commit','xact_rollback','tup_returned','tup_fetched','tup_inserted','tup_updated','tup_deleted','blks_read','blks_hit']
+
+
+# ############################################
+# Function parse_dsn()
+# ############################################
+
+def parse_dsn(dsn):
+    """Get the parameters of a DSN with the key=value format"""
+
+    parameters = {}
+
+    for parameter in dsn.split():
+        key, value = parameter.split('=',1)
+        parameters[key] = value.strip("'")
+
+    return parameters
+
+
+# ############################################
+# Function write_configuration()
+# ############################################
+
+def write_configuration(home_dir,dsn,args):
+    """Write the nmap2db.conf used by the scanners of the benchmark"""
+
+    parameters = parse_dsn(dsn)
+
+    os.makedirs(os.path.join(home_dir,'.nmap2db'))
+
+    lines = ['[nmap2db_database]']
+
+    for key, option in [('host','host'),('hostaddr','hostaddr'),('port','port'),('dbname','dbname'),('user','user'),('password','password')]:
+        if key in parameters:
+            lines.append('%s=%s' % (option,parameters[key]))
+
+    lines += ['pg_connect_retry_interval=1',
+              '',
+              '[nmap2db_scan]',
+              'nmap_binary=%s' % FAKE_NMAP,
+              'max_parallel_hosts=%s' % args.max_parallel_hosts,
+              'hosts_per_nmap_run=%s' % args.hosts_per_nmap_run,
+              'split_batch_reports=true',
+              'max_idle_wait=%s' % args.max_idle_wait,
+              'work_unit_size=%s' % args.work_unit_size,
+              'work_units_per_claim=%s' % args.work_units_per_claim,
+              'heartbeat_interval=5',
+              'lease_duration=60',
+              'drain_timeout=10',
+              'client_side_ingest=%s' % str(args.client_side_ingest).lower(),
+              'spool_dir=%s' % os.path.join(home_dir,'spool'),
+              '',
+              '[logging]',
+              'log_level=%s' % args.log_level,
+              'log_file=%s' % os.path.join(home_dir,'nmap2db.log'),
+              '']
+
+    f = open(os.path.join(home_dir,'.nmap2db','nmap2db.conf'),'w')
+
+    try:
+        f.write('\n'.join(lines))
+    finally:
+        f.close()
+
+
+# ############################################
+# Function get_database_stats()
+#
+# The statistics of a transaction are sent to
+# the statistics collector when it ends. We
+# wait a bit so they are included.
+# ############################################
+
+def get_database_stats(cur):
+    """Get the statistics of the current database"""
+
+    time.sleep(1)
+
+    cur.execute('SELECT pg_stat_clear_snapshot()')
+    cur.execute('SELECT ' + ','.join(DATABASE_STATS) + ' FROM pg_stat_database WHERE datname = current_database()')
+
+    return dict(zip(DATABASE_STATS,cur.fetchone()))
+
+
+# ############################################
+# Function prepare_database()
+# ############################################
+
+def prepare_database(cur,network):
+    """Delete the data of earlier runs and register the network of the benchmark"""
+
+    cur.execute('DELETE FROM scan_job WHERE network_addr = %s',(network,))
+    cur.execute('DELETE FROM network WHERE network_addr = %s',(network,))
+    cur.execute('SELECT register_network(%s,%s)',(network,'nmap2db benchmark'))
+
+
+# ############################################
+# Function start_scanners()
+# ############################################
+
+def start_scanners(cur,home_dir,args):
+    """Start the scanners and wait until they are registered"""
+
+    env = dict(os.environ)
+    env.update({'HOME':home_dir,
+                'FAKE_NMAP_LATENCY':args.latency,
+                'FAKE_NMAP_STARTUP':str(args.startup),
+                'FAKE_NMAP_DOWN':str(args.down),
+                'FAKE_NMAP_PORTS':str(args.ports),
+                'FAKE_NMAP_HOPS':str(args.hops),
+                'FAKE_NMAP_SCRIPTS':str(args.scripts)})
+
+    devnull = open(os.devnull,'w')
+    scanners = []
+
+    for index in range(args.workers):
+        scanners.append(subprocess.Popen([sys.executable,NMAP2DB_SCAN],env=env,stdout=devnull,stderr=subprocess.STDOUT))
+
+    pids = [scanner.pid for scanner in scanners]
+    timeout = time.time() + 60
+
+    while time.time() < timeout:
+        cur.execute("SELECT count(*) FROM scanner_worker WHERE status = 'running' AND pid = ANY(%s)",(pids,))
+
+        if cur.fetchone()[0] == len(scanners):
+            return scanners
+
+        if [scanner for scanner in scanners if scanner.poll() != None]:
+            break
+
+        time.sleep(0.2)
+
+    stop_scanners(scanners)
+    raise RuntimeError('The scanners could not start, see the log in %s' % home_dir)
+
+
+# ############################################
+# Function stop_scanners()
+# ############################################
+
+def stop_scanners(scanners):
+    """Stop the scanners and wait until they are done"""
+
+    for scanner in scanners:
+        if scanner.poll() == None:
+            scanner.send_signal(signal.SIGTERM)
+
+    timeout = time.time() + 30
+
+    for scanner in scanners:
+        while scanner.poll() == None and time.time() < timeout:
+            time.sleep(0.1)
+
+        if scanner.poll() == None:
+            scanner.kill()
+            scanner.wait()
+
+
+# ############################################
+# Function run_benchmark()
+# ############################################
+
+def run_benchmark(dsn,home_dir,args):
+    """Scan the network of the benchmark with N scanners and return the results"""
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    scanners = []
+
+    try:
+        prepare_database(cur,args.network)
+        scanners = start_scanners(cur,home_dir,args)
+
+        #
+        # The scanners are idle, waiting for a notification.
+        #
+
+        time.sleep(1)
+
+        stats_before = get_database_stats(cur)
+
+        started = time.time()
+        cur.execute("SELECT register_scan_job(%s,%s,'1 day',true)",(args.network,args.scan_id))
+        cur.execute('SELECT id FROM scan_job WHERE network_addr = %s AND scan_id = %s',(args.network,args.scan_id))
+        scan_job_id = cur.fetchone()[0]
+
+        active_backends = []
+        completed = False
+
+        while time.time() - started < args.timeout:
+            cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND state = 'active' AND pid <> pg_backend_pid()")
+            active_backends.append(cur.fetchone()[0])
+
+            cur.execute('SELECT last_completion IS NOT NULL FROM scan_job WHERE id = %s',(scan_job_id,))
+
+            if cur.fetchone()[0]:
+                completed = True
+                break
+
+            time.sleep(args.sample_interval)
+
+        elapsed = time.time() - started
+
+        stop_scanners(scanners)
+        stats_after = get_database_stats(cur)
+
+        cur.execute('SELECT extract(epoch FROM last_completion - registered) FROM scan_job WHERE id = %s',(scan_job_id,))
+        completion_seconds = cur.fetchone()[0]
+
+        cur.execute('SELECT extract(epoch FROM a.claimed - a.registered), '
+                    'extract(epoch FROM a.finished - a.claimed), '
+                    'extract(epoch FROM a.claimed - b.registered) '
+                    'FROM scan_job_unit a JOIN scan_job b ON a.scan_jobid = b.id '
+                    'WHERE a.scan_jobid = %s AND a.claimed IS NOT NULL',
+                    (scan_job_id,))
+
+        units = cur.fetchall()
+
+        cur.execute('SELECT count(*) FROM host_info WHERE hostaddr <<= %s',(args.network,))
+        hosts = cur.fetchone()[0]
+
+        cur.execute('SELECT count(*) FROM scan_report WHERE scan_jobid = %s',(scan_job_id,))
+        reports = cur.fetchone()[0]
+
+    finally:
+        stop_scanners(scanners)
+        conn.close()
+
+    if completion_seconds == None:
+        completion_seconds = elapsed
+
+    dispatch_latencies = sorted([float(unit[0]) for unit in units])
+    unit_latencies = sorted([float(unit[1]) for unit in units if unit[1] != None])
+    job_start_latency = None
+    transactions_per_host = None
+    active_backends_mean = None
+
+    if units:
+        job_start_latency = round(min([float(unit[2]) for unit in units]) * 1000,3)
+
+    database = {}
+
+    for name in DATABASE_STATS:
+        database[name] = stats_after[name] - stats_before[name]
+
+    if hosts > 0:
+        transactions_per_host = round(database['xact_commit'] / float(hosts),2)
+
+    if active_backends:
+        active_backends_mean = round(sum(active_backends) / float(len(active_backends)),2)
+
+    return {'scan_jobid':scan_job_id,
+            'completed':completed,
+            'hosts':hosts,
+            'reports':reports,
+            'work_units':len(units),
+            'completion_seconds':round(float(completion_seconds),3),
+            'hosts_per_second':round(hosts / float(completion_seconds),2),
+            'job_start_latency_ms':job_start_latency,
+            'dispatch_latency_ms_p50':percentile(dispatch_latencies,0.50),
+            'dispatch_latency_ms_p95':percentile(dispatch_latencies,0.95),
+            'dispatch_latency_ms_max':percentile(dispatch_latencies,1.0),
+            'unit_ms_p50':percentile(unit_latencies,0.50),
+            'unit_ms_p95':percentile(unit_latencies,0.95),
+            'database':database,
+            'transactions_per_host':transactions_per_host,
+            'active_backends_mean':active_backends_mean,
+            'active_backends_max':max(active_backends + [0])}
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='nmap2db end to end scanner benchmark')
+    parser.add_argument('--dsn',default=None,help='DSN (key=value format) of a test nmap2db database (default: throwaway instance)')
+    parser.add_argument('--pg-bindir',default=None,help='Directory with initdb, pg_ctl and psql (default: pg_config --bindir)')
+    parser.add_argument('--keep',action='store_true',help='Keep the temporary directories of the benchmark')
+    parser.add_argument('--workers',type=int,default=2,help='Number of nmap2db_scan processes')
+    parser.add_argument('--network',default='198.18.0.0/24',help='Network scanned, inside 198.18.0.0/15')
+    parser.add_argument('--scan-id',default='sS-sV-O',help='Scan definition of the scan job')
+    parser.add_argument('--max-parallel-hosts',type=int,default=8)
+    parser.add_argument('--hosts-per-nmap-run',type=int,default=1)
+    parser.add_argument('--work-unit-size',type=int,default=64)
+    parser.add_argument('--work-units-per-claim',type=int,default=1)
+    parser.add_argument('--max-idle-wait',type=int,default=60)
+    parser.add_argument('--client-side-ingest',action='store_true')
+    parser.add_argument('--latency',default='uniform:0.5,1.5',help='Latency distribution of fake_nmap per host, e.g. fixed:1, lognormal:2,0.5')
+    parser.add_argument('--startup',type=float,default=0.1,help='Seconds used by every fake_nmap run before the scan starts')
+    parser.add_argument('--down',type=float,default=0.0,help='Fraction of the hosts that are down')
+    parser.add_argument('--ports',type=int,default=10,help='Number of open ports per host')
+    parser.add_argument('--hops',type=int,default=5,help='Number of traceroute hops per host')
+    parser.add_argument('--scripts',type=int,default=0,help='Number of NSE script outputs per port and per host')
+    parser.add_argument('--timeout',type=int,default=3600,help='Maximum number of seconds waiting for the scan job')
+    parser.add_argument('--sample-interval',type=float,default=0.5,help='Seconds between the samples of the active backends')
+    parser.add_argument('--log-level',default='WARNING',help='Log level of the scanners')
+    parser.add_argument('--output',default=None,help='File where the results are written as JSON')
+    args = parser.parse_args()
+
+    home_dir = tempfile.mkdtemp(prefix='nmap2db_bench_home_')
+
+    try:
+        if args.dsn == None:
+            with throwaway_postgres(args.pg_bindir,keep=args.keep) as pg:
+                write_configuration(home_dir,pg.dsn,args)
+                result = run_benchmark(pg.dsn,home_dir,args)
+        else:
+            write_configuration(home_dir,args.dsn,args)
+            result = run_benchmark(args.dsn,home_dir,args)
+
+    finally:
+        if args.keep:
+            sys.stderr.write('[INFO]: Scanner configuration, spool and log kept in %s\n' % home_dir)
+        else:
+            shutil.rmtree(home_dir,ignore_errors=True)
+
+    result.update({'workers':args.workers,
+                   'network':args.network,
+                   'scan_id':args.scan_id,
+                   'max_parallel_hosts':args.max_parallel_hosts,
+                   'hosts_per_nmap_run':args.hosts_per_nmap_run,
+                   'work_unit_size':args.work_unit_size,
+                   'work_units_per_claim':args.work_units_per_claim,
+                   'client_side_ingest':args.client_side_ingest,
+                   'latency':args.latency,
+                   'startup':args.startup,
+                   'down':args.down,
+                   'ports_per_host':args.ports,
+                   'hops_per_host':args.hops,
+                   'scripts_per_port':args.scripts,
+                   'throwaway_instance':args.dsn == None,
+                   'timestamp':int(time.time())})
+
+    print json.dumps(result,sort_keys=True)
+    sys.stdout.flush()
+
+    if args.output != None:
+        f = open(args.output,'w')
+
+        try:
+            json.dump(result,f,sort_keys=True,indent=2)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# EXPLAIN checks of the queries of the nmap2db shell.
+#
+# The queries are built by the methods of nmap2db_db used by the
+# shell commands, and run with EXPLAIN (FORMAT JSON) instead of
+# being executed. The plans are checked for:
+#
+# * partition pruning: a query with a period of time only scans
+#                      the partitions of scan_report, host_info
+#                      and service_info of the months in the
+#                      period, and the DEFAULT partition if a
+#                      month of the period has no partition.
+# * index usage: the tables (or their partitions) used by the
+#                show_* queries are read with an index, the BRIN
+#                and partial indexes included, and never with a
+#                sequential scan.
+#
+# The plans are built with enable_seqscan = off, so a sequential
+# scan is only used if no index can be used by the query. With
+# the few rows of the synthetic reports the planner would
+# prefer a sequential scan anyway.
+#
+# By default the checks create a throwaway PostgreSQL instance
+# (pg_throwaway.py) with native partitioning
+# (sql/nmap2db_native_partitioning.sql) and some synthetic
+# reports. With --dsn they use an existing nmap2db database with
+# native partitioning, whose report tables are TRUNCATED if
+# --reports is not 0. Never use --dsn with a production nmap2db
+# database.
+#
+# Every check is printed as one JSON object. The exit code is 1
+# if a check fails.
+#
+# Example:
+#
+#   ./explain_checks.py --reports 50
+#
+
+import os
+import sys
+import json
+import logging
+import argparse
+import datetime
+
+import psycopg2
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from nmap2db.database import nmap2db_db
+from nmap2db.xml_report import get_report_id
+from nmap_xml_generator import *
+from pg_throwaway import *
+from bench_ingest_throughput import prepare_database
+
+PARTITIONED_TABLES = ['scan_report','host_info','service_info']
+
+CHECK_PORTS = ['22','80','443']
+
+
+#
+# Class: explain_logs
+#
+# nmap2db_db only uses the logger of its logs object.
+#
+
+class explain_logs():
+    """This class is the logs object of explain_db"""
+
+    def __init__(self):
+        """ The Constructor."""
+
+        self.logger = logging.getLogger('explain_checks')
+
+
+#
+# Class: explain_db
+#
+# This class runs the queries of nmap2db_db with EXPLAIN and
+# keeps their plans instead of printing their results.
+#
+
+class explain_db(nmap2db_db):
+    """This class gets the plans of the queries of the nmap2db shell"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, dsn):
+        """ The Constructor."""
+
+        nmap2db_db.__init__(self,dsn,explain_logs(),'explain_checks')
+
+        self.plans = []
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def pg_connect(self):
+        """Connect to the database without sequential scans"""
+
+        with self.lock:
+            if self.conn and not self.conn.closed:
+                return
+
+            nmap2db_db.pg_connect(self)
+            self.cur.execute('SET enable_seqscan = off')
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def execute_query(self,query,parameters=None,retry=True):
+        """Get the plan of a query"""
+
+        cur = nmap2db_db.execute_query(self,'EXPLAIN (FORMAT JSON) ' + query,parameters,retry)
+        plan = cur.fetchone()[0]
+
+        if isinstance(plan,basestring):
+            plan = json.loads(plan)
+
+        self.plans.append(plan[0]['Plan'])
+
+        return cur
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def print_results(self,cur,colnames,left_columns):
+        """The results of EXPLAIN are not printed"""
+
+        pass
+
+
+# ############################################
+# Function get_plan_nodes()
+# ############################################
+
+def get_plan_nodes(plan):
+    """Get all the nodes of a plan"""
+
+    nodes = [plan]
+
+    for subplan in plan.get('Plans',[]):
+        nodes.extend(get_plan_nodes(subplan))
+
+    return nodes
+
+
+# ############################################
+# Function get_months()
+# ############################################
+
+def get_months(from_timestamp,to_timestamp):
+    """Get the first day of every month in a period"""
+
+    months = []
+    month = datetime.date(from_timestamp.year,from_timestamp.month,1)
+
+    while month <= to_timestamp.date():
+        months.append(month)
+        month = datetime.date(month.year + month.month / 12,month.month % 12 + 1,1)
+
+    return months
+
+
+# ############################################
+# Function get_partitions()
+# ############################################
+
+def get_partitions(cur,table):
+    """Get the names of the partitions of a table"""
+
+    cur.execute('SELECT b.relname FROM pg_inherits a JOIN pg_class b ON b.oid = a.inhrelid WHERE a.inhparent = %s::regclass',(table,))
+
+    return set([row[0] for row in cur.fetchall()])
+
+
+# ############################################
+# Function check_partition_pruning()
+# ############################################
+
+def check_partition_pruning(cur,name,plans,from_timestamp,to_timestamp):
+    """Check that the plans only scan the partitions of a period"""
+
+    scanned = set()
+
+    for plan in plans:
+        for node in get_plan_nodes(plan):
+            if 'Relation Name' in node:
+                scanned.add(node['Relation Name'])
+
+    results = []
+
+    for table in PARTITIONED_TABLES:
+        partitions = get_partitions(cur,table)
+        table_scanned = set([relation for relation in scanned if relation in partitions])
+
+        if not table_scanned:
+            continue
+
+        expected = set()
+
+        for month in get_months(from_timestamp,to_timestamp):
+            partition = '%s_%s' % (table,month.strftime('%Y_%m'))
+
+            if partition in partitions:
+                expected.add(partition)
+            else:
+                expected.add(table + '_default')
+
+        results.append({'check':'partition_pruning',
+                        'query':name,
+                        'table':table,
+                        'from':str(from_timestamp),
+                        'to':str(to_timestamp),
+                        'partitions':len(partitions),
+                        'scanned':sorted(table_scanned),
+                        'expected':sorted(expected),
+                        'ok':table_scanned <= expected})
+
+    return results
+
+
+# ############################################
+# Function check_index_usage()
+# ############################################
+
+def check_index_usage(cur,name,plans,tables):
+    """Check that the plans do not use a sequential scan to read a table"""
+
+    relations = {}
+
+    for table in tables:
+        relations[table] = table
+
+        for partition in get_partitions(cur,table):
+            relations[partition] = table
+
+    scans = {}
+    indexes = set()
+
+    for plan in plans:
+        for node in get_plan_nodes(plan):
+            if node.get('Relation Name') in relations:
+                scans.setdefault(relations[node['Relation Name']],set()).add(node['Node Type'])
+
+            if 'Index Name' in node:
+                indexes.add(node['Index Name'])
+
+    results = []
+
+    for table in tables:
+        if table not in scans:
+            continue
+
+        results.append({'check':'index_usage',
+                        'query':name,
+                        'table':table,
+                        'scans':sorted(scans[table]),
+                        'indexes':sorted(indexes),
+                        'ok':'Seq Scan' not in scans[table]})
+
+    return results
+
+
+# ############################################
+# Function get_plans()
+# ############################################
+
+def get_plans(dsn,query):
+    """Get the plans of the queries run by a method of nmap2db_db"""
+
+    db = explain_db(dsn)
+
+    try:
+        query(db)
+    finally:
+        db.pg_close()
+
+    return db.plans
+
+
+# ############################################
+# Function save_reports()
+# ############################################
+
+def save_reports(dsn,num_reports,num_hosts):
+    """Save synthetic reports in the database"""
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    try:
+        prepare_database(cur,num_reports * num_hosts)
+
+        for index in range(num_reports):
+            xml_report = generate_nmap_report(num_hosts,20,5,index * num_hosts,index)
+            cur.execute('SELECT save_scan_report(NULL,%s,%s)',(xml_report,get_report_id(xml_report)))
+
+        for table in PARTITIONED_TABLES:
+            cur.execute('ANALYZE ' + table)
+
+    finally:
+        conn.close()
+
+
+# ############################################
+# Function run_checks()
+# ############################################
+
+def run_checks(dsn,args):
+    """Run all the checks and return the results"""
+
+    if args.reports > 0:
+        save_reports(dsn,args.reports,args.hosts)
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+
+    now = datetime.datetime.now()
+    next_month = datetime.datetime(now.year + now.month / 12,now.month % 12 + 1,1)
+
+    #
+    # The default period of the shell commands (the last 7 days)
+    # and a period inside the next month.
+    #
+
+    periods = [(now - datetime.timedelta(days=7),now),
+               (next_month + datetime.timedelta(days=1),next_month + datetime.timedelta(days=20))]
+
+    queries = [('show_port',lambda db, from_timestamp, to_timestamp: db.show_ports(None,None,None,from_timestamp,to_timestamp)),
+               ('show_os',lambda db, from_timestamp, to_timestamp: db.show_os(None,None,from_timestamp,to_timestamp))]
+
+    results = []
+
+    try:
+        for from_timestamp, to_timestamp in periods:
+            for name, query in queries:
+                plans = get_plans(dsn,lambda db: query(db,from_timestamp,to_timestamp))
+                results.extend(check_partition_pruning(cur,name,plans,from_timestamp,to_timestamp))
+
+        #
+        # A report and a host saved in the database are used
+        # by the queries that need them.
+        #
+
+        cur.execute('SELECT report_id, host(hostaddr) FROM host_info LIMIT 1')
+        report_id, host = cur.fetchone() or ('0' * 32,get_host_address(0))
+
+        from_timestamp, to_timestamp = periods[0]
+
+        index_queries = [('show_port',['service_info','host_info'],lambda db: db.show_ports(None,CHECK_PORTS,None,from_timestamp,to_timestamp)),
+                         ('show_os',['host_info'],lambda db: db.show_os(None,None,from_timestamp,to_timestamp)),
+                         ('show_host_reports',['host_info','scan_report'],lambda db: db.show_host_reports(host,from_timestamp,to_timestamp)),
+                         ('show_host_details',['host_info'],lambda db: db.show_host_details(report_id)),
+                         ('show_services_details',['service_info'],lambda db: db.show_services_details(report_id)),
+                         ('show_host_without_hostname',['host_info'],lambda db: db.show_host_without_hostname()),
+                         ('show_current_port',['service_current','host_current'],lambda db: db.show_current_ports(None,CHECK_PORTS,None))]
+
+        for name, tables, query in index_queries:
+            results.extend(check_index_usage(cur,name,get_plans(dsn,query),tables))
+
+    finally:
+        conn.close()
+
+    return results
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='nmap2db EXPLAIN checks')
+    parser.add_argument('--dsn',default=None,help='DSN of a test nmap2db database with native partitioning (default: throwaway instance)')
+    parser.add_argument('--pg-bindir',default=None,help='Directory with initdb, pg_ctl and psql (default: pg_config --bindir)')
+    parser.add_argument('--keep',action='store_true',help='Keep the data directory of the throwaway instance')
+    parser.add_argument('--reports',type=int,default=20,help='Number of synthetic reports saved before the checks. Report tables are truncated if it is not 0')
+    parser.add_argument('--hosts',type=int,default=16,help='Number of hosts per report')
+    args = parser.parse_args()
+
+    if args.dsn == None:
+        with throwaway_postgres(args.pg_bindir,keep=args.keep,sql_files=[NATIVE_PARTITIONING_SQL]) as pg:
+            results = run_checks(pg.dsn,args)
+    else:
+        results = run_checks(args.dsn,args)
+
+    for result in results:
+        print json.dumps(result,sort_keys=True)
+
+    if not results or not all([result['ok'] for result in results]):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
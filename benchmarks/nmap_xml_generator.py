@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Synthetic nmap XML report generator.
+#
+# It generates reports with the same structure as the output of
+# "nmap -sV -O -sC --traceroute -oX -": hosts with hostnames, OS
+# matches, ports with services, NSE script output and traceroute
+# hops. The reports are deterministic for a given seed, so the
+# same reports can be used to compare different versions of the
+# ingest code.
+#
+# The hosts are taken from the network 198.18.0.0/15 (RFC 2544
+# benchmarking range).
+#
+# Example:
+#
+#   ./nmap_xml_generator.py --hosts 16 --ports 1000 --hops 8 > report.xml
+#   ./nmap_xml_generator.py --hosts 16 --ports 20 --os-matches 5 --scripts 2 > report.xml
+#
+
+import sys
+import random
+import argparse
+
+from xml.sax.saxutils import quoteattr
+
+BENCHMARK_NETWORK = '198.18.0.0/15'
+
+SERVICES = [('ssh','OpenSSH','6.6.1p1','protocol 2.0'),
+            ('http','Apache httpd','2.4.7','(Ubuntu)'),
+            ('https','nginx','1.4.6',None),
+            ('smtp','Postfix smtpd',None,None),
+            ('domain','ISC BIND','9.9.5',None),
+            ('postgresql','PostgreSQL DB','9.3.4',None),
+            ('ms-wbt-server','Microsoft Terminal Services',None,None)]
+
+OS_CLASSES = [('general purpose','Linux','Linux','3.X'),
+              ('general purpose','Microsoft','Windows','2012'),
+              ('router','Cisco','IOS','12.X'),
+              ('general purpose','FreeBSD','FreeBSD','10.X')]
+
+SCRIPTS = ['ssh-hostkey','http-title','http-server-header','ssl-cert','banner','smtp-commands']
+
+HOST_SCRIPTS = ['clock-skew','smb-os-discovery','nbstat']
+
+
+# ############################################
+# Function generate_script()
+#
+# The output of a NSE script, with the same
+# attributes and <elem> values nmap writes.
+# ############################################
+
+def generate_script(rand,script_id):
+    """Generate the XML of a script element"""
+
+    fingerprint = ''.join(['%02x' % rand.randint(0,255) for index in range(16)])
+    output = '\n  %s %s (%s)\n' % (script_id,fingerprint,rand.choice(['RSA','ECDSA','text/html; charset=UTF-8','CN=www.example.com']))
+
+    return '<script id=%s output=%s><elem key="fingerprint">%s</elem><elem key="bits">%s</elem></script>' % (quoteattr(script_id),quoteattr(output),fingerprint,rand.choice([256,1024,2048,4096]))
+
+
+# ############################################
+# Function get_host_address()
+# ############################################
+
+def get_host_address(index):
+    """Get the IP of host number index in the benchmark network"""
+
+    index += 1
+    return '198.%s.%s.%s' % (18 + index / 65536,(index / 256) % 256,index % 256)
+
+
+# ############################################
+# Function generate_host()
+# ############################################
+
+def generate_host(rand,hostaddr,num_ports,num_hops,starttime,num_os_matches=3,num_scripts=0):
+    """Generate the XML of a host element"""
+
+    lines = []
+
+    lines.append('<host starttime="%s" endtime="%s"><status state="up" reason="echo-reply" reason_ttl="61"/>' % (starttime,starttime + rand.randint(5,120)))
+    lines.append('<address addr="%s" addrtype="ipv4"/>' % hostaddr)
+    lines.append('<address addr="52:54:00:%02X:%02X:%02X" addrtype="mac" vendor="QEMU virtual NIC"/>' % (rand.randint(0,255),rand.randint(0,255),rand.randint(0,255)))
+    lines.append('<hostnames>')
+    lines.append('<hostname name="host-%s.Example.com" type="PTR"/>' % hostaddr.replace('.','-'))
+    lines.append('<hostname name="Alias-%s.Example.com" type="user"/>' % rand.randint(1,1000))
+    lines.append('</hostnames>')
+
+    lines.append('<ports><extraports state="closed" count="%s"><extrareasons reason="resets" count="%s"/></extraports>' % (65535 - num_ports,65535 - num_ports))
+
+    for port_id in sorted(rand.sample(xrange(1,65536),num_ports)):
+        name, product, version, extrainfo = rand.choice(SERVICES)
+
+        service = '<service name=%s product=%s' % (quoteattr(name),quoteattr(product))
+
+        if version != None:
+            service += ' version=%s' % quoteattr(version)
+
+        if extrainfo != None:
+            service += ' extrainfo=%s' % quoteattr(extrainfo)
+
+        service += ' method="probed" conf="10"/>'
+
+        scripts = ''.join([generate_script(rand,rand.choice(SCRIPTS)) for index in range(num_scripts)])
+
+        lines.append('<port protocol="tcp" portid="%s"><state state="open" reason="syn-ack" reason_ttl="61"/>%s%s</port>' % (port_id,service,scripts))
+
+    lines.append('</ports>')
+
+    lines.append('<os><portused state="open" proto="tcp" portid="22"/>')
+
+    for index in range(num_os_matches):
+        ostype, vendor, osfamily, osgen = rand.choice(OS_CLASSES)
+        accuracy = max(100 - index * 5,50)
+
+        lines.append('<osmatch name=%s accuracy="%s" line="%s">' % (quoteattr('%s %s %s' % (vendor,osfamily,osgen)),accuracy,rand.randint(1,60000)))
+        lines.append('<osclass type=%s vendor=%s osfamily=%s osgen=%s accuracy="%s"><cpe>cpe:/o:%s</cpe></osclass>' % (quoteattr(ostype),quoteattr(vendor),quoteattr(osfamily),quoteattr(osgen),accuracy,osfamily.lower()))
+        lines.append('</osmatch>')
+
+    lines.append('</os>')
+
+    if num_scripts > 0:
+        lines.append('<hostscript>%s</hostscript>' % ''.join([generate_script(rand,rand.choice(HOST_SCRIPTS)) for index in range(num_scripts)]))
+
+    if num_hops > 0:
+        lines.append('<trace port="22" proto="tcp">')
+
+        for ttl in range(1,num_hops):
+            lines.append('<hop ttl="%s" ipaddr="10.%s.%s.1" rtt="%s.%s" host="Router-%s.Example.net"/>' % (ttl,ttl,rand.randint(0,3),ttl,rand.randint(0,99),ttl))
+
+        lines.append('<hop ttl="%s" ipaddr="%s" rtt="%s.00"/>' % (num_hops,hostaddr,num_hops))
+        lines.append('</trace>')
+
+    lines.append('<times srtt="1000" rttvar="500" to="100000"/>')
+    lines.append('</host>')
+
+    return '\n'.join(lines)
+
+
+# ############################################
+# Function generate_nmap_report()
+# ############################################
+
+def generate_nmap_report(num_hosts=1,num_ports=10,num_hops=5,first_host=0,seed=0,num_os_matches=3,num_scripts=0,hosts=None,starttime=None):
+    """Generate a nmap XML report"""
+
+    rand = random.Random(seed)
+
+    if starttime == None:
+        starttime = 1400000000 + seed
+
+    #
+    # The hosts of the report are taken from the benchmark
+    # network if they are not defined.
+    #
+
+    if hosts == None:
+        hosts = [get_host_address(first_host + index) for index in range(num_hosts)]
+    else:
+        num_hosts = len(hosts)
+
+    lines = []
+
+    lines.append('<?xml version="1.0"?>')
+    lines.append('<nmaprun scanner="nmap" args="nmap -sV -O%s --traceroute -oX - %s" start="%s" startstr="" version="6.40" xmloutputversion="1.04">' % (num_scripts > 0 and ' -sC' or '',' '.join(hosts),starttime))
+    lines.append('<scaninfo type="syn" protocol="tcp" numservices="65535" services="1-65535"/>')
+    lines.append('<verbose level="0"/>')
+    lines.append('<debugging level="0"/>')
+
+    for hostaddr in hosts:
+        lines.append(generate_host(rand,hostaddr,num_ports,num_hops,starttime,num_os_matches,num_scripts))
+
+    lines.append('<runstats><finished time="%s" timestr="" elapsed="%s.42" exit="success"/><hosts up="%s" down="0" total="%s"/></runstats>' % (starttime + 600,600,num_hosts,num_hosts))
+    lines.append('</nmaprun>')
+
+    return '\n'.join(lines) + '\n'
+
+
+# ############################################
+# Function main()
+# ############################################
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Synthetic nmap XML report generator')
+    parser.add_argument('--hosts',type=int,default=1,help='Number of hosts in the report')
+    parser.add_argument('--ports',type=int,default=10,help='Number of open ports per host')
+    parser.add_argument('--hops',type=int,default=5,help='Number of traceroute hops per host')
+    parser.add_argument('--os-matches',type=int,default=3,help='Number of OS matches per host')
+    parser.add_argument('--scripts',type=int,default=0,help='Number of NSE script outputs per port and per host')
+    parser.add_argument('--first-host',type=int,default=0,help='Number of the first host in the benchmark network')
+    parser.add_argument('--seed',type=int,default=0,help='Seed of the random values')
+    args = parser.parse_args()
+
+    sys.stdout.write(generate_nmap_report(args.hosts,args.ports,args.hops,args.first_host,args.seed,args.os_matches,args.scripts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Throwaway PostgreSQL instance for the benchmarks.
+#
+# A new cluster is created with initdb in a temporary directory,
+# started on a free port that only listens on a unix socket in
+# the same directory, and the nmap2db database is installed with
+# sql/nmap2db.sql and the SQL files defined with sql_files, e.g.
+# sql/nmap2db_native_partitioning.sql. The cluster is stopped and
+# deleted when the benchmark is done.
+#
+# The PostgreSQL programs (initdb, pg_ctl and psql) are taken
+# from --pg-bindir, from "pg_config --bindir" or from the PATH.
+#
+# Example:
+#
+#   with throwaway_postgres() as pg:
+#       conn = psycopg2.connect(pg.dsn)
+#
+
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import subprocess
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','sql')
+
+NMAP2DB_SQL = os.path.join(SQL_DIR,'nmap2db.sql')
+NATIVE_PARTITIONING_SQL = os.path.join(SQL_DIR,'nmap2db_native_partitioning.sql')
+
+
+# ############################################
+# Function get_pg_bindir()
+# ############################################
+
+def get_pg_bindir():
+    """Get the directory with the PostgreSQL programs"""
+
+    try:
+        return subprocess.check_output(['pg_config','--bindir']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+# ############################################
+# Function get_free_port()
+# ############################################
+
+def get_free_port():
+    """Get a TCP port that is not used"""
+
+    s = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+
+    try:
+        s.bind(('127.0.0.1',0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+#
+# Class: throwaway_postgres
+#
+# This class creates, starts, stops and deletes a PostgreSQL
+# cluster with the nmap2db database. It can be used in a with
+# statement.
+#
+
+class throwaway_postgres():
+    """This class is a temporary PostgreSQL instance with the nmap2db database"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, pg_bindir=None, settings=None, keep=False, sql_files=None):
+        """ The Constructor."""
+
+        if pg_bindir == None:
+            pg_bindir = get_pg_bindir()
+
+        self.pg_bindir = pg_bindir
+        self.settings = settings or {}
+        self.keep = keep
+        self.sql_files = [NMAP2DB_SQL] + (sql_files or [])
+        self.base_dir = None
+        self.data_dir = None
+        self.port = None
+        self.dsn = None
+        self.devnull = open(os.devnull,'w')
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def __enter__(self):
+        try:
+            self.start()
+        except:
+            self.stop()
+            raise
+
+        return self
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def command(self, program, *args):
+        """Run a PostgreSQL program"""
+
+        subprocess.check_call([os.path.join(self.pg_bindir,program)] + list(args),stdout=self.devnull,stderr=subprocess.STDOUT)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def start(self):
+        """Create and start the instance and install the nmap2db database"""
+
+        self.base_dir = tempfile.mkdtemp(prefix='nmap2db_bench_')
+        self.data_dir = os.path.join(self.base_dir,'data')
+        self.port = get_free_port()
+
+        self.command('initdb','-D',self.data_dir,'-U','postgres','-A','trust','-E','UTF8','--no-locale')
+
+        options = "-p %s -k %s -c listen_addresses=''" % (self.port,self.base_dir)
+
+        for name in sorted(self.settings.keys()):
+            options += " -c %s=%s" % (name,self.settings[name])
+
+        self.command('pg_ctl','-D',self.data_dir,'-l',os.path.join(self.base_dir,'postgresql.log'),'-o',options,'-w','start')
+
+        for sql_file in self.sql_files:
+            self.command('psql','-h',self.base_dir,'-p',str(self.port),'-U','postgres','-d','postgres',
+                         '-q','-X','-v','ON_ERROR_STOP=1','-f',sql_file)
+
+        self.dsn = 'host=%s port=%s dbname=nmap2db user=postgres' % (self.base_dir,self.port)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def stop(self):
+        """Stop and delete the instance"""
+
+        if self.base_dir == None:
+            return
+
+        if os.path.exists(os.path.join(self.data_dir,'postmaster.pid')):
+            self.command('pg_ctl','-D',self.data_dir,'-m','fast','-w','stop')
+
+        if self.keep:
+            sys.stderr.write('[INFO]: PostgreSQL data directory kept in %s\n' % self.data_dir)
+        else:
+            shutil.rmtree(self.base_dir,ignore_errors=True)
+
+        self.base_dir = None
@@ -0,0 +1,42 @@
+-- --------------------------------------------------
+-- NMAP2DB
+--
+-- @File:
+-- legacy_indexes.sql
+--
+-- @Description:
+-- The indexes of scan_report, host_info, service_info,
+-- host_current and service_current used before the BRIN and
+-- partial indexes: a btree index on every timestamp and on
+-- the low-cardinality columns. bench_ingest_throughput.py
+-- drops the indexes of these tables, except the primary keys,
+-- and creates these ones, to compare the ingest time and the
+-- size of both sets of indexes. The original indexes are
+-- created again at the end.
+--
+-- Do not load this file in a nmap2db database.
+-- --------------------------------------------------
+
+CREATE INDEX scan_report_registered_idx ON scan_report(registered);
+CREATE INDEX scan_report_started_idx ON scan_report(started);
+CREATE INDEX scan_report_finished_idx ON scan_report(finished);
+CREATE INDEX scan_report_elapsed_time_idx ON scan_report(elapsed_time);
+
+CREATE INDEX host_info_registered_idx ON host_info(registered);
+CREATE INDEX host_info_scan_started_idx ON host_info(scan_started);
+CREATE INDEX host_info_scan_finished_idx ON host_info(scan_finished);
+CREATE INDEX host_info_hostaddr_idx ON host_info(hostaddr);
+CREATE INDEX host_info_state_idx ON host_info(state);
+
+CREATE INDEX host_current_state_idx ON host_current(state);
+
+CREATE INDEX service_info_registered_idx ON service_info(registered);
+CREATE INDEX service_info_hostaddr_idx ON service_info(hostaddr);
+CREATE INDEX service_info_port_protocol_idx ON service_info(port_protocol);
+CREATE INDEX service_info_port_id_idx ON service_info(port_id);
+CREATE INDEX service_info_port_state_idx ON service_info(port_state);
+CREATE INDEX service_info_service_idx ON service_info(service);
+
+CREATE INDEX service_current_port_id_idx ON service_current(port_id);
+CREATE INDEX service_current_port_state_idx ON service_current(port_state);
+CREATE INDEX service_current_service_idx ON service_current(service);
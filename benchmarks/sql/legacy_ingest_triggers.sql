@@ -0,0 +1,257 @@
+-- --------------------------------------------------
+-- NMAP2DB
+--
+-- @File: 
+-- legacy_ingest_triggers.sql
+--
+-- @Description: 
+-- The versions of save_scan_report() (lowercase of the whole
+-- report) and of the xpath() based trigger functions 
+-- extract_report_values() and extract_hosts_and_services_values()
+-- used before the XMLTABLE versions. bench_report_ingest.py 
+-- installs them inside a transaction that is rolled back, to 
+-- compare the ingest time of both versions.
+--
+-- Do not load this file in a nmap2db database.
+-- --------------------------------------------------
+
+-- ------------------------------------------------------------
+-- Function: extract_report_values()
+--
+-- ------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION extract_report_values() RETURNS TRIGGER 
+LANGUAGE plpgsql 
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+    BEGIN
+       --
+       -- This function can be used by a trigger to extract information from a XML report
+       -- from a NMAP scaning. The information extracted is used to update some attributes
+       -- in the table scan_report.
+       --	    
+       -- If nmap2db.client_side_ingest is 'on', nmap2db_scan has already
+       -- extracted these values.
+       --
+
+       IF current_setting('nmap2db.client_side_ingest',true) = 'on' THEN
+          RETURN NEW;
+       END IF;
+
+       NEW.report_id := md5(NEW.xmlreport::text);
+       NEW.started := to_timestamp((xpath('/nmaprun/@start', NEW.xmlreport))[1]::text::integer);
+       NEW.finished := to_timestamp((xpath('/nmaprun/runstats/finished/@time', NEW.xmlreport))[1]::text::integer);
+       NEW.elapsed_time := (xpath('/nmaprun/runstats/finished/@elapsed', NEW.xmlreport))[1]::text::numeric;
+       NEW.scan_type := (xpath('/nmaprun/scaninfo/@type', NEW.xmlreport))[1]::text;
+       NEW.scan_protocol := (xpath('/nmaprun/scaninfo/@protocol', NEW.xmlreport))[1]::text;
+       NEW.scan_numservices := (xpath('/nmaprun/scaninfo/@numservices', NEW.xmlreport))[1]::text::integer;
+       NEW.nmap_args := (xpath('/nmaprun/@args', NEW.xmlreport))[1]::text;
+       NEW.nmap_version :=  (xpath('/nmaprun/@version', NEW.xmlreport))[1]::text;
+       NEW.xmloutputversion :=  (xpath('/nmaprun/@xmloutputversion', NEW.xmlreport))[1]::text;
+       NEW.host_up := (xpath('/nmaprun/runstats/hosts/@up', NEW.xmlreport))[1]::text::integer;
+       NEW.host_down := (xpath('/nmaprun/runstats/hosts/@down', NEW.xmlreport))[1]::text::integer;
+       NEW.host_total := (xpath('/nmaprun/runstats/hosts/@total', NEW.xmlreport))[1]::text::integer;
+
+       RETURN NEW;
+    END;
+$$;
+
+
+
+-- ------------------------------------------------------------
+-- Function: extract_host_and_services_values()
+--
+-- ------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION extract_hosts_and_services_values() RETURNS TRIGGER 
+LANGUAGE plpgsql 
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+ DECLARE
+  hosts_scanned RECORD;
+  services_scanned RECORD;
+  traceroute_hops INTEGER;
+  loop_ INTEGER;
+  check_hostaddr INTEGER;
+  hostaddr_ INET;
+  hostname_ TEXT;
+  adjacent_hostaddr_ INET;
+  adjacent_hostname_ TEXT;
+  is_adjacent_a_router_ BOOLEAN;		     
+  hops XML [];
+  
+    BEGIN
+      --
+      -- This function can be used by a trigger to extract information from a XML report
+      -- from a NMAP scaning. The information extracted is used to update some attributes
+      -- in the tables host_info, service_info and network_topology.
+      --
+      -- This function is executed everytime a new report is saved in the table scan_report.
+      -- If the report delivers traceroute information, the table network_topology gets
+      -- updated if necessary.
+      --
+      -- If nmap2db.client_side_ingest is 'on', nmap2db_scan saves these
+      -- values itself with COPY.
+      --
+
+    IF current_setting('nmap2db.client_side_ingest',true) = 'on' THEN
+       RETURN NULL;
+    END IF;
+
+    -- 
+    -- Main loop. We get all the hosts in the report.
+    --
+
+    FOR hosts_scanned IN SELECT host_scanned::xml FROM (SELECT unnest(xpath('//host', NEW.xmlreport)) AS host_scanned) AS foo LOOP
+
+    	EXECUTE 'INSERT INTO host_info (report_id,
+			     	        scan_jobid,
+     				        scan_started,
+				        scan_finished,
+				        hostaddr,
+				        addrtype,
+				        hostname,
+				        hostname_type,
+					osclass_type,
+					osclass_vendor,
+					osclass_osfamily,
+					osclass_osgen,
+					osclass_accuracy,
+					osmatch_name,
+					osmatch_accuracy,
+				        state,
+				        state_reason)
+                 VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17)'
+
+        USING NEW.report_id,
+	      NEW.scan_jobid,
+	      to_timestamp((xpath('/host/@starttime', hosts_scanned.host_scanned))[1]::text::integer),
+	      to_timestamp((xpath('/host/@endtime', hosts_scanned.host_scanned))[1]::text::integer), 	     
+	      (xpath('/host/address/@addr', hosts_scanned.host_scanned))[1]::text::inet,
+	      (xpath('/host/address/@addrtype', hosts_scanned.host_scanned))[1]::text,
+	      (xpath('/host/hostnames/hostname/@name', hosts_scanned.host_scanned)),
+	      (xpath('/host/hostnames/hostname/@type', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/osclass/@type', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/osclass/@vendor', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/osclass/@osfamily', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/osclass/@osgen', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/osclass/@accuracy', hosts_scanned.host_scanned))::text[]::integer[],
+	      (xpath('/host/os/osmatch/@name', hosts_scanned.host_scanned)),
+	      (xpath('/host/os/osmatch/@accuracy', hosts_scanned.host_scanned))::text[]::integer[],
+	      (xpath('/host/status/@state', hosts_scanned.host_scanned))[1]::text,
+	      (xpath('/host/status/@reason', hosts_scanned.host_scanned))[1]::text;
+
+	 --
+	 -- Service loop. We get all the services for a host
+	 --
+
+         FOR services_scanned IN SELECT service_scanned::xml FROM (SELECT unnest(xpath('//ports/port',hosts_scanned.host_scanned)) AS service_scanned) AS foo2 LOOP   	
+
+
+             EXECUTE 'INSERT INTO service_info (report_id,
+	     	     	     	  	        scan_jobid,
+				                hostaddr,
+                                                port_protocol,
+				                port_id,
+				                port_state,
+				                port_state_reason,
+				                service,
+				                service_method,
+				                service_product,
+ 				                service_product_version,
+ 				                service_product_extrainfo
+				               )
+	              VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12)'
+
+            USING NEW.report_id,
+	    	  NEW.scan_jobid,
+		  (xpath('/host/address/@addr', hosts_scanned.host_scanned))[1]::text::inet,
+	          (xpath('/port/@protocol', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/@portid', services_scanned.service_scanned))[1]::text::integer,
+	          (xpath('/port/state/@state', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/state/@reason', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/service/@name', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/service/@method', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/service/@product', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/service/@version', services_scanned.service_scanned))[1]::text,
+	          (xpath('/port/service/@extrainfo', services_scanned.service_scanned))[1]::text;
+
+	  END LOOP;
+
+ 	 --
+	 -- If the host has status up and traceroute information, the table network_topology gets
+      	 -- updated if necessary
+	 --
+
+	 IF (xpath('/host/status/@state', hosts_scanned.host_scanned))[1]::text = 'up' THEN
+
+	   traceroute_hops := array_length(xpath('/host/trace/*',hosts_scanned.host_scanned),1);
+
+	   IF traceroute_hops > 1 THEN
+
+	         FOR loop_ IN 1..(traceroute_hops) LOOP
+		  hops[loop_]:= (xpath('/host/trace/*',hosts_scanned.host_scanned))[loop_];
+		 END LOOP;
+	   
+	 	 FOR loop_ IN 1..(traceroute_hops-1) LOOP
+	     
+	          hostaddr_:= unnest(xpath('/hop/@ipaddr',hops[loop_]))::text::inet;
+		  hostname_ :=  unnest(xpath('/hop/@host',hops[loop_]))::text;
+	     	  adjacent_hostaddr_ :=  unnest(xpath('/hop/@ipaddr',hops[loop_+1]))::text::inet;
+		  adjacent_hostname_ :=  unnest(xpath('/hop/@host',hops[loop_+1]))::text;
+		  
+		  IF loop_ != (traceroute_hops-1) THEN
+		    is_adjacent_a_router_ := TRUE;  
+		  ELSIF loop_ = (traceroute_hops-1) THEN
+		    is_adjacent_a_router_ := FALSE;	  
+		  END IF;
+
+	     	  SELECT cnt INTO check_hostaddr FROM (SELECT count(*) AS cnt FROM network_topology WHERE hostaddr = hostaddr_ AND adjacent_hostaddr = adjacent_hostaddr_) AS foo3;
+
+	     	  IF check_hostaddr = 0 THEN	 
+		 		    
+	     	     EXECUTE 'INSERT INTO network_topology (hostaddr,hostname,adjacent_hostaddr,adjacent_hostname,is_adjacent_a_router) VALUES ($1,$2,$3,$4,$5)'
+                     USING hostaddr_, 
+		       	   hostname_,
+		           adjacent_hostaddr_,
+			   adjacent_hostname_,
+			   is_adjacent_a_router_;
+	          END IF;
+
+	 	 END LOOP;
+
+           END IF;
+          END IF;
+    END LOOP;
+    
+    RETURN NULL;
+    END;
+$$;
+
+
+-- ------------------------------------------------------------
+-- Function: save_scan_report()
+--
+-- The old version had only two parameters. report_id is 
+-- ignored, so both versions can be called the same way.
+-- ------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION save_scan_report(scan_jobid BIGINT, xmlreport XML, report_id TEXT DEFAULT NULL) RETURNS VOID
+LANGUAGE plpgsql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+BEGIN
+ --
+ -- This function saves in the database the XML report from a NMAP scan 
+ --
+
+  EXECUTE 'INSERT INTO scan_report (scan_jobid,xmlreport) VALUES ($1,$2)'
+  USING scan_jobid,
+  	lower(xmlreport::text)::xml;
+
+  RETURN;
+END;
+$$;
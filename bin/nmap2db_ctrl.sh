@@ -12,6 +12,8 @@
 # 
 # @Description: 
 # NMAP2DB control script. Used to start/stop the nmap2db
+# supervisor (nmap2db_supervisor), that runs and restarts the
+# nmap2db scanners
 #
 # Some nmap scans must be run as root. We recommend to run 
 # this script as 'root'
@@ -27,25 +29,64 @@ BINDIR="/usr/bin"
 
 execute_command(){
     
+    SUPERVISOR_PID=`pidof -x nmap2db_supervisor`
+
     case $COMMAND in
 	start)
 	    
-	    for SCANNER in `seq 1 $NUMBER_SCANNERS`
-	    do
-		echo "* Starting scanner num. $SCANNER"
-		$BINDIR/nmap2db_scan &
-		sleep 3;
-	    done
+	    if [ -n "$SUPERVISOR_PID" ]
+	    then
+		echo "* nmap2db_supervisor is already running with PID: ${SUPERVISOR_PID}"
+		exit 1
+	    fi
+
+	    SUPERVISOR_ARGS=""
+
+	    if [ -n "$NUMBER_SCANNERS" ]
+	    then
+		SUPERVISOR_ARGS="$SUPERVISOR_ARGS --min-scanners $NUMBER_SCANNERS"
+	    fi
+
+	    if [ -n "$MAX_SCANNERS" ]
+	    then
+		SUPERVISOR_ARGS="$SUPERVISOR_ARGS --max-scanners $MAX_SCANNERS"
+	    fi
+
+	    if [ -n "$METRICS_PORT" ]
+	    then
+		SUPERVISOR_ARGS="$SUPERVISOR_ARGS --metrics-port $METRICS_PORT"
+	    fi
+
+	    echo "* Starting nmap2db_supervisor"
+	    $BINDIR/nmap2db_supervisor $SUPERVISOR_ARGS > /dev/null 2>&1 &
 	    exit 0
 	    ;;
 	
 	stop)
-	    for PID in `pidof -x nmap2db_scan`;
+	    for PID in $SUPERVISOR_PID;
 	    do
 		kill -15 $PID
-		echo "* Scanner with PID: ${PID} stopped"
+		echo "* nmap2db_supervisor with PID: ${PID} stopping. It will stop when its scanners have finished their nmap processes"
 	    done
             exit 0;;
+
+	reload)
+	    for PID in $SUPERVISOR_PID;
+	    do
+		kill -1 $PID
+		echo "* nmap2db_supervisor with PID: ${PID} reloading. The scanners will be restarted when they have finished their nmap processes"
+	    done
+            exit 0;;
+
+	status)
+	    if [ -z "$SUPERVISOR_PID" ]
+	    then
+		echo "* nmap2db_supervisor is not running"
+		exit 3
+	    fi
+
+	    $BINDIR/nmap2db_supervisor --status
+            exit 0;;
     esac
     
 }
@@ -68,8 +109,10 @@ help(){
     echo
     echo "       -h Help"
     echo "       -v Version"
-    echo "       -c Command [start|stop] (*)"
-    echo "       -n Number of scanners"
+    echo "       -c Command [start|stop|reload|status] (*)"
+    echo "       -n Minimum number of scanners"
+    echo "       -x Maximum number of scanners"
+    echo "       -m First port used to export the metrics of the scanners"
     echo "       (*) - Must be defined"
     echo
     echo "Example: sudo `basename $0` -c start"
@@ -106,7 +149,7 @@ if [ $# -eq 0 ]
     exit 1   
 fi  
 
-while getopts "hvc:n:" Option
+while getopts "hvc:n:x:m:" Option
   do
   case $Option in
       h)
@@ -122,6 +165,12 @@ while getopts "hvc:n:" Option
 
       n)
 	  let NUMBER_SCANNERS=$OPTARG;;
+
+      x)
+	  let MAX_SCANNERS=$OPTARG;;
+
+      m)
+	  let METRICS_PORT=$OPTARG;;
 	  
   esac
 done
@@ -143,7 +192,7 @@ if [ -z "$COMMAND" ]
     exit 1
 fi
 
-if [ "$COMMAND" != "start" ] &&  [ "$COMMAND" != "stop" ] 
+if [ "$COMMAND" != "start" ] &&  [ "$COMMAND" != "stop" ] && [ "$COMMAND" != "reload" ] && [ "$COMMAND" != "status" ] 
     then
     echo
     echo "ERROR: This command is not supported"
@@ -152,16 +201,6 @@ if [ "$COMMAND" != "start" ] &&  [ "$COMMAND" != "stop" ]
     exit 1
 fi
 
-if [ -z "$NUMBER_SCANNERS" ] 
-    then
-    let NUMBER_SCANNERS=2
-fi
-
-if [ "$NUMBER_SCANNERS" -lt 2 ] 
-    then
-    let NUMBER_SCANNERS=2
-fi
-
 
 execute_command
 exit 0
@@ -197,6 +197,39 @@ class nmap2db_cli(cmd.Cmd):
             print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
             
 
+    # ############################################
+    # Method do_show_scanner_workers
+    # ############################################
+
+    def do_show_scanner_workers(self,args):
+        """
+        DESCRIPTION:
+        This command shows the scanners running and the scanners 
+        stopped in the last day, with their last heartbeat and the
+        work units they are running.
+        
+        COMMAND:
+        show_scanner_workers
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        if len(arg_list) == 0:
+            try:
+                self.db.show_scanner_workers()
+
+            except Exception as e:
+                print "\n[ERROR]: ",e
+                
+        else:
+            print "\n[ERROR] - This command does not accept parameters.\n          Type help or \? to list commands\n"
+            
+
     # ############################################
     # Method do_show_host_reports
     # ############################################
@@ -408,7 +441,7 @@ class nmap2db_cli(cmd.Cmd):
                 service_list_tmp = []
 
                 for service_tmp in service_list:
-                    service_list_tmp.append('%' + service_tmp + '%')
+                    service_list_tmp.append('%' + service_tmp.lower() + '%')
                     
                 service_list = service_list_tmp
 
@@ -458,7 +491,7 @@ class nmap2db_cli(cmd.Cmd):
                 service_list_tmp = []
 
                 for service_tmp in service_list:
-                    service_list_tmp.append('%' + service_tmp + '%')
+                    service_list_tmp.append('%' + service_tmp.lower() + '%')
                     
                 service_list = service_list_tmp
 
@@ -514,7 +547,7 @@ class nmap2db_cli(cmd.Cmd):
                 os_list_tmp = []
 
                 for os_tmp in os_list:
-                    os_list_tmp.append('%' + os_tmp + '%')
+                    os_list_tmp.append('%' + os_tmp.lower() + '%')
                     
                 os_list = os_list_tmp
             
@@ -557,7 +590,7 @@ class nmap2db_cli(cmd.Cmd):
                 os_list_tmp = []
 
                 for os_tmp in os_list:
-                    os_list_tmp.append('%' + os_tmp + '%')
+                    os_list_tmp.append('%' + os_tmp.lower() + '%')
                     
                 os_list = os_list_tmp
 
@@ -570,6 +603,146 @@ class nmap2db_cli(cmd.Cmd):
             print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
                  
 
+    # ############################################
+    # Method do_show_current_port
+    # ############################################
+
+    def do_show_current_port(self,args):
+        """
+        DESCRIPTION:
+        This command shows the ports/services found by the last 
+        scan of every host.
+        
+        COMMAND:
+        show_current_port [network, ...] [port, ...] [service, ...]
+        """
+                
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        if len(arg_list) == 0:
+            
+            print "--------------------------------------------------------"
+            networks = raw_input("# Networks CIDR [all]: ")
+            ports = str(raw_input("# Ports []: "))
+            services = raw_input("# Services []: ")
+            print "--------------------------------------------------------"
+
+        elif len(arg_list) == 3:
+            
+            networks = arg_list[0]
+            ports = arg_list[1]
+            services = arg_list[2]
+
+            if self.output_format == 'table':
+            
+                print "--------------------------------------------------------"
+                print "# Networks: " + networks
+                print "# Ports: " + str(ports)
+                print "# Services: " + services
+                print "--------------------------------------------------------"
+
+        else:
+            print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+            return False
+
+        if networks == '':
+            network_list = None
+        else:
+            network_list = networks.strip().replace(' ','').split(',')
+                
+        if ports == '':
+            port_list = None
+        else:
+            port_list = ports.strip().replace(' ','').split(',')
+
+        if services == '':
+            service_list = None
+        else:
+            service_list = services.split(',')
+            service_list_tmp = []
+
+            for service_tmp in service_list:
+                service_list_tmp.append('%' + service_tmp.lower() + '%')
+                    
+            service_list = service_list_tmp
+
+        try:
+            self.db.show_current_ports(network_list,port_list,service_list)
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
+
+    # ############################################
+    # Method do_show_current_os
+    # ############################################
+
+    def do_show_current_os(self,args):
+        """
+        DESCRIPTION:
+        This command shows the operative system found by the last 
+        scan of every host.
+        
+        COMMAND:
+        show_current_os [NETWORK][OS]
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        if len(arg_list) == 0:
+            
+            print "--------------------------------------------------------"
+            networks = raw_input("# Networks CIDR [all]: ")
+            osname = raw_input("# OSname []: ")
+            print "--------------------------------------------------------"
+
+        elif len(arg_list) == 2:
+            
+            networks = arg_list[0]
+            osname = arg_list[1]
+
+            if self.output_format == 'table':
+            
+                print "--------------------------------------------------------"
+                print "# Networks: " + networks
+                print "# OSname: " + osname
+                print "--------------------------------------------------------"
+
+        else:
+            print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+            return False
+
+        if networks == '':
+            network_list = None
+        else:
+            network_list = networks.strip().replace(' ','').split(',')
+                
+        if osname == '':
+            os_list = None
+        else:
+            os_list = osname.split(',')
+            os_list_tmp = []
+
+            for os_tmp in os_list:
+                os_list_tmp.append('%' + os_tmp.lower() + '%')
+                    
+            os_list = os_list_tmp
+
+        try:
+            self.db.show_current_os(network_list,os_list)
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
+
     # ############################################
     # Method do_register_backup_server
     # ############################################
@@ -650,6 +823,76 @@ class nmap2db_cli(cmd.Cmd):
 
     
 
+    # ############################################
+    # Method do_register_hostaddr
+    # ############################################
+
+    def do_register_hostaddr(self,args):
+        """
+        DESCRIPTION:
+        This command registers single IPs of a registered network.
+
+        The IPs of IPv6 networks shorter than /112 are not 
+        generated when the network is registered, only the IPs 
+        registered with this command are scanned in them.
+
+        The IPs are defined as a comma separated list, or as a 
+        file with one IP per line with @file.
+
+        COMMAND:
+        register_hostaddr [IPaddress list|@file]
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+
+        if len(arg_list) == 0:
+            
+            print "--------------------------------------------------------"
+            hostaddrs = raw_input("# IPaddress list or @file []: ")
+            print "--------------------------------------------------------"
+
+        elif len(arg_list) == 1:
+            hostaddrs = arg_list[0]
+
+        else:
+            print "\n[ERROR] - Wrong number of parameters used.\n          Type help or \? to list commands\n"
+            return False
+
+        hostaddrs = hostaddrs.strip()
+
+        try:
+            if hostaddrs.startswith('@'):
+                f = open(hostaddrs[1:])
+
+                try:
+                    hostaddr_list = [line.strip() for line in f if line.strip() != '' and not line.startswith('#')]
+                finally:
+                    f.close()
+
+            else:
+                hostaddr_list = [hostaddr for hostaddr in hostaddrs.replace(' ','').split(',') if hostaddr != '']
+
+        except IOError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+
+        if hostaddr_list == []:
+            print "\n[ERROR]: No IPs have been defined\n"
+            return False
+
+        try:
+            registered = self.db.register_hostaddrs(hostaddr_list)
+            print "\n[Done]: %s IPs registered, %s ignored (already registered or not in a registered network)\n" % (registered,len(set(hostaddr_list)) - registered)
+
+        except Exception as e:
+            print "\n[ERROR]: Could not register these IPs\n",e
+
+
     # ############################################
     # Method do_register_backup_server
     # ############################################
@@ -747,56 +990,319 @@ class nmap2db_cli(cmd.Cmd):
             print "\n[ERROR] - Wrong number of parameters used.\n          Type help or \? to list commands\n"
 
 
+    # ############################################
+    # Method do_show_raw_report
+    # ############################################
+
+    def do_show_raw_report(self,args):
+        """
+        DESCRIPTION:
+        This command shows the raw XML report saved for a report.
+        
+        COMMAND:
+        show_raw_report [ReportID]
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        if len(arg_list) == 0:
+            
+            print "--------------------------------------------------------"
+            report_id = raw_input("# ReportID []: ")
+            print "--------------------------------------------------------"
+
+        elif len(arg_list) == 1:
+            
+            report_id = arg_list[0].lower()
+          
+            print "--------------------------------------------------------"
+            print "# ReportID: " + report_id
+            print "--------------------------------------------------------"
+
+        else:
+            print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+            return False
+
+        try:
+            xml_report = self.db.get_raw_report(report_id.strip())
+
+            if xml_report == None:
+                print "\n[ERROR]: The raw report does not exist or has been purged\n"
+            else:
+                print xml_report
+
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
+
+    # ############################################
+    # Method do_purge_raw_reports
+    # ############################################
+
+    def do_purge_raw_reports(self,args):
+        """
+        DESCRIPTION:
+        This command deletes the raw XML reports older than a 
+        number of days. The values extracted from them are kept.
+
+        If the number of days is not defined, the value of
+        raw_report_retention in nmap2db.conf is used.
+        
+        COMMAND:
+        purge_raw_reports [Days]
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        try:
+            if len(arg_list) == 0:
+                retention_days = self.conf.raw_report_retention
+
+            elif len(arg_list) == 1:
+                retention_days = int(arg_list[0])
+
+            else:
+                print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+                return False
+
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+
+        if retention_days <= 0:
+            print "\n[Done]: Raw reports are kept forever (raw_report_retention = 0)\n"
+            return False
+
+        try:
+            purged = self.db.purge_raw_reports(retention_days)
+            print "\n[Done]: %s raw reports older than %s days deleted\n" % (purged,retention_days)
+
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
+
+    # ############################################
+    # Method do_purge_history
+    # ############################################
+
+    def do_purge_history(self,args):
+        """
+        DESCRIPTION:
+        This command drops the partitions of scan_report, 
+        host_info and service_info of the months older than a 
+        number of full months before the current one. It needs 
+        native partitioning.
+
+        If an archive directory is defined, every partition is 
+        saved in it as a gzip compressed CSV file before it is 
+        dropped.
+
+        If the number of months or the archive directory are not
+        defined, the values of history_retention and 
+        history_archive_dir in nmap2db.conf are used.
+        
+        COMMAND:
+        purge_history [Months] [Archive directory]
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        archive_dir = self.conf.history_archive_dir
+
+        try:
+            if len(arg_list) == 0:
+                retention_months = self.conf.history_retention
+
+            elif len(arg_list) == 1:
+                retention_months = int(arg_list[0])
+
+            elif len(arg_list) == 2:
+                retention_months = int(arg_list[0])
+                archive_dir = arg_list[1]
+
+            else:
+                print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+                return False
+
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+
+        if retention_months <= 0:
+            print "\n[Done]: The scan history is kept forever (history_retention = 0)\n"
+            return False
+
+        if archive_dir != '' and not os.path.isdir(archive_dir):
+            print "\n[ERROR]: The archive directory %s does not exist\n" % archive_dir
+            return False
+
+        try:
+            partitions = self.db.get_expired_partitions(retention_months)
+
+            if partitions == None:
+                print "\n[ERROR]: purge_history needs native partitioning (nmap2db_native_partitioning.sql)\n"
+                return False
+
+            months = sorted(set([partition_month for partition_month, table_name, partition_name in partitions]))
+
+            for month in months:
+
+                if archive_dir != '':
+                    for partition_month, table_name, partition_name in partitions:
+                        if partition_month == month:
+                            self.db.archive_partition(partition_name,os.path.join(archive_dir,partition_name + '.csv.gz'))
+
+                scans = self.db.drop_partitions(month)
+                print "[Done]: Partitions of %s dropped, %s host scans deleted" % (month.strftime('%Y-%m'),scans)
+
+            print "\n[Done]: %s months older than %s months deleted\n" % (len(months),retention_months)
+
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
+
+    # ############################################
+    # Method do_rebuild_current_state
+    # ############################################
+
+    def do_rebuild_current_state(self,args):
+        """
+        DESCRIPTION:
+        This command builds again the current state of hosts and 
+        ports (host_current and service_current) from the history 
+        of all the reports. It is only needed after upgrading from 
+        an older version or after deleting reports, the current 
+        state is updated every time a report is saved.
+        
+        COMMAND:
+        rebuild_current_state
+        """
+        
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        if len(arg_list) == 0:
+            try:
+                hosts = self.db.rebuild_current_state()
+                print "\n[Done]: Current state of %s hosts rebuilt\n" % hosts
+
+            except Exception as e:
+                print "\n[ERROR]: ",e
+
+        else:
+            print "\n[ERROR] - This command does not accept parameters.\n          Type help or \? to list commands\n"
+
+
     # ############################################
     # Method do_generate_topology
     # ############################################
 
-    #   def do_generate_topology(self,args):
-    #       """
-    #       DESCRIPTION:
-    #       This command generates a PNG file with the network topology of 
-    #       the nmap2db networks.
-    #       
-    #       COMMAND:
-    #       generate_topology [Output file]
-    #       """
-    #               
-    #       try: 
-    #           arg_list = shlex.split(args)
-    #       
-    #       except ValueError as e:
-    #           print "\n[ERROR]: ",e,"\n"
-    #           return False
-    #       
-    #       if len(arg_list) == 0:
-    #           
-    #           print "--------------------------------------------------------"
-    #           output_file = raw_input("# Output file []: ")
-    #           print "--------------------------------------------------------"
-    #
-    #           try:
-    #               self.db.generate_topology(output_file)
-    #
-    #           except Exception as e:
-    #               print "\n[ERROR]: ",e
-    #               
-    #       elif len(arg_list) == 1:
-    #           
-    #           output_file = arg_list[0]
-    #         
-    #           print "--------------------------------------------------------"
-    #           print "# Output file: " + output_file
-    #           print "--------------------------------------------------------"
-    #           
-    #           try:
-    #               self.db.generate_topology(output_file)
-    #               
-    #           except Exception as e:
-    #               print "\n[ERROR]: ",e
-    #
-    #       else:
-    #           print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
-    #           
+    def do_generate_topology(self,args):
+        """
+        DESCRIPTION:
+        This command generates the network topology graph of the 
+        nmap2db networks in the DOT language of Graphviz, with the 
+        links between hosts found by the traceroutes of the scans.
+
+        Mode normal only shows the links to routers, mode full 
+        shows the end nodes too. If a number of days is defined, 
+        only the links seen by a scan in the last days are used.
+
+        The graph is printed if the output file is not defined. A 
+        PNG file can be generated with "dot -Tpng -o topology.png".
+        
+        COMMAND:
+        generate_topology [Mode] [Days] [Output file]
+        """
+                
+        try: 
+            arg_list = shlex.split(args)
+        
+        except ValueError as e:
+            print "\n[ERROR]: ",e,"\n"
+            return False
+        
+        output_file = ''
+        seen_days = ''
+
+        if len(arg_list) == 0:
+            
+            print "--------------------------------------------------------"
+            mode = raw_input("# Mode [normal]: ")
+            seen_days = raw_input("# Seen in the last days [all]: ")
+            output_file = raw_input("# Output file []: ")
+            print "--------------------------------------------------------"
+
+        elif len(arg_list) <= 3:
+            
+            mode = arg_list[0]
+
+            if len(arg_list) >= 2:
+                seen_days = arg_list[1]
+
+            if len(arg_list) == 3:
+                output_file = arg_list[2]
+
+        else:
+            print "\n[ERROR] - Wrong number of parameters used.\n          Type help or ? to list commands\n"
+            return False
+
+        mode = mode.strip().lower()
+
+        if mode == '':
+            mode = 'normal'
+
+        if mode not in ['normal','full']:
+            print "\n[ERROR]: Mode must be normal or full\n"
+            return False
+
+        if seen_days.strip() in ['','all','0']:
+            seen_days = None
+        else:
+            try:
+                seen_days = int(seen_days)
+
+            except ValueError as e:
+                print "\n[ERROR]: ",e,"\n"
+                return False
+
+        try:
+            dot_output = self.db.generate_topology(mode,seen_days)
+
+            if output_file == '':
+                sys.stdout.write(dot_output)
+            else:
+                f = open(output_file,'w')
+
+                try:
+                    f.write(dot_output)
+                finally:
+                    f.close()
+
+                print "\n[Done]: Network topology graph written to %s\n" % output_file
+
+        except Exception as e:
+            print "\n[ERROR]: ",e
+
 
     # ############################################
     # Method do_clear
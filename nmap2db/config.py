@@ -44,9 +44,43 @@ class configuration():
         self.dsn = ''
         self.pg_connect_retry_interval = 10
 
+        # nmap2db_scan section
+        self.nmap_binary = 'nmap'
+        self.max_parallel_hosts = 1
+        self.hosts_per_nmap_run = 1
+        self.split_batch_reports = True
+        self.max_idle_wait = 60
+        self.work_units_per_claim = 1
+        self.work_unit_size = 256
+        self.checkpoint_interval = 60
+        self.heartbeat_interval = 15
+        self.lease_duration = 120
+        self.drain_timeout = 300
+        self.metrics_address = '127.0.0.1'
+        self.metrics_port = 0
+        self.client_side_ingest = False
+        self.compress_raw_reports = False
+        self.spool_dir = '/var/spool/nmap2db'
+        self.spool_drain_batch_size = 100
+
+        # nmap2db_supervisor section
+        self.min_scanners = 2
+        self.max_scanners = 2
+        self.scale_interval = 60
+        self.restart_delay = 1
+        self.max_restart_delay = 300
+        self.status_file = '/var/run/nmap2db/nmap2db_supervisor.status'
+
+        # nmap2db_maintenance section
+        self.raw_report_retention = 0
+        self.partition_months_ahead = 3
+        self.history_retention = 0
+        self.history_archive_dir = ''
+
         # Logging section
         self.log_level = 'ERROR'
         self.log_file = '/var/log/nmap2db/nmap2db.log'
+        self.slow_operation_threshold = 1.0
 
         self.set_configuration_file()
         self.set_configuration_parameters()
@@ -103,12 +137,99 @@ class configuration():
             if config.has_option('nmap2db_database','pg_connect_retry_interval'):
                 self.pg_connect_retry_interval = int(config.get('nmap2db_database','pg_connect_retry_interval'))
 
+            # nmap2db_scan section
+            if config.has_option('nmap2db_scan','nmap_binary'):
+                self.nmap_binary = config.get('nmap2db_scan','nmap_binary')
+
+            if config.has_option('nmap2db_scan','max_parallel_hosts'):
+                self.max_parallel_hosts = int(config.get('nmap2db_scan','max_parallel_hosts'))
+
+            if config.has_option('nmap2db_scan','hosts_per_nmap_run'):
+                self.hosts_per_nmap_run = int(config.get('nmap2db_scan','hosts_per_nmap_run'))
+
+            if config.has_option('nmap2db_scan','split_batch_reports'):
+                self.split_batch_reports = config.getboolean('nmap2db_scan','split_batch_reports')
+
+            if config.has_option('nmap2db_scan','max_idle_wait'):
+                self.max_idle_wait = int(config.get('nmap2db_scan','max_idle_wait'))
+
+            if config.has_option('nmap2db_scan','work_units_per_claim'):
+                self.work_units_per_claim = int(config.get('nmap2db_scan','work_units_per_claim'))
+
+            if config.has_option('nmap2db_scan','work_unit_size'):
+                self.work_unit_size = int(config.get('nmap2db_scan','work_unit_size'))
+
+            if config.has_option('nmap2db_scan','checkpoint_interval'):
+                self.checkpoint_interval = int(config.get('nmap2db_scan','checkpoint_interval'))
+
+            if config.has_option('nmap2db_scan','heartbeat_interval'):
+                self.heartbeat_interval = int(config.get('nmap2db_scan','heartbeat_interval'))
+
+            if config.has_option('nmap2db_scan','lease_duration'):
+                self.lease_duration = int(config.get('nmap2db_scan','lease_duration'))
+
+            if config.has_option('nmap2db_scan','drain_timeout'):
+                self.drain_timeout = int(config.get('nmap2db_scan','drain_timeout'))
+
+            if config.has_option('nmap2db_scan','metrics_address'):
+                self.metrics_address = config.get('nmap2db_scan','metrics_address')
+
+            if config.has_option('nmap2db_scan','metrics_port'):
+                self.metrics_port = int(config.get('nmap2db_scan','metrics_port'))
+
+            if config.has_option('nmap2db_scan','client_side_ingest'):
+                self.client_side_ingest = config.getboolean('nmap2db_scan','client_side_ingest')
+
+            if config.has_option('nmap2db_scan','compress_raw_reports'):
+                self.compress_raw_reports = config.getboolean('nmap2db_scan','compress_raw_reports')
+
+            if config.has_option('nmap2db_scan','spool_dir'):
+                self.spool_dir = config.get('nmap2db_scan','spool_dir')
+
+            if config.has_option('nmap2db_scan','spool_drain_batch_size'):
+                self.spool_drain_batch_size = int(config.get('nmap2db_scan','spool_drain_batch_size'))
+
+            # nmap2db_supervisor section
+            if config.has_option('nmap2db_supervisor','min_scanners'):
+                self.min_scanners = int(config.get('nmap2db_supervisor','min_scanners'))
+
+            if config.has_option('nmap2db_supervisor','max_scanners'):
+                self.max_scanners = int(config.get('nmap2db_supervisor','max_scanners'))
+
+            if config.has_option('nmap2db_supervisor','scale_interval'):
+                self.scale_interval = int(config.get('nmap2db_supervisor','scale_interval'))
+
+            if config.has_option('nmap2db_supervisor','restart_delay'):
+                self.restart_delay = int(config.get('nmap2db_supervisor','restart_delay'))
+
+            if config.has_option('nmap2db_supervisor','max_restart_delay'):
+                self.max_restart_delay = int(config.get('nmap2db_supervisor','max_restart_delay'))
+
+            if config.has_option('nmap2db_supervisor','status_file'):
+                self.status_file = config.get('nmap2db_supervisor','status_file')
+
+            # nmap2db_maintenance section
+            if config.has_option('nmap2db_maintenance','raw_report_retention'):
+                self.raw_report_retention = int(config.get('nmap2db_maintenance','raw_report_retention'))
+
+            if config.has_option('nmap2db_maintenance','partition_months_ahead'):
+                self.partition_months_ahead = int(config.get('nmap2db_maintenance','partition_months_ahead'))
+
+            if config.has_option('nmap2db_maintenance','history_retention'):
+                self.history_retention = int(config.get('nmap2db_maintenance','history_retention'))
+
+            if config.has_option('nmap2db_maintenance','history_archive_dir'):
+                self.history_archive_dir = config.get('nmap2db_maintenance','history_archive_dir')
+
             # Logging section
             if config.has_option('logging','log_level'):
                 self.log_level = config.get('logging','log_level')
 
             if config.has_option('logging','log_file'):
                 self.log_file = config.get('logging','log_file')
+
+            if config.has_option('logging','slow_operation_threshold'):
+                self.slow_operation_threshold = float(config.get('logging','slow_operation_threshold'))
             
 
         # Generate the DSN string 
@@ -19,22 +19,94 @@
 # You should have received a copy of the GNU General Public License
 # along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import sys
+import gzip
+import time
+import errno
+import select
+import binascii
+import threading
 import psycopg2
+import psycopg2.errorcodes
 import psycopg2.extensions
 from psycopg2.extras import wait_select
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
 from nmap2db.prettytable import *
+from nmap2db.xml_report import *
 
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODE)
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY)
 
+
+# ############################################
+# Function format_copy_value()
+#
+# Values used with COPY ... FROM STDIN are 
+# formatted in the COPY text format. Lists are
+# formatted as arrays.
+# ############################################
+
+def format_copy_value(value):
+    """Format a value for COPY in text format"""
+
+    if value == None:
+        return '\\N'
+
+    if isinstance(value,bool):
+        value = value and 't' or 'f'
+
+    elif isinstance(value,list):
+        value = format_array_value(value)
+
+    elif isinstance(value,buffer):
+        value = '\\x' + binascii.hexlify(value)
+
+    elif isinstance(value,unicode):
+        value = value.encode('utf-8')
+
+    else:
+        value = str(value)
+
+    return value.replace('\\','\\\\').replace('\t','\\t').replace('\n','\\n').replace('\r','\\r')
+
+
+# ############################################
+# Function format_array_value()
+# ############################################
+
+def format_array_value(values):
+    """Format a list of values as an array literal"""
+
+    elements = []
+
+    for value in values:
+
+        if isinstance(value,unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+
+        elements.append('"' + value.replace('\\','\\\\').replace('"','\\"') + '"')
+
+    return '{' + ','.join(elements) + '}'
+
+
 #
 # Class: pg_database
 #
 # This class is used to interact with a postgreSQL database
 # It is used to open and close connections to the database
 # and to set/get some information for/of the connection.
+#
+# The connection is opened the first time it is needed and
+# reused by all the methods of the class. If the connection 
+# is lost, it is opened again the next time a query is run.
 # 
 
 class nmap2db_db():
@@ -53,6 +125,10 @@ class nmap2db_db():
         self.conn = None
         self.server_version = None
         self.cur = None
+        self.reconnects = 0
+        self.lock = threading.RLock()
+        self.listen_channels = []
+        self.profiler = None
 
         self.output_format = 'table'
 
@@ -63,32 +139,40 @@ class nmap2db_db():
     # A generic function to connect to PostgreSQL using Psycopg2
     # We will define the application_name parameter if it is not
     # defined in the DSN and the postgreSQL server version >= 9.0
+    #
+    # If we already have an open connection, it is reused.
     # ############################################
 
     def pg_connect(self):
         """A generic function to connect to PostgreSQL using Psycopg2"""
 
-        try:
-            self.conn = psycopg2.connect(self.dsn)
+        with self.lock:
+            if self.conn and not self.conn.closed:
+                return
+
+            try:
+                self.conn = psycopg2.connect(self.dsn)
         
-            if self.conn:
-                self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-                wait_select(self.conn)
+                if self.conn:
+                    self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    wait_select(self.conn)
 
-                self.cur = self.conn.cursor()
+                    self.cur = self.conn.cursor()
 
-                self.server_version = self.conn.server_version
+                    self.server_version = self.conn.server_version
 
-                if (self.server_version >= 90000 and 'application_name=' not in self.dsn):
+                    if (self.server_version >= 90000 and 'application_name=' not in self.dsn):
               
-                    try:
-                        self.cur.execute('SET application_name TO %s',(self.application,))
-                        self.conn.commit()
-                    except psycopg2.Error as e:
-                        self.logs.logger.error('Could not define the application_name parameter: - %s', e)
+                        try:
+                            self.cur.execute('SET application_name TO %s',(self.application,))
+                        except psycopg2.Error as e:
+                            self.logs.logger.error('Could not define the application_name parameter: - %s', e)
+
+                    for channel in self.listen_channels:
+                        self.cur.execute('LISTEN ' + channel)
      
-        except psycopg2.Error as e:
-            raise e
+            except psycopg2.Error as e:
+                raise e
 
     # ############################################
     # Method pg_close()
@@ -97,42 +181,156 @@ class nmap2db_db():
     def pg_close(self):
         """A generic function to close a postgreSQL connection using Psycopg2"""
 
-        if self.cur:
-            try:
-                self.cur.close()
-            except psycopg2.Error as e:
-                print "\n* ERROR - Could not close the cursor used in this connection: \n%s" % e    
+        with self.lock:
+            if self.cur:
+                try:
+                    self.cur.close()
+                except psycopg2.Error as e:
+                    print "\n* ERROR - Could not close the cursor used in this connection: \n%s" % e    
+
+            if self.conn:
+                try:
+                    self.conn.close() 
+                except psycopg2.Error as e:
+                    print "\n* ERROR - Could not close the connection to the database: \n%s" % e    
+
+            self.cur = None
+            self.conn = None
+                
+
+    # ############################################
+    # Method pg_reconnect()
+    # ############################################
+
+    def pg_reconnect(self):
+        """Close the connection to the database and open a new one"""
+
+        with self.lock:
+            self.pg_close()
+            self.reconnects += 1
+            self.pg_connect()
+
+
+    # ############################################
+    # Method execute_query()
+    #
+    # All the queries used by this class are run with this 
+    # method. It returns a new cursor with the result of the 
+    # query. If the connection to the database has been lost 
+    # we reconnect and, if retry is True, run the query again.
+    #
+    # Queries that change the state of the system, e.g. 
+    # claiming a scan job, should use retry=False. We do not 
+    # know if they were executed before the connection was lost.
+    #
+    # If a profiler is defined, the wall time, rows and bytes
+    # of every query are recorded.
+    # ############################################
+
+    def execute_query(self,query,parameters=None,retry=True):
+        """Run a query using the persistent connection to the database"""
+
+        with self.lock:
+            started = time.time()
 
-        if self.conn:
             try:
-                self.conn.close() 
-            except psycopg2.Error as e:
-                print "\n* ERROR - Could not close the connection to the database: \n%s" % e    
+                self.pg_connect()
+
+                cur = self.conn.cursor()
+                cur.execute(query,parameters)
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self.logs.logger.error('Lost the connection to the database: %s',e)
+                self.pg_close()
+
+                if not retry:
+                    raise psycopg2.OperationalError(str(e))
                 
+                self.reconnects += 1
+                self.pg_connect()
+
+                cur = self.conn.cursor()
+                cur.execute(query,parameters)
+
+            if self.profiler != None:
+                self.profiler.record('query',time.time() - started,cur.rowcount,len(cur.query or ''),(query,parameters))
+
+            return cur
+
 
     # ############################################
-    # Method 
+    # Method listen()
+    #
+    # The channels we listen to are registered again 
+    # every time we reconnect to the database.
     # ############################################
 
-    def show_network_definitions(self):
-        """A function to get a list with the networks defined in the system"""
+    def listen(self,channel):
+        """Listen for notifications on a channel"""
+
+        with self.lock:
+            if channel in self.listen_channels and self.conn and not self.conn.closed:
+                return
+
+            self.execute_query('LISTEN ' + channel)
+
+            if channel not in self.listen_channels:
+                self.listen_channels.append(channel)
+
+
+    # ############################################
+    # Method wait_for_notifications()
+    # ############################################
+
+    def wait_for_notifications(self,timeout):
+        """Wait up to timeout seconds for notifications on the channels we listen to"""
+
+        self.pg_connect()
+
+        with self.lock:
+            if self.conn.notifies:
+                notifications = self.conn.notifies[:]
+                del self.conn.notifies[:]
+                return notifications
 
         try:
-            self.pg_connect()
+            try:
+                select.select([self.conn],[],[],timeout)
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT * FROM show_network_definitions')
-                    self.conn.commit()
+            except select.error as e:
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["Network","Remarks"])
+                #
+                # A signal, e.g. SIGTERM, has interrupted the wait.
+                #
 
-                except psycopg2.Error as e:
+                if e.args[0] != errno.EINTR:
                     raise e
-                
+
+            with self.lock:
+                self.conn.poll()
+
+                notifications = self.conn.notifies[:]
+                del self.conn.notifies[:]
+                return notifications
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, select.error) as e:
             self.pg_close()
-            
+            raise psycopg2.OperationalError(str(e))
+
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def show_network_definitions(self):
+        """A function to get a list with the networks defined in the system"""
+
+        try:
+            cur = self.execute_query('SELECT * FROM show_network_definitions')
+
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["Network","Remarks"])
+
         except psycopg2.Error as e:
             raise e
 
@@ -145,21 +343,11 @@ class nmap2db_db():
         """A function to get a list with the scans defined in the system"""
 
         try:
-            self.pg_connect()
-
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT * FROM show_scan_definitions')
-                    self.conn.commit()
+            cur = self.execute_query('SELECT * FROM show_scan_definitions')
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["ScanID","Remarks","Arguments"])
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["ScanID","Remarks","Arguments"])
 
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -171,25 +359,31 @@ class nmap2db_db():
         """A function to get a list with the scans jobs defined in the system"""
 
         try:
-            self.pg_connect()
+            if network_cidr == 'ALL':
+                cur = self.execute_query('SELECT * FROM show_scan_jobs')
+            else:
+                cur = self.execute_query('SELECT * FROM show_scan_jobs WHERE "Network" = %s',(network_cidr,))
 
-            if self.cur:
-                try:
-                    if network_cidr == 'ALL':
-                        self.cur.execute('SELECT * FROM show_scan_jobs')
-                        self.conn.commit()
-                    else:
-                        self.cur.execute('SELECT * FROM show_scan_jobs WHERE "Network" = %s',(network_cidr,))
-                        self.conn.commit()
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["ScanID","Remarks","Arguments"])
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["ScanID","Remarks","Arguments"])
+        except psycopg2.Error as e:
+            raise e
+
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def show_scanner_workers(self):
+        """A function to get a list with the scanners running or stopped in the last day"""
+
+        try:
+            cur = self.execute_query('SELECT * FROM show_scanner_workers')
+
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["Hostname"])
 
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -202,26 +396,15 @@ class nmap2db_db():
         """A function to get a list or scan reports for a host"""
 
         try:
-            self.pg_connect()
-
-            if self.cur:
-                try:
 
-                    if (host.replace('.','')).replace('/','').isdigit():
-                        self.cur.execute('SELECT * FROM show_host_reports WHERE "IPaddress" = %s AND "Registered" >= %s AND "Registered" <= %s',(host,from_timestamp, to_timestamp))
-                    else:
-                        self.cur.execute('SELECT * FROM show_host_reports WHERE "Hostname" @> %s AND "Registered" >= %s AND "Registered" <= %s',([host],from_timestamp, to_timestamp)) 
+            if (host.replace('.','')).replace('/','').isdigit():
+                cur = self.execute_query('SELECT * FROM show_host_reports WHERE "IPaddress" = %s AND "Registered" >= %s AND "Registered" <= %s',(host,from_timestamp, to_timestamp))
+            else:
+                cur = self.execute_query('SELECT * FROM show_host_reports WHERE "Hostname" @> %s AND "Registered" >= %s AND "Registered" <= %s',([host],from_timestamp, to_timestamp)) 
 
-                    self.conn.commit()
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["ScanID","Finished","Duration","IPaddress","Hostname","State"])
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["ScanID","Finished","Duration","IPaddress","Hostname","State"])
-
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -233,48 +416,38 @@ class nmap2db_db():
         """A function to get host details for a reportID"""
 
         try:
-            self.pg_connect()
+            cur = self.execute_query('SELECT * FROM show_host_details WHERE "ReportID" = %s',(report_id,))
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT * FROM show_host_details WHERE "ReportID" = %s',(report_id,))
-                    self.conn.commit()
-
-                    x = PrettyTable([".",".."],header = False)
-                    x.align["."] = "r"
-                    x.align[".."] = "l"
-                    x.padding_width = 1
-
-                    for record in self.cur:
-                        
-                        x.add_row(["ReportID:",record[0]])
-                        x.add_row(["Registered:",str(record[1])])
-                        x.add_row(["ScanID:",record[2]])
-                        x.add_row(["",""])
-                        x.add_row(["Network:",record[3]])
-                        x.add_row(["Network info:",record[4]])
-                        x.add_row(["",""])
-                        x.add_row(["IPaddress:",record[5]])
-                        x.add_row(["Addrtype:",record[6]])
-                        x.add_row(["Hostname:",record[7]])
-                        x.add_row(["Hostname type:",record[8]])
-                        x.add_row(["",""])
-                        x.add_row(["OStype:",record[9]])
-                        x.add_row(["OSvendor:",record[10]])
-                        x.add_row(["OSfamily:",record[11]])
-                        x.add_row(["OSgen:",record[12]])
-                        x.add_row(["OSname:",record[13]])
-                        x.add_row(["",""])
-                        x.add_row(["State:",record[14]])
-                        x.add_row(["State reason:",record[15]])
-
-                        print x
+            x = PrettyTable([".",".."],header = False)
+            x.align["."] = "r"
+            x.align[".."] = "l"
+            x.padding_width = 1
 
-                except psycopg2.Error as e:
-                    raise e
+            for record in cur:
                 
-            self.pg_close()
-            
+                x.add_row(["ReportID:",record[0]])
+                x.add_row(["Registered:",str(record[1])])
+                x.add_row(["ScanID:",record[2]])
+                x.add_row(["",""])
+                x.add_row(["Network:",record[3]])
+                x.add_row(["Network info:",record[4]])
+                x.add_row(["",""])
+                x.add_row(["IPaddress:",record[5]])
+                x.add_row(["Addrtype:",record[6]])
+                x.add_row(["Hostname:",record[7]])
+                x.add_row(["Hostname type:",record[8]])
+                x.add_row(["",""])
+                x.add_row(["OStype:",record[9]])
+                x.add_row(["OSvendor:",record[10]])
+                x.add_row(["OSfamily:",record[11]])
+                x.add_row(["OSgen:",record[12]])
+                x.add_row(["OSname:",record[13]])
+                x.add_row(["",""])
+                x.add_row(["State:",record[14]])
+                x.add_row(["State reason:",record[15]])
+
+                print x
+
         except psycopg2.Error as e:
             raise e
 
@@ -287,21 +460,11 @@ class nmap2db_db():
         """A function to get a list of services found in a scan report"""
 
         try:
-            self.pg_connect()
-
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT "Prot","Port","State","Reason","Service","Method","Product","Prod.ver","Prod.info" FROM show_services_details WHERE report_id = %s',(report_id,))
-                    self.conn.commit()
+            cur = self.execute_query('SELECT "Prot","Port","State","Reason","Service","Method","Product","Prod.ver","Prod.info" FROM show_services_details WHERE report_id = %s',(report_id,))
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["Port","State","Reason","Service","Method","Product","Prod.ver","Prod.info"])
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["Port","State","Reason","Service","Method","Product","Prod.ver","Prod.info"])
 
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -313,39 +476,35 @@ class nmap2db_db():
         """A function to get a list of ports"""
 
         try:
-            self.pg_connect()
+            
+            if network_list != None:
+                network_sql = 'AND (FALSE '
+                
+                for network in network_list:
+                    network_sql = network_sql + 'OR "IPaddress" <<= \'' + network + '\' '  
+                                            
+                network_sql = network_sql + ') '
 
-            if self.cur:
-                try:
-                    
-                    if network_list != None:
-                        network_sql = 'AND (FALSE '
-                        
-                        for network in network_list:
-                            network_sql = network_sql + 'OR "IPaddress" <<= \'' + network + '\' '  
-                                                    
-                        network_sql = network_sql + ') '
-
-                    else:
-                        network_sql = ''
-
-                    if port_list != None:
-                        port_sql = 'AND "Port" IN (' + ','.join(port_list) + ') '
-                    else:
-                        port_sql = ''
-
-                    if service_list != None:
-                        service_sql = 'AND (FALSE '
-                        
-                        for service in service_list:
-                            service_sql = service_sql + 'OR "Service" LIKE \'' + service + '\' ' 
-
-                        service_sql = service_sql + ') '
-                    else:
-                        service_sql = ''    
-                        
-
-                    self.cur.execute('WITH port_list AS(' + 
+            else:
+                network_sql = ''
+
+            if port_list != None:
+                port_sql = 'AND "Port" IN (' + ','.join(port_list) + ') '
+            else:
+                port_sql = ''
+
+            if service_list != None:
+                service_sql = 'AND (FALSE '
+                
+                for service in service_list:
+                    service_sql = service_sql + 'OR "Service" LIKE \'' + service + '\' ' 
+
+                service_sql = service_sql + ') '
+            else:
+                service_sql = ''    
+                
+
+            cur = self.execute_query('WITH port_list AS(' + 
                                      'SELECT DISTINCT ON ("Port","Prot","IPaddress") ' +
                                      '"IPaddress",' +
                                      '"Port",' +
@@ -375,16 +534,9 @@ class nmap2db_db():
                                      'WHERE b.registered >= \'' + str(from_timestamp) + '\' AND b.registered <= \'' + str(to_timestamp) + '\' '
                                      )
 
-                    self.conn.commit()
-
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["IPaddress","Hostname","Port","Prot","State","Service","Product","Prod.ver","Prod.info"])
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["IPaddress","Hostname","Port","Prot","State","Service","Product","Prod.ver","Prod.info"])
 
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -397,33 +549,29 @@ class nmap2db_db():
         """A function to get a list og hostnames running an OS"""
 
         try:
-            self.pg_connect()
+            
+            if network_list != None:
+                network_sql = 'AND (FALSE '
+                
+                for network in network_list:
+                    network_sql = network_sql + 'OR "Network" <<= \'' + network + '\' '  
+                                            
+                network_sql = network_sql + ') '
 
-            if self.cur:
-                try:
-                    
-                    if network_list != None:
-                        network_sql = 'AND (FALSE '
-                        
-                        for network in network_list:
-                            network_sql = network_sql + 'OR "Network" <<= \'' + network + '\' '  
-                                                    
-                        network_sql = network_sql + ') '
-
-                    else:
-                        network_sql = ''
-
-                    if os_list != None:
-                        os_sql = 'AND (FALSE '
-
-                        for osname in os_list:
-                            os_sql = os_sql + 'OR "OSname" LIKE \'' + osname + '\' ' 
-
-                        os_sql = os_sql + ') '
-                    else:
-                        os_sql = ''
-                        
-                    self.cur.execute('SELECT DISTINCT ON ("IPaddress") ' +
+            else:
+                network_sql = ''
+
+            if os_list != None:
+                os_sql = 'AND (FALSE '
+
+                for osname in os_list:
+                    os_sql = os_sql + 'OR "OSname" LIKE \'' + osname + '\' ' 
+
+                os_sql = os_sql + ') '
+            else:
+                os_sql = ''
+                
+            cur = self.execute_query('SELECT DISTINCT ON ("IPaddress") ' +
                                      '"Registered",' + 
                                      '"IPaddress",' +
                                      '"Hostname",' +
@@ -434,16 +582,9 @@ class nmap2db_db():
                                      os_sql +
                                      'ORDER BY "IPaddress"')
 
-                    self.conn.commit()
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["IPaddress","Hostname","OSname"])
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["IPaddress","Hostname","OSname"])
-
-                except psycopg2.Error as e:
-                    raise e
-                
-            self.pg_close()
-            
         except psycopg2.Error as e:
             raise e
 
@@ -452,47 +593,104 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def show_host_without_hostname(self):
-        """A function to get a list of host without a hostname"""
+    def show_current_ports(self,network_list,port_list,service_list):
+        """A function to get the current list of ports"""
 
         try:
-            self.pg_connect()
+            
+            if network_list != None:
+                network_sql = 'AND (FALSE '
+                
+                for network in network_list:
+                    network_sql = network_sql + 'OR "IPaddress" <<= \'' + network + '\' '  
+                                            
+                network_sql = network_sql + ') '
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT "IPaddress","State","Last registration" FROM show_host_without_hostname')
-                    self.conn.commit()
+            else:
+                network_sql = ''
 
-                    colnames = [desc[0] for desc in self.cur.description]
-                    self.print_results(self.cur,colnames,["IPaddress","State","Last registration"])
+            if port_list != None:
+                port_sql = 'AND "Port" IN (' + ','.join(port_list) + ') '
+            else:
+                port_sql = ''
 
-                except psycopg2.Error as e:
-                    raise e
+            if service_list != None:
+                service_sql = 'AND (FALSE '
                 
-            self.pg_close()
-            
+                for service in service_list:
+                    service_sql = service_sql + 'OR "Service" LIKE \'' + service + '\' ' 
+
+                service_sql = service_sql + ') '
+            else:
+                service_sql = ''    
+                
+            cur = self.execute_query('SELECT "IPaddress",' +
+                                     '"Hostname",' +
+                                     '"Port",' +
+                                     '"Prot",' +
+                                     '"State",' +
+                                     '"Service",' +
+                                     '"Product",' +
+                                     '"Prod.ver",' +
+                                     '"Prod.info",' +
+                                     '"Last scan" ' +
+                                     'FROM show_current_ports ' +
+                                     'WHERE TRUE ' +
+                                     network_sql +
+                                     port_sql + 
+                                     service_sql +
+                                     'ORDER BY "IPaddress","Prot","Port"')
+
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["IPaddress","Hostname","Port","Prot","State","Service","Product","Prod.ver","Prod.info","Last scan"])
+
         except psycopg2.Error as e:
             raise e
 
+
     # ############################################
     # Method 
     # ############################################
 
-    def register_network(self,network_cidr,remarks):
-        """A method to register a network_cidr"""
+    def show_current_os(self,network_list,os_list):
+        """A function to get the current list of hostnames running an OS"""
 
         try:
-            self.pg_connect()
+            
+            if network_list != None:
+                network_sql = 'AND (FALSE '
+                
+                for network in network_list:
+                    network_sql = network_sql + 'OR "IPaddress" <<= \'' + network + '\' '  
+                                            
+                network_sql = network_sql + ') '
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT register_network(%s,%s)',(network_cidr,remarks))
-                    self.conn.commit()                        
+            else:
+                network_sql = ''
+
+            if os_list != None:
+                os_sql = 'AND (FALSE '
+
+                for osname in os_list:
+                    os_sql = os_sql + 'OR "OSname" LIKE \'' + osname + '\' ' 
+
+                os_sql = os_sql + ') '
+            else:
+                os_sql = ''
                 
-                except psycopg2.Error as  e:
-                    raise e
+            cur = self.execute_query('SELECT "IPaddress",' +
+                                     '"Hostname",' +
+                                     '"OSname",' + 
+                                     '"State",' +
+                                     '"Last scan" ' +
+                                     'FROM show_current_os ' +
+                                     'WHERE TRUE ' +
+                                     network_sql +
+                                     os_sql +
+                                     'ORDER BY "IPaddress"')
 
-            self.pg_close()
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["IPaddress","Hostname","OSname","State","Last scan"])
 
         except psycopg2.Error as e:
             raise e
@@ -502,21 +700,14 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def register_scan_job(self,network_cidr,scan_id,execution_interval,is_active):
-        """A method to register a scan job"""
+    def show_host_without_hostname(self):
+        """A function to get a list of host without a hostname"""
 
         try:
-            self.pg_connect()
-
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT register_scan_job(%s,%s,%s,%s)',(network_cidr,scan_id,execution_interval,is_active))
-                    self.conn.commit()                        
-                
-                except psycopg2.Error as  e:
-                    raise e
+            cur = self.execute_query('SELECT "IPaddress","State","Last registration" FROM show_host_without_hostname')
 
-            self.pg_close()
+            colnames = [desc[0] for desc in cur.description]
+            self.print_results(cur,colnames,["IPaddress","State","Last registration"])
 
         except psycopg2.Error as e:
             raise e
@@ -525,50 +716,41 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def get_next_scan_job(self):
-        """A method to get the next scan job to run"""
+    def register_network(self,network_cidr,remarks):
+        """A method to register a network_cidr"""
 
         try:
-            self.pg_connect()
-
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT get_next_scan_job()')
-                    self.conn.commit()                        
-                
-                    scan_job_id = self.cur.fetchone()[0]
-                    return scan_job_id
-                    
-                except psycopg2.Error as  e:
-                    raise e
-
-            self.pg_close()
+            self.execute_query('SELECT register_network(%s,%s)',(network_cidr,remarks),retry=False)
 
         except psycopg2.Error as e:
             raise e
 
+
     # ############################################
     # Method 
     # ############################################
 
-    def get_scan_job_args(self,scan_job_id):
-        """A method to get the arguments for a scan_job"""
+    def register_hostaddrs(self,hostaddr_list):
+        """A method to register a list of IPs"""
 
         try:
-            self.pg_connect()
+            cur = self.execute_query('SELECT register_hostaddrs(%s::inet[])',(hostaddr_list,))
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT get_scan_job_args(%s)',(scan_job_id,))
-                    self.conn.commit()                        
-                
-                    scan_job_args = self.cur.fetchone()[0]
-                    return scan_job_args
-                    
-                except psycopg2.Error as  e:
-                    raise e
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
 
-            self.pg_close()
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def register_scan_job(self,network_cidr,scan_id,execution_interval,is_active):
+        """A method to register a scan job"""
+
+        try:
+            self.execute_query('SELECT register_scan_job(%s,%s,%s,%s)',(network_cidr,scan_id,execution_interval,is_active),retry=False)
 
         except psycopg2.Error as e:
             raise e
@@ -577,24 +759,138 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def get_scan_job_network(self,scan_job_id):
-        """A method to get the network for a scan_job"""
+    def claim_scan_job_units(self,max_units,unit_size,worker_id,lease_duration):
+        """A method to claim up to max_units work units to run"""
 
         try:
-            self.pg_connect()
+            cur = self.execute_query('SELECT unit_id,scan_jobid,first_hostaddr,last_hostaddr,scan_id,args FROM claim_scan_job_units(%s,%s,%s,%s * INTERVAL \'1 second\')',(max_units,unit_size,worker_id,lease_duration),retry=False)
+        
+            return cur.fetchall()
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT get_scan_job_network_addr(%s)',(scan_job_id,))
-                    self.conn.commit()                        
-                
-                    scan_job_network = self.cur.fetchone()[0]
-                    return scan_job_network
-                    
-                except psycopg2.Error as  e:
-                    raise e
+        except psycopg2.Error as e:
+            raise e
 
-            self.pg_close()
+    # ############################################
+    # Method 
+    # ############################################
+
+    def finish_scan_job_unit(self,unit_id,worker_id):
+        """A method to mark a work unit as done"""
+
+        try:
+            cur = self.execute_query('SELECT finish_scan_job_unit(%s,%s)',(unit_id,worker_id),retry=False)
+        
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def register_scanner_worker(self,hostname,pid):
+        """A method to register a scanner"""
+
+        try:
+            cur = self.execute_query('SELECT register_scanner_worker(%s,%s)',(hostname,pid),retry=False)
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def scanner_worker_heartbeat(self,worker_id,lease_duration):
+        """A method to register a heartbeat of a scanner and renew its leases"""
+
+        try:
+            cur = self.execute_query('SELECT scanner_worker_heartbeat(%s,%s * INTERVAL \'1 second\')',(worker_id,lease_duration))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def unregister_scanner_worker(self,worker_id):
+        """A method to mark a scanner as stopped and release its work units"""
+
+        try:
+            cur = self.execute_query('SELECT unregister_scanner_worker(%s)',(worker_id,),retry=False)
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def release_scan_job_unit(self,unit_id,worker_id):
+        """A method to give up the lease of a scanner on a work unit"""
+
+        try:
+            cur = self.execute_query('SELECT release_scan_job_unit(%s,%s)',(unit_id,worker_id))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def checkpoint_scan_job_unit(self,unit_id,worker_id,hostaddr):
+        """A method to save the last IP done of a work unit"""
+
+        try:
+            cur = self.execute_query('SELECT checkpoint_scan_job_unit(%s,%s,%s)',(unit_id,worker_id,hostaddr))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def get_known_hostaddrs(self,first_hostaddr,last_hostaddr,max_hostaddrs):
+        """A method to get up to max_hostaddrs registered IPs in a range of IPs, in order"""
+
+        try:
+            cur = self.execute_query('SELECT get_known_hostaddrs(%s,%s,%s)',(first_hostaddr,last_hostaddr,max_hostaddrs))
+        
+            return [row[0] for row in cur]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def get_next_scan_job_due(self):
+        """A method to get the seconds until the next scan job is due"""
+
+        try:
+            cur = self.execute_query('SELECT get_next_scan_job_due()')
+        
+            next_scan_job_due = cur.fetchone()[0]
+
+            if next_scan_job_due != None:
+                return float(next_scan_job_due)
+            else:
+                return None
 
         except psycopg2.Error as e:
             raise e
@@ -603,22 +899,60 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def save_scan_report(self,scan_job_id,xml_report):
+    def get_scan_backlog(self,unit_size):
+        """A method to get the work units waiting for a scanner and the work units running"""
+
+        try:
+            cur = self.execute_query('SELECT waiting_units,running_units FROM get_scan_backlog(%s)',(unit_size,))
+        
+            return cur.fetchone()
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def get_scanner_worker_units(self,hostname):
+        """A method to get the work units running of every scanner running in a server"""
+
+        try:
+            cur = self.execute_query('SELECT pid,worker_id,running_units FROM get_scanner_worker_units(%s)',(hostname,))
+        
+            return cur.fetchall()
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method save_scan_report()
+    #
+    # The query is not run again if the connection is
+    # lost, the report stays in the spool of the scanner.
+    # If the report was saved by an attempt that committed
+    # before the connection was lost, the duplicate
+    # report ID is not an error.
+    #
+    # save_scan_report() does not save a report ID that
+    # is already saved, the primary key of scan_report
+    # does not catch it with native partitioning.
+    # ############################################
+
+    def save_scan_report(self,scan_job_id,xml_report,report_id=None):
         """A method to save a scan report"""
 
         try:
-            self.pg_connect()
+            self.execute_query('SELECT save_scan_report(%s,%s,%s)',(scan_job_id,xml_report,report_id),retry=False)
+        
+            return True
 
-            if self.cur:
-                try:
-                    self.cur.execute('SELECT save_scan_report(%s,%s)',(scan_job_id,xml_report))
-                    self.conn.commit()                        
-                
-                    return True
-                except psycopg2.Error as  e:
-                    raise e
+        except psycopg2.IntegrityError as e:
+            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION and report_id != None and report_id in self.get_saved_report_ids([report_id]):
+                self.logs.logger.info('The XML report %s was already saved',report_id)
+                return True
 
-            self.pg_close()
+            raise e
 
         except psycopg2.Error as e:
             raise e
@@ -628,27 +962,317 @@ class nmap2db_db():
     # Method 
     # ############################################
 
-    def expand_network(self,scan_job_network):
-        """A method to get all IPs in a network"""
+    def get_saved_report_ids(self,report_ids):
+        """A method to get which report IDs in a list are already saved"""
+
+        try:
+            cur = self.execute_query('SELECT report_id FROM scan_report WHERE report_id = ANY(%s)',(list(report_ids),))
+
+            return set([row[0] for row in cur])
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def get_raw_report(self,report_id):
+        """A method to get the raw XML report of a scan report"""
 
         try:
+            cur = self.execute_query('SELECT xmlreport,rawreport FROM scan_report WHERE report_id = %s',(report_id,))
+
+            row = cur.fetchone()
+
+            if row == None:
+                return None
+
+            xmlreport, rawreport = row
+
+            if xmlreport != None:
+                return xmlreport
+            elif rawreport != None:
+                return decompress_raw_report(rawreport)
+            else:
+                return None
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method create_nmap2db_partitions()
+    #
+    # The function only exists in databases converted
+    # with sql/nmap2db_native_partitioning.sql. None is
+    # returned for the other databases.
+    # ############################################
+
+    def create_nmap2db_partitions(self,months_ahead):
+        """A method to create the partitions of the next months"""
+
+        try:
+            cur = self.execute_query("SELECT to_regprocedure('create_nmap2db_partitions(integer)') IS NOT NULL")
+
+            if not cur.fetchone()[0]:
+                return None
+
+            cur = self.execute_query('SELECT create_nmap2db_partitions(%s)',(months_ahead,))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method has_partition_rules()
+    #
+    # The partitions of sql/nmap2db_table_partition.sql
+    # get their rows with INSERT rules, that COPY does
+    # not fire.
+    # ############################################
+
+    def has_partition_rules(self):
+        """A method to know if the report tables use the partitioning rules of nmap2db_table_partition.sql"""
+
+        try:
+            cur = self.execute_query("SELECT EXISTS (SELECT 1 FROM pg_rules "
+                                     "WHERE schemaname = 'public' "
+                                     "AND tablename IN ('scan_report','host_info','service_info') "
+                                     "AND rulename IN ('current_month','next_month'))")
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method get_expired_partitions()
+    #
+    # None is returned if the database does not use
+    # native partitioning.
+    # ############################################
+
+    def get_expired_partitions(self,retention_months):
+        """A method to get the partitions older than the retention period"""
+
+        try:
+            cur = self.execute_query("SELECT to_regprocedure('get_expired_nmap2db_partitions(integer)') IS NOT NULL")
+
+            if not cur.fetchone()[0]:
+                return None
+
+            cur = self.execute_query('SELECT partition_month,table_name,partition_name FROM get_expired_nmap2db_partitions(%s)',(retention_months,))
+
+            return cur.fetchall()
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method archive_partition()
+    #
+    # The partition is written with COPY to a gzip 
+    # compressed CSV file with a header line. The file
+    # gets its final name when it is complete and 
+    # synced to disk.
+    # ############################################
+
+    def archive_partition(self,partition_name,archive_file):
+        """A method to save a partition in a compressed CSV file"""
+
+        with self.lock:
             self.pg_connect()
 
-            if self.cur:
+            cur = self.conn.cursor()
+            f = open(archive_file + '.tmp','wb')
+
+            try:
+                gz = gzip.GzipFile(fileobj=f,mode='wb')
+
                 try:
-                    self.cur.execute('SELECT expand_network(%s)',(scan_job_network,))
-                    self.conn.commit()                        
-                
-                    return self.cur
-                    
-                except psycopg2.Error as  e:
-                    raise e
+                    cur.copy_expert('COPY (SELECT * FROM "' + partition_name + '") TO STDOUT WITH (FORMAT csv, HEADER)',gz)
+                finally:
+                    gz.close()
 
-            self.pg_close()
+                f.flush()
+                os.fsync(f.fileno())
+
+            finally:
+                f.close()
+
+            os.rename(archive_file + '.tmp',archive_file)
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def drop_partitions(self,month):
+        """A method to drop the partitions of a month"""
+
+        try:
+            cur = self.execute_query('SELECT drop_nmap2db_partitions(%s)',(month,),retry=False)
+
+            return cur.fetchone()[0]
 
         except psycopg2.Error as e:
             raise e
 
+    # ############################################
+    # Method 
+    # ############################################
+
+    def rebuild_current_state(self):
+        """A method to build host_current and service_current again from the history"""
+
+        try:
+            cur = self.execute_query('SELECT rebuild_current_state()')
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def purge_raw_reports(self,retention_days):
+        """A method to delete the raw XML reports older than retention_days"""
+
+        try:
+            cur = self.execute_query('SELECT purge_raw_reports(%s * INTERVAL \'1 day\')',(retention_days,))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+
+    # ############################################
+    # Method 
+    # ############################################
+
+    def generate_topology(self,mode,seen_days):
+        """A method to get the DOT output of the network topology graph"""
+
+        try:
+            cur = self.execute_query('SELECT generate_topology_dot_output(%s,%s * INTERVAL \'1 day\')',(mode,seen_days))
+
+            return cur.fetchone()[0]
+
+        except psycopg2.Error as e:
+            raise e
+
+
+    # ############################################
+    # Method save_parsed_scan_reports()
+    #
+    # Scan reports parsed by nmap2db_scan are saved with 
+    # COPY in one transaction. The parameter 
+    # nmap2db.client_side_ingest tells the triggers of 
+    # scan_report that the values are already extracted.
+    #
+    # Reports already saved are left out, as in 
+    # save_scan_report(). The advisory locks are taken
+    # in the order of the report IDs, so two sessions
+    # can not deadlock.
+    # ############################################
+
+    def save_parsed_scan_reports(self,reports):
+        """A method to save scan reports parsed by nmap2db_scan"""
+
+        host_rows = []
+        service_rows = []
+        topology_rows = []
+
+        with self.lock:
+            cur = self.execute_query('BEGIN')
+
+            try:
+                report_ids = sorted(set([report.report_id for report in reports]))
+
+                cur.execute('SELECT pg_advisory_xact_lock(hashtext(a)) FROM unnest(%s::text[]) AS a ORDER BY a',(report_ids,))
+                cur.execute('SELECT report_id FROM scan_report WHERE report_id = ANY(%s)',(report_ids,))
+
+                saved_report_ids = set([row[0] for row in cur])
+
+                if saved_report_ids:
+                    self.logs.logger.info('%s XML reports were already saved',len(saved_report_ids))
+
+                reports = [report for report in reports if report.report_id not in saved_report_ids]
+
+                for report in reports:
+                    host_rows.extend(report.host_rows)
+                    service_rows.extend(report.service_rows)
+                    topology_rows.extend(report.topology_rows)
+
+                cur.execute("SET LOCAL nmap2db.client_side_ingest TO 'on'")
+
+                self.copy_rows(cur,'scan_report',SCAN_REPORT_COLUMNS,[report.report_row for report in reports])
+                self.copy_rows(cur,'host_info',HOST_INFO_COLUMNS,host_rows)
+                self.copy_rows(cur,'service_info',SERVICE_INFO_COLUMNS,service_rows)
+
+                #
+                # The links of all the reports are saved with one 
+                # upsert, grouped and in the order of the primary 
+                # key as extract_hosts_and_services_values() does.
+                #
+
+                if topology_rows:
+                    cur.execute('CREATE TEMP TABLE IF NOT EXISTS network_topology_ingest (LIKE network_topology INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+
+                    self.copy_rows(cur,'network_topology_ingest',NETWORK_TOPOLOGY_COLUMNS,topology_rows)
+
+                    cur.execute('INSERT INTO network_topology (' + ','.join(NETWORK_TOPOLOGY_COLUMNS) + ',first_seen,last_seen,times_seen) '
+                                'SELECT hostaddr,max(hostname),adjacent_hostaddr,max(adjacent_hostname),bool_or(is_adjacent_a_router),now(),now(),count(*) '
+                                'FROM network_topology_ingest '
+                                'GROUP BY hostaddr,adjacent_hostaddr '
+                                'ORDER BY hostaddr,adjacent_hostaddr '
+                                'ON CONFLICT (hostaddr,adjacent_hostaddr) DO UPDATE '
+                                'SET hostname = coalesce(EXCLUDED.hostname,network_topology.hostname), '
+                                'adjacent_hostname = coalesce(EXCLUDED.adjacent_hostname,network_topology.adjacent_hostname), '
+                                'is_adjacent_a_router = network_topology.is_adjacent_a_router OR EXCLUDED.is_adjacent_a_router, '
+                                'last_seen = greatest(network_topology.last_seen,EXCLUDED.last_seen), '
+                                'times_seen = network_topology.times_seen + EXCLUDED.times_seen')
+
+                cur.execute('COMMIT')
+                return True
+
+            except psycopg2.Error as e:
+                try:
+                    if not self.conn.closed:
+                        self.conn.cursor().execute('ROLLBACK')
+                except psycopg2.Error:
+                    pass
+
+                raise e
+
+
+    # ############################################
+    # Method copy_rows()
+    # ############################################
+
+    def copy_rows(self,cur,table,columns,rows):
+        """Load a list of rows in a table with COPY"""
+
+        if not rows:
+            return
+
+        data = StringIO()
+
+        for row in rows:
+            data.write('\t'.join([format_copy_value(value) for value in row]) + '\n')
+
+        data.seek(0)
+
+        started = time.time()
+        cur.copy_expert('COPY ' + table + ' (' + ','.join(columns) + ") FROM STDIN WITH (ENCODING 'UTF8')",data)
+
+        if self.profiler != None:
+            self.profiler.record('copy',time.time() - started,len(rows),len(data.getvalue()),'COPY ' + table)
+
+
     # ############################################
     # Method 
     # ############################################
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import SocketServer
+import BaseHTTPServer
+
+#
+# Metrics of nmap2db_scan.
+#
+# The metrics are counters, gauges and histograms kept in memory
+# and exported over HTTP in the Prometheus text format, without
+# external dependencies. Every scanner process exports its own
+# metrics on the port defined with metrics_port or --metrics-port.
+#
+# A gauge or a counter can be defined with a function, that is 
+# called to get its value every time the metrics are exported.
+#
+
+DEFAULT_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,600,1800,3600)
+
+SIZE_BUCKETS = (1024,4096,16384,65536,262144,1048576,4194304,16777216,67108864)
+
+
+# ############################################
+# Function format_labels()
+# ############################################
+
+def format_labels(labels):
+    """Format a tuple of (name,value) labels"""
+
+    if not labels:
+        return ''
+
+    return '{' + ','.join(['%s="%s"' % (name,str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')) for name, value in labels]) + '}'
+
+
+# ############################################
+# Function format_value()
+# ############################################
+
+def format_value(value):
+    """Format a metric value"""
+
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+#
+# Class: nmap2db_metrics
+#
+# This class is the registry with all the metrics of a process.
+#
+
+class nmap2db_metrics():
+    """This class keeps the metrics of a nmap2db process"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self):
+        """ The Constructor."""
+
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.names = []
+        self.server = None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def add_metric(self, name, metric_type, help_text, function=None, buckets=None):
+        """Define a new metric"""
+
+        with self.lock:
+            if name not in self.metrics:
+                self.names.append(name)
+
+            self.metrics[name] = {'type':metric_type,
+                                  'help':help_text,
+                                  'function':function,
+                                  'buckets':buckets,
+                                  'values':{}}
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def counter(self, name, help_text, function=None):
+        """Define a new counter"""
+
+        self.add_metric(name,'counter',help_text,function=function)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def gauge(self, name, help_text, function=None):
+        """Define a new gauge"""
+
+        self.add_metric(name,'gauge',help_text,function=function)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        """Define a new histogram"""
+
+        self.add_metric(name,'histogram',help_text,buckets=tuple(sorted(buckets)))
+
+
+    # ############################################
+    # Method
+    #
+    # Labels are given as a dictionary. They are
+    # saved as a sorted tuple so they can be used
+    # as a key.
+    # ############################################
+
+    def inc(self, name, value=1, labels=None):
+        """Increment a counter or a gauge"""
+
+        key = tuple(sorted((labels or {}).items()))
+
+        with self.lock:
+            values = self.metrics[name]['values']
+            values[key] = values.get(key,0) + value
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def set(self, name, value, labels=None):
+        """Set the value of a gauge"""
+
+        key = tuple(sorted((labels or {}).items()))
+
+        with self.lock:
+            self.metrics[name]['values'][key] = value
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def observe(self, name, value, labels=None):
+        """Add an observation to a histogram"""
+
+        key = tuple(sorted((labels or {}).items()))
+
+        with self.lock:
+            metric = self.metrics[name]
+
+            if key not in metric['values']:
+                metric['values'][key] = {'buckets':[0] * len(metric['buckets']),'sum':0,'count':0}
+
+            histogram = metric['values'][key]
+
+            for index, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def render(self):
+        """Get all the metrics in the Prometheus text format"""
+
+        lines = []
+
+        with self.lock:
+            for name in self.names:
+                metric = self.metrics[name]
+
+                lines.append('# HELP %s %s' % (name,metric['help']))
+                lines.append('# TYPE %s %s' % (name,metric['type']))
+
+                if metric['function'] != None:
+                    try:
+                        lines.append('%s %s' % (name,format_value(metric['function']())))
+                    except Exception:
+                        pass
+
+                    continue
+
+                for key in sorted(metric['values'].keys()):
+                    value = metric['values'][key]
+
+                    if metric['type'] == 'histogram':
+                        for bound, count in zip(metric['buckets'],value['buckets']):
+                            lines.append('%s_bucket%s %s' % (name,format_labels(key + (('le',format_value(bound)),)),format_value(count)))
+
+                        lines.append('%s_bucket%s %s' % (name,format_labels(key + (('le','+Inf'),)),format_value(value['count'])))
+                        lines.append('%s_sum%s %s' % (name,format_labels(key),format_value(value['sum'])))
+                        lines.append('%s_count%s %s' % (name,format_labels(key),format_value(value['count'])))
+
+                    else:
+                        lines.append('%s%s %s' % (name,format_labels(key),format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def start_http_server(self, address, port):
+        """Export the metrics over HTTP in a background thread"""
+
+        metrics = self
+
+        class metrics_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/','/metrics'):
+                    self.send_error(404)
+                    return
+
+                output = metrics.render()
+
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length',str(len(output)))
+                self.end_headers()
+                self.wfile.write(output)
+
+            def log_message(self, format, *args):
+                pass
+
+        class metrics_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = metrics_server((address,port),metrics_handler)
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return self.server
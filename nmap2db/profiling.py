@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+#
+# Timing of the operations of nmap2db.
+#
+# Every operation (a query, a COPY or a stage of the scanner:
+# claim, expand, nmap, save) is recorded with its wall time, and
+# the rows and bytes it has processed when they are known.
+#
+# Operations slower than slow_operation_threshold seconds are
+# written to the log with their details, e.g. the SQL and the
+# parameters of a query.
+#
+# The operations of a scan job are also added to the summary of
+# the job, that the scanner writes to the log as one line:
+#
+#   job 42: 254 hosts, nmap 812.0 s, save 37.2 s, expand 0.1 s
+#
+
+JOB_SUMMARY_STAGES = ('nmap','save','expand','claim')
+
+#
+# nmap processes are expected to be slow, they are not written
+# to the log. Their time is in the summary of the scan job.
+#
+
+SLOW_LOG_EXCLUDED_STAGES = ('nmap',)
+
+MAX_DETAIL_LENGTH = 200
+
+
+# ############################################
+# Function format_detail()
+#
+# The parameters of a query can be a whole XML
+# report. Long values are truncated.
+# ############################################
+
+def format_detail(detail):
+    """Format the details of an operation for the log"""
+
+    if isinstance(detail,tuple) and len(detail) == 2:
+        query, parameters = detail
+
+        if parameters != None:
+            parameters = [shorten_value(repr(value)) for value in parameters]
+
+        return '%s %s' % (shorten_value(str(query)),parameters)
+
+    return shorten_value(str(detail))
+
+
+# ############################################
+# Function shorten_value()
+# ############################################
+
+def shorten_value(value):
+    """Truncate a long value"""
+
+    if len(value) > MAX_DETAIL_LENGTH:
+        return value[:MAX_DETAIL_LENGTH] + '...(%s bytes)' % len(value)
+
+    return value
+
+
+#
+# Class: profile_timer
+#
+# This class measures the wall time of an operation used in a
+# with statement. The rows and bytes of the operation can be
+# defined inside the with block.
+#
+
+class profile_timer():
+    """This class measures the wall time of an operation"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, profiler, stage, job_id=None, detail=None):
+        """ The Constructor."""
+
+        self.profiler = profiler
+        self.stage = stage
+        self.job_id = job_id
+        self.detail = detail
+        self.rows = None
+        self.nbytes = None
+        self.started = None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.stage,time.time() - self.started,self.rows,self.nbytes,self.detail,self.job_id)
+        return False
+
+
+#
+# Class: nmap2db_profiler
+#
+# This class keeps the totals of every kind of operation and
+# of every scan job.
+#
+
+class nmap2db_profiler():
+    """This class records the wall time of the operations of nmap2db"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, logs, slow_operation_threshold):
+        """ The Constructor."""
+
+        self.logs = logs
+        self.slow_operation_threshold = slow_operation_threshold
+        self.stages = {}
+        self.jobs = {}
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def timer(self, stage, job_id=None, detail=None):
+        """Get a timer for an operation"""
+
+        return profile_timer(self,stage,job_id,detail)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def record(self, stage, elapsed, rows=None, nbytes=None, detail=None, job_id=None):
+        """Record an operation"""
+
+        totals = self.stages.setdefault(stage,{'count':0,'time':0.0,'rows':0,'bytes':0})
+
+        totals['count'] += 1
+        totals['time'] += elapsed
+
+        if rows != None and rows > 0:
+            totals['rows'] += rows
+
+        if nbytes != None:
+            totals['bytes'] += nbytes
+
+        if job_id != None:
+            job = self.jobs.setdefault(job_id,{'hosts':0})
+            job[stage] = job.get(stage,0.0) + elapsed
+
+        if self.slow_operation_threshold > 0 and elapsed >= self.slow_operation_threshold and stage not in SLOW_LOG_EXCLUDED_STAGES:
+            self.logs.logger.warning('Slow operation: %s %.3f s, rows: %s, bytes: %s, job: %s: %s',stage,elapsed,rows,nbytes,job_id,format_detail(detail))
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def add_hosts(self, job_id, hosts):
+        """Add the hosts scanned to the summary of a scan job"""
+
+        job = self.jobs.setdefault(job_id,{'hosts':0})
+        job['hosts'] += hosts
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def pop_job_summary(self, job_id):
+        """Get the summary of a scan job and start a new one"""
+
+        if job_id not in self.jobs:
+            return None
+
+        job = self.jobs.pop(job_id)
+        summary = 'job %s: %s hosts' % (job_id,job['hosts'])
+
+        for stage in JOB_SUMMARY_STAGES:
+            if stage in job:
+                summary += ', %s %.1f s' % (stage,job[stage])
+
+        return summary
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_summary(self):
+        """Get the totals of every kind of operation"""
+
+        lines = []
+
+        for stage in sorted(self.stages.keys()):
+            totals = self.stages[stage]
+            lines.append('%s: %s operations, %.1f s, %s rows, %s bytes' % (stage,totals['count'],totals['time'],totals['rows'],totals['bytes']))
+
+        return lines
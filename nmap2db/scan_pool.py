@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import subprocess
+import tempfile
+import time
+import os
+
+#
+# Class: nmap2db_scan_process
+#
+# This class represents one nmap child process started by
+# nmap2db_scan. The XML output and the errors of the process
+# are written to temporary files so a process with a large
+# report never blocks on a full pipe while we wait for it.
+#
+# If the process scans more than one target, the targets are
+# written to a temporary file and given to nmap with -iL.
+#
+
+class nmap2db_scan_process():
+    """This class represents a running nmap process"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, scan_job_id, targets, nmap_command, unit_id=None, scan_id=None):
+        """ The Constructor."""
+
+        self.scan_job_id = scan_job_id
+        self.unit_id = unit_id
+        self.scan_id = scan_id
+        self.targets = targets
+        self.targets_file = None
+
+        if len(targets) == 1:
+            self.nmap_command = nmap_command + targets
+
+        else:
+            fd, self.targets_file = tempfile.mkstemp(prefix='nmap2db_targets_')
+            os.write(fd,'\n'.join(targets) + '\n')
+            os.close(fd)
+
+            self.nmap_command = nmap_command + ['-iL',self.targets_file]
+
+        self.output_file = tempfile.TemporaryFile()
+        self.error_file = tempfile.TemporaryFile()
+
+        self.started = time.time()
+        self.finished = None
+
+        self.proc = subprocess.Popen(self.nmap_command,stdout=self.output_file,stderr=self.error_file)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def is_finished(self):
+        """Check if the nmap process has finished"""
+
+        if self.proc.poll() != None:
+
+            if self.finished == None:
+                self.finished = time.time()
+
+            return True
+        else:
+            return False
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_returncode(self):
+        """Get the return code of the nmap process"""
+
+        return self.proc.returncode
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_output(self):
+        """Get the XML output of the nmap process"""
+
+        self.output_file.seek(0)
+        return self.output_file.read()
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_error(self):
+        """Get the error output of the nmap process"""
+
+        self.error_file.seek(0)
+        return self.error_file.read()
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def terminate(self):
+        """Terminate the nmap process if it is still running"""
+
+        if not self.is_finished():
+            try:
+                self.proc.terminate()
+                self.proc.wait()
+            except OSError:
+                pass
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def close(self):
+        """Close the temporary files used by the process"""
+
+        self.output_file.close()
+        self.error_file.close()
+
+        if self.targets_file != None:
+            try:
+                os.unlink(self.targets_file)
+            except OSError:
+                pass
+
+
+#
+# Class: nmap2db_scan_pool
+#
+# This class is used by nmap2db_scan to keep up to
+# max_parallel_hosts nmap processes running at the same time.
+#
+# It also keeps track of the work units being scanned. A work
+# unit is completed when all its targets have been submitted
+# (close_unit) and all its nmap processes have been collected.
+#
+# The checkpoint of a work unit is the last target of the 
+# nmap processes that have finished, in the order they were
+# submitted. The processes of a unit can finish in any order, 
+# so a process is only part of the checkpoint when all the 
+# processes submitted before it have finished too.
+#
+# A nmap process that exits with an error stops the checkpoint
+# of its work unit before its targets. The work unit has failed,
+# it is not completed and its targets are scanned again by the
+# scanner that claims it next.
+#
+
+class nmap2db_scan_pool():
+    """This class is used to run several nmap processes in parallel"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, max_parallel_hosts, logs, poll_interval=0.1):
+        """ The Constructor."""
+
+        self.max_parallel_hosts = max(1,max_parallel_hosts)
+        self.logs = logs
+        self.poll_interval = poll_interval
+        self.running = []
+        self.units = {}
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def has_free_slot(self):
+        """Check if we can start another nmap process"""
+
+        return len(self.running) < self.max_parallel_hosts
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def is_empty(self):
+        """Check if there are not nmap processes running"""
+
+        return len(self.running) == 0
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_num_running(self):
+        """Get the number of nmap processes running"""
+
+        return len(self.running)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_num_units(self, scan_job_id=None):
+        """Get the number of work units being scanned, of all the scan jobs or of one"""
+
+        if scan_job_id == None:
+            return len(self.units)
+
+        return len([unit for unit in self.units.values() if unit['scan_job_id'] == scan_job_id])
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def submit(self, scan_job_id, targets, nmap_command, unit_id=None, scan_id=None):
+        """Start a new nmap process for a list of targets"""
+
+        process = nmap2db_scan_process(scan_job_id,targets,nmap_command,unit_id,scan_id)
+        self.running.append(process)
+
+        if unit_id in self.units:
+            self.units[unit_id]['running'] += 1
+            self.units[unit_id]['submitted'].append(process)
+
+        self.logs.logger.debug('Scan jobID: %s started nmap for %s targets (%s running)',scan_job_id,len(targets),len(self.running))
+
+        return process
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def collect(self):
+        """Get the list of nmap processes that have finished"""
+
+        finished = []
+
+        for process in self.running[:]:
+            if process.is_finished():
+                self.running.remove(process)
+                finished.append(process)
+
+                if process.unit_id in self.units:
+                    unit = self.units[process.unit_id]
+                    unit['running'] -= 1
+
+                    if process.get_returncode() != 0:
+                        unit['failed'] = True
+
+                    while unit['submitted'] and unit['submitted'][0].finished != None and unit['submitted'][0].get_returncode() == 0:
+                        unit['checkpoint'] = unit['submitted'].pop(0).targets[-1]
+
+        return finished
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def open_unit(self, unit_id, scan_job_id=None):
+        """Start to keep track of the nmap processes of a work unit"""
+
+        self.units[unit_id] = {'scan_job_id':scan_job_id,
+                               'running':0,
+                               'closed':False,
+                               'failed':False,
+                               'submitted':[],
+                               'checkpoint':None,
+                               'checkpointed':time.time()}
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def close_unit(self, unit_id):
+        """All the targets of a work unit have been submitted"""
+
+        if unit_id in self.units:
+            self.units[unit_id]['closed'] = True
+
+
+    # ############################################
+    # Method
+    #
+    # The nmap processes of the work unit already 
+    # running are not stopped, their reports are 
+    # saved when they finish.
+    # ############################################
+
+    def discard_unit(self, unit_id):
+        """Stop keeping track of a work unit that can not be scanned"""
+
+        if unit_id in self.units:
+            del self.units[unit_id]
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def is_failed_unit(self, unit_id):
+        """Check if a nmap process of a work unit has exited with an error"""
+
+        return unit_id in self.units and self.units[unit_id]['failed']
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def pop_completed_units(self):
+        """Get the list of (unit_id, scan_job_id) of the work units without targets left to scan"""
+
+        completed = []
+
+        for unit_id, unit in self.units.items():
+            if unit['closed'] and unit['running'] == 0 and not unit['failed']:
+                completed.append((unit_id,unit['scan_job_id']))
+                del self.units[unit_id]
+
+        return completed
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def pop_failed_units(self):
+        """Get the list of (unit_id, scan_job_id, last target done) of the failed work units without nmap processes running"""
+
+        failed = []
+
+        for unit_id, unit in self.units.items():
+            if unit['closed'] and unit['running'] == 0 and unit['failed']:
+                failed.append((unit_id,unit['scan_job_id'],unit['checkpoint']))
+                del self.units[unit_id]
+
+        return failed
+
+
+    # ############################################
+    # Method
+    #
+    # A checkpoint is returned for every work unit
+    # without a checkpoint in the last interval 
+    # seconds, even if no process has finished. The
+    # database uses it to know the unit is alive.
+    # ############################################
+
+    def pop_checkpoints(self, interval):
+        """Get the list of (unit_id, last target done) of the work units that need a checkpoint"""
+
+        checkpoints = []
+        now = time.time()
+
+        for unit_id, unit in self.units.items():
+            if now - unit['checkpointed'] >= interval:
+                checkpoints.append((unit_id,unit['checkpoint']))
+                unit['checkpointed'] = now
+
+        return checkpoints
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def wait(self, timeout=None):
+        """Wait until at least one nmap process has finished or timeout seconds have passed"""
+
+        started = time.time()
+
+        while True:
+            finished = self.collect()
+
+            if finished or self.is_empty():
+                return finished
+
+            if timeout != None and time.time() - started >= timeout:
+                return finished
+
+            time.sleep(self.poll_interval)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def terminate_all(self):
+        """Terminate all nmap processes running"""
+
+        for process in self.running:
+            process.terminate()
+            process.close()
+
+        self.running = []
+        self.units = {}
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import errno
+import fcntl
+
+#
+# Class: nmap2db_spool
+#
+# This class is a local write-ahead spool used by nmap2db_scan.
+# The reports of the nmap processes that have finished, and the
+# work units that are done, are written to the spool directory
+# before they are saved in the database. They are deleted from
+# the spool when the database has them.
+#
+# If the database is unreachable, the scanner keeps scanning
+# and the entries wait in the spool until the connection is
+# back. Entries left in the spool by a scanner that stopped are
+# saved by the next scanner that drains the spool.
+#
+# Every entry is a file. It is written to a temporary file that
+# is renamed when its content is on disk, so a crash never
+# leaves half written entries. The first line of the file
+# defines the entry:
+#
+# * report <scan_job_id> <report_id>, followed by the XML report
+# * unit <unit_id> <worker_id>
+# * checkpoint <unit_id> <worker_id> <last IP done>
+# * release <unit_id> <worker_id>, a work unit that has failed
+#
+# The worker_id is the scanner holding the lease on the work
+# unit when the entry was written. The database ignores the
+# entries of a scanner that has lost its lease.
+#
+# Entries are named after the time they were written, so they
+# are drained in the same order. Only one process at a time can
+# drain a spool directory shared by several scanners.
+#
+# Entries that can not be saved are renamed to *.rejected.
+#
+
+class nmap2db_spool():
+    """This class is a local write-ahead spool of scan reports"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, spool_dir, logs):
+        """ The Constructor."""
+
+        self.spool_dir = spool_dir
+        self.logs = logs
+        self.counter = 0
+        self.next_drain = 0
+
+        try:
+            os.makedirs(self.spool_dir,0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+        self.lock_file = open(os.path.join(self.spool_dir,'.lock'),'a')
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def write_entry(self, header, data=''):
+        """Write a new entry to the spool"""
+
+        self.counter += 1
+
+        entry_name = '%017.6f-%s-%s.entry' % (time.time(),os.getpid(),self.counter)
+        temp_file = os.path.join(self.spool_dir,'.' + entry_name + '.tmp')
+
+        f = open(temp_file,'wb')
+
+        try:
+            f.write(header + '\n')
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+        os.rename(temp_file,os.path.join(self.spool_dir,entry_name))
+
+        #
+        # The directory is synced too, so the new name of
+        # the entry survives a crash.
+        #
+
+        dir_fd = os.open(self.spool_dir,os.O_RDONLY)
+
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        return entry_name
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def append_report(self, scan_job_id, report_id, xml_report):
+        """Append a XML report to the spool"""
+
+        return self.write_entry('report %s %s' % (scan_job_id,report_id),xml_report)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def append_unit(self, unit_id, worker_id):
+        """Append a work unit that is done to the spool"""
+
+        return self.write_entry('unit %s %s' % (unit_id,worker_id))
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def append_checkpoint(self, unit_id, worker_id, hostaddr):
+        """Append a checkpoint of a work unit to the spool"""
+
+        return self.write_entry('checkpoint %s %s %s' % (unit_id,worker_id,hostaddr))
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def append_release(self, unit_id, worker_id):
+        """Append a work unit that has failed to the spool"""
+
+        return self.write_entry('release %s %s' % (unit_id,worker_id))
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def list_entries(self):
+        """Get the list of entries in the spool, oldest first"""
+
+        return sorted([entry for entry in os.listdir(self.spool_dir) if entry.endswith('.entry')])
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def is_empty(self):
+        """Check if there are not entries in the spool"""
+
+        return len(self.list_entries()) == 0
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def read_entry(self, entry_name):
+        """Get the kind, the values and the data of an entry"""
+
+        f = open(os.path.join(self.spool_dir,entry_name),'rb')
+
+        try:
+            header = f.readline().split()
+            data = f.read()
+        finally:
+            f.close()
+
+        return header[0], header[1:], data
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def remove_entry(self, entry_name):
+        """Delete an entry saved in the database"""
+
+        try:
+            os.unlink(os.path.join(self.spool_dir,entry_name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise e
+
+
+    # ############################################
+    # Method
+    #
+    # Entries that can not be saved in the database,
+    # e.g. reports with invalid XML, are renamed so
+    # they do not block the spool. They are kept
+    # for inspection.
+    # ############################################
+
+    def reject_entry(self, entry_name):
+        """Remove an entry that can not be saved from the spool"""
+
+        os.rename(os.path.join(self.spool_dir,entry_name),os.path.join(self.spool_dir,entry_name + '.rejected'))
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def lock(self):
+        """Get the lock used to drain the spool. Return False if another process has it"""
+
+        try:
+            fcntl.flock(self.lock_file.fileno(),fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+
+        except IOError as e:
+            if e.errno in (errno.EACCES,errno.EAGAIN):
+                return False
+            else:
+                raise e
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def unlock(self):
+        """Release the lock used to drain the spool"""
+
+        fcntl.flock(self.lock_file.fileno(),fcntl.LOCK_UN)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def can_drain(self):
+        """Check if it is time to try to drain the spool"""
+
+        return time.time() >= self.next_drain
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def drain_failed(self, retry_interval):
+        """Wait retry_interval seconds before trying to drain the spool again"""
+
+        self.next_drain = time.time() + retry_interval
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def drain_done(self):
+        """The spool can be drained again at once"""
+
+        self.next_drain = 0
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import math
+import time
+import errno
+import signal
+import socket
+import subprocess
+
+import psycopg2
+
+#
+# States of a scanner slot:
+#
+# * running: The scanner is running.
+# * waiting: The scanner stopped unexpectedly and is started
+#            again when its restart delay has passed.
+# * reloading: The scanner got a SIGTERM after a reload and is
+#              started again as soon as it stops.
+# * stopping: The scanner got a SIGTERM and its slot is removed
+#             when it stops.
+#
+
+SLOT_STATES = ('running','waiting','reloading','stopping')
+
+#
+# Seconds between the checks of the partitions of the next
+# months, when the database uses native partitioning.
+#
+
+PARTITIONS_INTERVAL = 3600
+
+
+#
+# Class: nmap2db_scanner_slot
+#
+# This class is a place for one nmap2db_scan process in the pool
+# of the supervisor. The slot keeps its number, used to give
+# every scanner its own metrics port, when its scanner is
+# started again.
+#
+
+class nmap2db_scanner_slot():
+    """This class is a scanner run by nmap2db_supervisor"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, slot_id, restart_delay):
+        """ The Constructor."""
+
+        self.slot_id = slot_id
+        self.proc = None
+        self.state = 'waiting'
+        self.started = None
+        self.restarts = 0
+        self.returncode = None
+        self.next_start = 0
+        self.restart_delay = restart_delay
+        self.work_units = None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_pid(self):
+        """Get the PID of the scanner if it is running"""
+
+        if self.proc != None:
+            return self.proc.pid
+
+        return None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def start(self, command):
+        """Start the scanner"""
+
+        self.proc = subprocess.Popen(command,close_fds=True)
+        self.state = 'running'
+        self.started = time.time()
+        self.work_units = None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def signal(self, signum):
+        """Send a signal to the scanner if it is running"""
+
+        if self.proc != None and self.proc.poll() == None:
+            try:
+                os.kill(self.proc.pid,signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise e
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def poll(self):
+        """Check if the scanner has stopped. Return its exit code if it has"""
+
+        if self.proc == None:
+            return None
+
+        returncode = self.proc.poll()
+
+        if returncode != None:
+            self.proc = None
+            self.returncode = returncode
+
+        return returncode
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_uptime(self):
+        """Get the seconds the scanner has been running"""
+
+        if self.proc != None and self.started != None:
+            return time.time() - self.started
+
+        return None
+
+
+#
+# Class: nmap2db_supervisor
+#
+# This class runs a pool of nmap2db_scan processes in a server.
+#
+# * Scanners that stop unexpectedly are started again after
+#   restart_delay seconds. The delay is doubled, up to
+#   max_restart_delay, every time a scanner stops again before it
+#   has run for max_restart_delay seconds.
+#
+# * Every scale_interval seconds the number of scanners is set
+#   between min_scanners and max_scanners to the work units
+#   waiting for a scanner or running, divided by the work units
+#   a scanner claims at once (work_units_per_claim). Only
+#   scanners without work units are stopped when there are too
+#   many.
+#
+# * A reload reads the configuration again and stops every
+#   scanner with a SIGTERM, so it can drain, and starts it again
+#   with the new configuration when it has stopped.
+#
+# * The status of every scanner is written to status_file.
+#
+
+class nmap2db_supervisor():
+    """This class runs a pool of scanners"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, db, logs, conf, scanner_command, min_scanners=None, max_scanners=None, metrics_port=None):
+        """ The Constructor."""
+
+        self.db = db
+        self.logs = logs
+        self.scanner_command = scanner_command
+        self.hostname = socket.getfqdn()
+        self.slots = []
+        self.next_scale = 0
+        self.next_partitions = 0
+        self.backlog = None
+        self.stopping = False
+        self.stop_deadline = None
+
+        #
+        # Values defined in the command line are kept
+        # when the configuration is reloaded.
+        #
+
+        self.min_scanners_override = min_scanners
+        self.max_scanners_override = max_scanners
+        self.metrics_port_override = metrics_port
+
+        self.set_configuration(conf)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def set_configuration(self, conf):
+        """Set the configuration of the supervisor"""
+
+        self.conf = conf
+
+        self.min_scanners = conf.min_scanners
+        self.max_scanners = conf.max_scanners
+        self.metrics_port = conf.metrics_port
+
+        if self.min_scanners_override != None:
+            self.min_scanners = self.min_scanners_override
+
+        if self.max_scanners_override != None:
+            self.max_scanners = self.max_scanners_override
+
+        if self.metrics_port_override != None:
+            self.metrics_port = self.metrics_port_override
+
+        self.min_scanners = max(self.min_scanners,0)
+        self.max_scanners = max(self.max_scanners,self.min_scanners)
+
+        self.next_scale = 0
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_active_slots(self):
+        """Get the slots that are not being stopped"""
+
+        return [slot for slot in self.slots if slot.state != 'stopping']
+
+
+    # ############################################
+    # Method
+    #
+    # Every scanner exports its metrics on the
+    # first metrics port plus the number of its
+    # slot.
+    # ############################################
+
+    def get_scanner_command(self, slot):
+        """Get the command used to start the scanner of a slot"""
+
+        if self.metrics_port > 0:
+            return self.scanner_command + ['--metrics-port',str(self.metrics_port + slot.slot_id)]
+
+        return self.scanner_command + ['--metrics-port','0']
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def add_slot(self):
+        """Add a new slot with the first free slot number"""
+
+        used_ids = [slot.slot_id for slot in self.slots]
+        slot_id = 0
+
+        while slot_id in used_ids:
+            slot_id += 1
+
+        slot = nmap2db_scanner_slot(slot_id,self.conf.restart_delay)
+        self.slots.append(slot)
+        self.slots.sort(key=lambda slot: slot.slot_id)
+
+        return slot
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def start_scanner(self, slot):
+        """Start the scanner of a slot"""
+
+        try:
+            slot.start(self.get_scanner_command(slot))
+            self.logs.logger.info('Scanner slot: %s started with PID: %s',slot.slot_id,slot.get_pid())
+
+        except OSError as e:
+            self.logs.logger.error('Scanner slot: %s could not start: %s',slot.slot_id,e)
+            self.schedule_restart(slot,0)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def schedule_restart(self, slot, uptime):
+        """Start the scanner of a slot again after its restart delay"""
+
+        if uptime >= self.conf.max_restart_delay:
+            slot.restart_delay = self.conf.restart_delay
+
+        slot.state = 'waiting'
+        slot.next_start = time.time() + slot.restart_delay
+        slot.restarts += 1
+
+        self.logs.logger.warning('Scanner slot: %s will be started again in %s seconds',slot.slot_id,slot.restart_delay)
+
+        slot.restart_delay = min(max(slot.restart_delay * 2,1),self.conf.max_restart_delay)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def check_scanners(self):
+        """Check the scanners that have stopped"""
+
+        for slot in list(self.slots):
+            pid = slot.get_pid()
+            uptime = slot.get_uptime()
+            returncode = slot.poll()
+
+            if returncode == None:
+                continue
+
+            if slot.state == 'stopping':
+                self.logs.logger.info('Scanner slot: %s stopped with exit code: %s',slot.slot_id,returncode)
+                self.slots.remove(slot)
+
+            elif slot.state == 'reloading':
+                self.logs.logger.info('Scanner slot: %s stopped for a reload with exit code: %s',slot.slot_id,returncode)
+
+                if self.stopping:
+                    self.slots.remove(slot)
+                else:
+                    self.start_scanner(slot)
+
+            else:
+                self.logs.logger.error('Scanner slot: %s (PID: %s) stopped unexpectedly with exit code: %s after %.0f seconds',
+                                       slot.slot_id,pid,returncode,uptime or 0)
+                self.schedule_restart(slot,uptime or 0)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def start_waiting_scanners(self):
+        """Start the scanners whose restart delay has passed"""
+
+        for slot in self.slots:
+            if slot.state == 'waiting' and time.time() >= slot.next_start:
+                self.start_scanner(slot)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def update_work_units(self):
+        """Get the work units running of every scanner from the database"""
+
+        work_units = {}
+
+        for pid, worker_id, running_units in self.db.get_scanner_worker_units(self.hostname):
+            work_units[pid] = running_units
+
+        for slot in self.slots:
+            if slot.get_pid() in work_units:
+                slot.work_units = work_units[slot.get_pid()]
+            else:
+                slot.work_units = None
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_wanted_scanners(self):
+        """Get the number of scanners needed by the work units waiting and running"""
+
+        waiting_units, running_units = self.db.get_scan_backlog(self.conf.work_unit_size)
+        self.backlog = (waiting_units,running_units)
+
+        wanted = int(math.ceil((waiting_units + running_units) / float(max(self.conf.work_units_per_claim,1))))
+
+        return min(max(wanted,self.min_scanners),self.max_scanners)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def scale(self):
+        """Set the number of scanners to the backlog of work units"""
+
+        if time.time() < self.next_scale:
+            return
+
+        self.next_scale = time.time() + self.conf.scale_interval
+
+        try:
+            self.update_work_units()
+            wanted = self.get_wanted_scanners()
+
+        except psycopg2.Error as e:
+            #
+            # Without the database we can not know the
+            # backlog. We keep the scanners we have, at
+            # least min_scanners.
+            #
+
+            self.logs.logger.warning('Could not get the backlog of work units: %s',e)
+            wanted = max(len(self.get_active_slots()),self.min_scanners)
+
+        active_slots = self.get_active_slots()
+
+        if len(active_slots) < wanted:
+            self.logs.logger.info('Backlog: %s, starting %s scanners',self.backlog,wanted - len(active_slots))
+
+            for index in range(wanted - len(active_slots)):
+                self.start_scanner(self.add_slot())
+
+        elif len(active_slots) > wanted:
+            idle_slots = [slot for slot in active_slots if slot.state == 'waiting' or (slot.state == 'running' and slot.work_units == 0)]
+            idle_slots.sort(key=lambda slot: slot.slot_id,reverse=True)
+
+            for slot in idle_slots[:len(active_slots) - wanted]:
+                self.logs.logger.info('Backlog: %s, stopping scanner slot: %s',self.backlog,slot.slot_id)
+                self.stop_slot(slot)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def stop_slot(self, slot):
+        """Stop the scanner of a slot and remove the slot"""
+
+        if slot.get_pid() == None:
+            self.slots.remove(slot)
+        else:
+            slot.state = 'stopping'
+            slot.signal(signal.SIGTERM)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def reload(self, conf):
+        """Use a new configuration and restart every scanner with it"""
+
+        self.logs.logger.info('Reloading the configuration, the scanners will be restarted when they have drained')
+        self.set_configuration(conf)
+
+        for slot in self.slots:
+            if slot.state == 'running':
+                slot.state = 'reloading'
+                slot.signal(signal.SIGTERM)
+
+            elif slot.state == 'waiting':
+                slot.restart_delay = self.conf.restart_delay
+                slot.next_start = 0
+
+
+    # ############################################
+    # Method
+    #
+    # The scanners drain when they get a SIGTERM.
+    # A second call stops them at once, as a second
+    # SIGTERM does with nmap2db_scan.
+    # ############################################
+
+    def stop(self):
+        """Stop every scanner"""
+
+        if self.stopping:
+            self.logs.logger.warning('Stopping the scanners at once')
+
+            for slot in self.slots:
+                slot.signal(signal.SIGTERM)
+
+            return
+
+        self.stopping = True
+        self.stop_deadline = time.time() + self.conf.drain_timeout + 60
+
+        self.logs.logger.info('Stopping %s scanners',len(self.slots))
+
+        for slot in list(self.slots):
+            self.stop_slot(slot)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def kill_all(self):
+        """Kill the scanners that have not stopped after the drain timeout"""
+
+        for slot in self.slots:
+            if slot.get_pid() != None:
+                self.logs.logger.error('Scanner slot: %s (PID: %s) has not stopped, killing it',slot.slot_id,slot.get_pid())
+                slot.signal(signal.SIGKILL)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def is_done(self):
+        """Check if every scanner has stopped after a stop"""
+
+        return self.stopping and len(self.slots) == 0
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def create_partitions(self):
+        """Create the partitions of the next months"""
+
+        if time.time() < self.next_partitions:
+            return
+
+        self.next_partitions = time.time() + PARTITIONS_INTERVAL
+
+        try:
+            created = self.db.create_nmap2db_partitions(self.conf.partition_months_ahead)
+
+            if created:
+                self.logs.logger.info('%s partitions created',created)
+
+        except psycopg2.Error as e:
+            self.logs.logger.warning('Could not create the partitions of the next months: %s',e)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def run_once(self):
+        """Check the scanners and the backlog once"""
+
+        self.check_scanners()
+
+        if self.stopping:
+            if self.stop_deadline != None and time.time() > self.stop_deadline:
+                self.kill_all()
+                self.stop_deadline = None
+
+        else:
+            self.create_partitions()
+            self.scale()
+            self.start_waiting_scanners()
+
+        self.write_status()
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def get_status(self):
+        """Get the status of every scanner"""
+
+        lines = []
+
+        lines.append('Supervisor PID: %s, scanners: %s (min: %s, max: %s), backlog (waiting, running work units): %s%s' %
+                     (os.getpid(),len(self.get_active_slots()),self.min_scanners,self.max_scanners,self.backlog,self.stopping and ', stopping' or ''))
+
+        lines.append('%-6s %-10s %-8s %-10s %-9s %-10s %-10s %-10s' % ('Slot','State','PID','Uptime','Restarts','Exit code','Work units','Restart in'))
+
+        for slot in self.slots:
+            uptime = slot.get_uptime()
+            restart_in = None
+
+            if uptime != None:
+                uptime = '%.0f s' % uptime
+
+            if slot.state == 'waiting':
+                restart_in = '%.0f s' % max(slot.next_start - time.time(),0)
+
+            lines.append('%-6s %-10s %-8s %-10s %-9s %-10s %-10s %-10s' % (slot.slot_id,slot.state,slot.get_pid(),uptime,slot.restarts,slot.returncode,slot.work_units,restart_in))
+
+        return lines
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def write_status(self):
+        """Write the status of every scanner to the status file"""
+
+        if self.conf.status_file == '':
+            return
+
+        temp_file = self.conf.status_file + '.tmp'
+
+        try:
+            f = open(temp_file,'w')
+
+            try:
+                f.write('\n'.join(self.get_status()) + '\n')
+            finally:
+                f.close()
+
+            os.rename(temp_file,self.conf.status_file)
+
+        except (IOError, OSError) as e:
+            self.logs.logger.warning('Could not write the status file %s: %s',self.conf.status_file,e)
+            self.conf.status_file = ''
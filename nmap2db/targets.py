@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import binascii
+
+#
+# Target generation used by nmap2db_scan.
+#
+# The IPs of a work unit are generated lazily, one at a time,
+# so the memory used does not depend on the size of the unit
+# and the first nmap process can start as soon as the first
+# batch of targets is ready.
+#
+# IPv6 ranges larger than MAX_EXPANDED_ADDRESSES are not
+# expanded. The scanner uses the IPs registered in hostaddress
+# with register_hostaddr for them, KNOWN_ADDRESSES_PAGE_SIZE
+# IPs at a time.
+#
+
+MAX_EXPANDED_ADDRESSES = 65536
+KNOWN_ADDRESSES_PAGE_SIZE = 1000
+
+ADDRESS_FAMILIES = {4:(socket.AF_INET,32),
+                    6:(socket.AF_INET6,128)}
+
+
+# ############################################
+# Function get_address_family()
+# ############################################
+
+def get_address_family(address):
+    """Get the family (4 or 6) of an IP address"""
+
+    if ':' in address:
+        return 6
+    else:
+        return 4
+
+
+# ############################################
+# Function address_to_int()
+# ############################################
+
+def address_to_int(address):
+    """Convert an IP address (without netmask) to an integer"""
+
+    address = address.split('/')[0]
+    family = get_address_family(address)
+
+    return long(binascii.hexlify(socket.inet_pton(ADDRESS_FAMILIES[family][0],address)),16)
+
+
+# ############################################
+# Function int_to_address()
+# ############################################
+
+def int_to_address(value,family):
+    """Convert an integer to an IP address of a family (4 or 6)"""
+
+    af, bits = ADDRESS_FAMILIES[family]
+    packed = binascii.unhexlify('%0*x' % (bits / 4,value))
+
+    return socket.inet_ntop(af,packed)
+
+
+# ############################################
+# Function get_range_size()
+# ############################################
+
+def get_range_size(first_hostaddr,last_hostaddr):
+    """Get the number of IPs in a range of IPs"""
+
+    return address_to_int(last_hostaddr) - address_to_int(first_hostaddr) + 1
+
+
+# ############################################
+# Function can_expand_range()
+# ############################################
+
+def can_expand_range(first_hostaddr,last_hostaddr):
+    """Check if all the IPs in a range can be generated"""
+
+    if get_address_family(first_hostaddr) == 4:
+        return True
+    else:
+        return get_range_size(first_hostaddr,last_hostaddr) <= MAX_EXPANDED_ADDRESSES
+
+
+# ############################################
+# Function iter_range_targets()
+#
+# xrange() can not be used here, it does not
+# support IPv6 values in Python 2.
+# ############################################
+
+def iter_range_targets(first_hostaddr,last_hostaddr):
+    """Generate all the IPs in a range of IPs"""
+
+    family = get_address_family(first_hostaddr)
+
+    value = address_to_int(first_hostaddr)
+    last_value = address_to_int(last_hostaddr)
+
+    while value <= last_value:
+        yield int_to_address(value,family)
+        value += 1
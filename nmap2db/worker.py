@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import socket
+
+import psycopg2
+
+#
+# Class: nmap2db_worker
+#
+# This class represents a nmap2db_scan process in the
+# scanner_worker table. The scanner registers when it starts
+# and sends a heartbeat every heartbeat_interval seconds. Every
+# heartbeat renews for lease_duration seconds the leases on the
+# work units the scanner is running.
+#
+# If the scanner dies, its leases expire and other scanners
+# claim its work units again. If it stops, it unregisters and
+# its work units go back to the queue at once.
+#
+
+class nmap2db_worker():
+    """This class represents a scanner registered in the database"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, db, logs, lease_duration, heartbeat_interval):
+        """ The Constructor."""
+
+        self.db = db
+        self.logs = logs
+        self.lease_duration = lease_duration
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = None
+        self.last_heartbeat = 0
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def register(self):
+        """Register the scanner if it is not registered"""
+
+        if self.worker_id == None:
+            self.worker_id = self.db.register_scanner_worker(socket.getfqdn(),os.getpid())
+            self.last_heartbeat = time.time()
+
+            self.logs.logger.info('Scanner registered with workerID: %s',self.worker_id)
+
+        return self.worker_id
+
+
+    # ############################################
+    # Method
+    #
+    # A heartbeat that can not be sent is not an
+    # error, the scanner keeps scanning. If the
+    # database is unreachable for longer than
+    # lease_duration, its work units can be claimed
+    # by other scanners.
+    # ############################################
+
+    def heartbeat(self, num_units=None):
+        """Send a heartbeat if heartbeat_interval seconds have passed since the last one"""
+
+        if self.worker_id == None or time.time() - self.last_heartbeat < self.heartbeat_interval:
+            return
+
+        try:
+            renewed_units = self.db.scanner_worker_heartbeat(self.worker_id,self.lease_duration)
+            self.last_heartbeat = time.time()
+
+            if num_units != None and renewed_units < num_units:
+                self.logs.logger.warning('WorkerID: %s has lost the lease on %s work units',self.worker_id,num_units - renewed_units)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self.logs.logger.warning('WorkerID: %s could not send a heartbeat: %s',self.worker_id,e)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def unregister(self):
+        """Mark the scanner as stopped and release its work units"""
+
+        if self.worker_id == None:
+            return
+
+        try:
+            released_units = self.db.unregister_scanner_worker(self.worker_id)
+            self.logs.logger.info('WorkerID: %s unregistered, %s work units released',self.worker_id,released_units)
+
+        except psycopg2.Error as e:
+            self.logs.logger.error('WorkerID: %s could not unregister: %s',self.worker_id,e)
+
+        self.worker_id = None
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import zlib
+import hashlib
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+#
+# Columns of the rows generated by nmap_report, in the same
+# order as the values in the rows.
+#
+
+SCAN_REPORT_COLUMNS = ('report_id','scan_jobid','started','finished','elapsed_time',
+                       'scan_type','scan_protocol','scan_protocols','scan_numservices','nmap_args',
+                       'nmap_version','xmloutputversion','host_up','host_down',
+                       'host_total','xmlreport','rawreport')
+
+HOST_INFO_COLUMNS = ('report_id','scan_jobid','scan_started','scan_finished','hostaddr',
+                     'addrtype','hostname','hostname_type','osclass_type','osclass_vendor',
+                     'osclass_osfamily','osclass_osgen','osclass_accuracy','osmatch_name',
+                     'osmatch_accuracy','state','state_reason')
+
+SERVICE_INFO_COLUMNS = ('report_id','scan_jobid','hostaddr','port_protocol','port_id',
+                        'port_state','port_state_reason','service','service_method',
+                        'service_product','service_product_version','service_product_extrainfo')
+
+NETWORK_TOPOLOGY_COLUMNS = ('hostaddr','hostname','adjacent_hostaddr','adjacent_hostname',
+                            'is_adjacent_a_router')
+
+
+# ############################################
+# Function split_nmap_report()
+#
+# nmap writes one XML document for all the targets
+# of a run. This function splits such a document
+# in one document per host, with the same nmaprun
+# attributes and scaninfo, and a runstats element
+# that only counts the host in the document.
+# ############################################
+
+def split_nmap_report(xml_report):
+    """Split a multi-host nmap XML report in one report per host"""
+
+    root = ElementTree.fromstring(xml_report)
+
+    common_elements = []
+    host_elements = []
+    runstats = None
+
+    for element in root:
+        if element.tag == 'host':
+            host_elements.append(element)
+        elif element.tag == 'runstats':
+            runstats = element
+        else:
+            common_elements.append(element)
+
+    host_reports = []
+
+    for host in host_elements:
+
+        report = ElementTree.Element(root.tag,root.attrib)
+
+        for element in common_elements:
+            report.append(element)
+
+        report.append(host)
+
+        if runstats != None:
+            report.append(get_host_runstats(runstats,host))
+
+        host_reports.append('<?xml version="1.0"?>\n' + ElementTree.tostring(report))
+
+    return host_reports
+
+
+# ############################################
+# Function get_host_runstats()
+# ############################################
+
+def get_host_runstats(runstats,host):
+    """Generate a runstats element for a report with only one host"""
+
+    host_runstats = ElementTree.Element('runstats')
+
+    for element in runstats:
+
+        if element.tag == 'hosts':
+            status = host.find('status')
+
+            if status != None and status.get('state') == 'up':
+                up = '1'
+            else:
+                up = '0'
+
+            down = str(1 - int(up))
+
+            ElementTree.SubElement(host_runstats,'hosts',{'up':up,'down':down,'total':'1'})
+
+        else:
+            host_runstats.append(element)
+
+    return host_runstats
+
+
+# ############################################
+# Function epoch_to_timestamp()
+# ############################################
+
+def epoch_to_timestamp(value):
+    """Convert a nmap epoch value to a timestamp with time zone"""
+
+    if value == None:
+        return None
+
+    return time.strftime('%Y-%m-%d %H:%M:%S+00',time.gmtime(int(value)))
+
+
+# ############################################
+# Function to_integer()
+# ############################################
+
+def to_integer(value):
+    """Convert an attribute value to an integer"""
+
+    if value == None:
+        return None
+
+    return int(value)
+
+
+#
+# Class: nmap_report
+#
+# This class extracts from a nmap XML report the same values
+# the triggers extract_report_values() and 
+# extract_hosts_and_services_values() extract in the database.
+#
+# The report is parsed incrementally with iterparse. Every 
+# host element is processed and released as soon as it has 
+# been parsed, so a report with many hosts and ports does not 
+# build a large tree in memory.
+#
+# The report is saved as nmap generated it. Only the values 
+# that are used in searches (hostnames, OS names and service 
+# names) are converted to lowercase, like the triggers do.
+#
+# report_id is the MD5 value of the report, calculated while 
+# the report is read by the parser.
+#
+# With compress_raw_report, the report is saved compressed with
+# zlib in the column rawreport instead of in xmlreport. zlib is
+# in the standard library of Python 2, zstd is not.
+#
+
+class nmap_report():
+    """This class represents the values extracted from a nmap XML report"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, scan_job_id, xml_report, compress_raw_report=False):
+        """ The Constructor."""
+
+        self.scan_job_id = scan_job_id
+        self.xml_report = xml_report
+        self.compress_raw_report = compress_raw_report
+        self.report_id = None
+
+        self.report_row = None
+        self.host_rows = []
+        self.service_rows = []
+        self.topology_rows = []
+
+        self.parse()
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def parse(self):
+        """Parse the XML report"""
+
+        nmaprun = {}
+        scaninfo = {}
+        scan_protocols = []
+        finished = {}
+        hosts = {}
+
+        root = None
+        depth = 0
+
+        reader = md5_reader(StringIO(self.xml_report))
+
+        for event, element in ElementTree.iterparse(reader,events=('start','end')):
+
+            if event == 'start':
+                depth += 1
+
+                if depth == 1:
+                    root = element
+                    nmaprun = dict(element.attrib)
+
+                continue
+
+            depth -= 1
+
+            if depth != 1:
+                continue
+
+            if element.tag == 'host':
+                self.parse_host(element)
+
+            elif element.tag == 'scaninfo':
+                if not scaninfo:
+                    scaninfo = dict(element.attrib)
+
+                #
+                # A report of -sS -sU has a scaninfo element per
+                # protocol. All of them are used to update
+                # service_current.
+                #
+
+                protocol = element.get('protocol')
+
+                if protocol != None and protocol not in scan_protocols:
+                    scan_protocols.append(protocol)
+
+            elif element.tag == 'runstats':
+                finished_element = element.find('finished')
+                hosts_element = element.find('hosts')
+
+                if finished_element != None:
+                    finished = dict(finished_element.attrib)
+
+                if hosts_element != None:
+                    hosts = dict(hosts_element.attrib)
+
+            root.clear()
+
+        #
+        # The MD5 value of the report is only known when the whole
+        # report has been read. It is added now to the rows.
+        #
+
+        self.report_id = reader.hexdigest()
+
+        self.host_rows = [(self.report_id,) + row for row in self.host_rows]
+        self.service_rows = [(self.report_id,) + row for row in self.service_rows]
+
+        elapsed_time = finished.get('elapsed')
+
+        if self.compress_raw_report:
+            xmlreport = None
+            rawreport = buffer(zlib.compress(self.xml_report))
+        else:
+            xmlreport = self.xml_report
+            rawreport = None
+
+        self.report_row = (self.report_id,
+                           self.scan_job_id,
+                           epoch_to_timestamp(nmaprun.get('start')),
+                           epoch_to_timestamp(finished.get('time')),
+                           elapsed_time,
+                           scaninfo.get('type'),
+                           scaninfo.get('protocol'),
+                           scan_protocols or None,
+                           to_integer(scaninfo.get('numservices')),
+                           nmaprun.get('args'),
+                           nmaprun.get('version'),
+                           nmaprun.get('xmloutputversion'),
+                           to_integer(hosts.get('up')),
+                           to_integer(hosts.get('down')),
+                           to_integer(hosts.get('total')),
+                           xmlreport,
+                           rawreport)
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def parse_host(self, host):
+        """Extract the host, service and topology values of a host element"""
+
+        address = host.find('address')
+        status = host.find('status')
+
+        if address != None:
+            hostaddr = address.get('addr')
+            addrtype = address.get('addrtype')
+        else:
+            hostaddr = None
+            addrtype = None
+
+        if status != None:
+            state = status.get('state')
+            state_reason = status.get('reason')
+        else:
+            state = None
+            state_reason = None
+
+        hostnames = host.findall('hostnames/hostname')
+        osmatches = host.findall('os/osmatch')
+        osclasses = host.findall('os/osmatch/osclass')
+
+        self.host_rows.append((self.scan_job_id,
+                               epoch_to_timestamp(host.get('starttime')),
+                               epoch_to_timestamp(host.get('endtime')),
+                               hostaddr,
+                               addrtype,
+                               lower_values(get_attribute_list(hostnames,'name')),
+                               lower_values(get_attribute_list(hostnames,'type')),
+                               lower_values(get_attribute_list(osclasses,'type')),
+                               lower_values(get_attribute_list(osclasses,'vendor')),
+                               lower_values(get_attribute_list(osclasses,'osfamily')),
+                               lower_values(get_attribute_list(osclasses,'osgen')),
+                               [int(value) for value in get_attribute_list(osclasses,'accuracy')],
+                               lower_values(get_attribute_list(osmatches,'name')),
+                               [int(value) for value in get_attribute_list(osmatches,'accuracy')],
+                               state,
+                               state_reason))
+
+        for port in host.findall('ports/port'):
+
+            port_state = port.find('state')
+            service = port.find('service')
+
+            if port_state == None:
+                port_state = {}
+
+            if service == None:
+                service = {}
+
+            self.service_rows.append((self.scan_job_id,
+                                      hostaddr,
+                                      port.get('protocol'),
+                                      to_integer(port.get('portid')),
+                                      port_state.get('state'),
+                                      port_state.get('reason'),
+                                      lower_value(service.get('name')),
+                                      service.get('method'),
+                                      service.get('product'),
+                                      service.get('version'),
+                                      service.get('extrainfo')))
+
+        #
+        # If the host has status up and traceroute information, 
+        # we get the pairs of adjacent hops for network_topology.
+        # Pairs with a hop without IP (no answer) are left out,
+        # as in extract_hosts_and_services_values().
+        #
+
+        trace = host.find('trace')
+
+        if state == 'up' and trace != None:
+            hops = list(trace)
+
+            for index in range(len(hops) - 1):
+                if hops[index].get('ipaddr') == None or hops[index + 1].get('ipaddr') == None:
+                    continue
+
+                self.topology_rows.append((hops[index].get('ipaddr'),
+                                           lower_value(hops[index].get('host')),
+                                           hops[index + 1].get('ipaddr'),
+                                           lower_value(hops[index + 1].get('host')),
+                                           index != len(hops) - 2))
+
+
+# ############################################
+# Function get_attribute_list()
+# ############################################
+
+def get_attribute_list(elements,attribute):
+    """Get the values of an attribute in a list of elements"""
+
+    values = []
+
+    for element in elements:
+        value = element.get(attribute)
+
+        if value != None:
+            values.append(value)
+
+    return values
+
+
+# ############################################
+# Function lower_value()
+# ############################################
+
+def lower_value(value):
+    """Convert a value to lowercase"""
+
+    if value == None:
+        return None
+
+    return value.lower()
+
+
+# ############################################
+# Function lower_values()
+# ############################################
+
+def lower_values(values):
+    """Convert a list of values to lowercase"""
+
+    return [value.lower() for value in values]
+
+
+# ############################################
+# Function get_report_id()
+# ############################################
+
+def get_report_id(xml_report):
+    """Get the report ID (MD5 value) of a XML report"""
+
+    return hashlib.md5(xml_report).hexdigest()
+
+
+#
+# Class: md5_reader
+#
+# File object used by nmap_report to calculate the MD5 value
+# of a report while it is read by the parser.
+#
+
+class md5_reader():
+    """This class calculates the MD5 value of the data read from a file"""
+
+    # ############################################
+    # Constructor
+    # ############################################
+
+    def __init__(self, fileobj):
+        """ The Constructor."""
+
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def read(self, size=-1):
+        """Read data from the file"""
+
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+
+        return data
+
+
+    # ############################################
+    # Method
+    # ############################################
+
+    def hexdigest(self):
+        """Get the MD5 value of the data read"""
+
+        return self.md5.hexdigest()
+
+
+# ############################################
+# Function decompress_raw_report()
+# ############################################
+
+def decompress_raw_report(rawreport):
+    """Get the XML report saved compressed in a rawreport value"""
+
+    return zlib.decompress(str(rawreport))
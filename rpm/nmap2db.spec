@@ -36,6 +36,8 @@ python setup.py build
 %install
 python setup.py install -O1 --skip-build --root %{buildroot}
 mkdir -p %{buildroot}/var/lib/%{name}
+mkdir -p %{buildroot}/var/spool/%{name}
+mkdir -p %{buildroot}/var/run/%{name}
 touch %{buildroot}/var/log/%{name}/%{name}.log
 
 %clean
@@ -51,8 +53,11 @@ rm -rf %{buildroot}
 %{_datadir}/%{name}/*
 /var/log/%{name}/*
 %config(noreplace) %{_sysconfdir}/%{name}/%{name}.conf
+/usr/lib/tmpfiles.d/%{name}.conf
 %attr(700,%{nmap2db_owner},%{nmap2db_group}) %dir /var/lib/%{name}
 %attr(755,%{nmap2db_owner},%{nmap2db_group}) %dir /var/log/%{name}
+%attr(700,%{nmap2db_owner},%{nmap2db_group}) %dir /var/spool/%{name}
+%attr(755,%{nmap2db_owner},%{nmap2db_group}) %dir /var/run/%{name}
 %attr(600,%{nmap2db_owner},%{nmap2db_group}) %ghost /var/log/%{name}/%{name}.log
 
 %pre
@@ -60,6 +65,11 @@ groupadd -f -r nmap2db >/dev/null 2>&1 || :
 useradd -M -N -g nmap2db -r -d /var/lib/nmap2db -s /bin/bash \
         -c "NMAP scan manager" nmap2db >/dev/null 2>&1 || :
 
+%post
+if [ -x /usr/bin/systemd-tmpfiles ]; then
+    /usr/bin/systemd-tmpfiles --create /usr/lib/tmpfiles.d/%{name}.conf >/dev/null 2>&1 || :
+fi
+
 %changelog
 * Mon Aug 12 2014 - Rafael Martinez Guerrero <rafael@postgresql.org.es> 1.0.0-1
 - New release 1.0.0
@@ -54,11 +54,13 @@ try:
           author_email='rafael@postgresql.org.es',
           url='https://github.com/rafaelma/nmap2db',
           packages=['nmap2db',],
-          scripts=['bin/nmap2db','bin/nmap2db_scan'],
+          scripts=['bin/nmap2db','bin/nmap2db_scan','bin/nmap2db_supervisor'],
           data_files=[('/etc/init.d', ['bin/nmap2db_ctrl.sh']),
                       ('/etc/nmap2db', ['etc/nmap2db.conf']),
                       ('/usr/share/nmap2db', ['sql/nmap2db.sql']),
                       ('/usr/share/nmap2db', ['sql/nmap2db_table_partition.sql']),
+                      ('/usr/share/nmap2db', ['sql/nmap2db_native_partitioning.sql']),
+                      ('/usr/lib/tmpfiles.d', ['etc/tmpfiles.d/nmap2db.conf']),
                       ('/var/log/nmap2db',['etc/nmap2db.log'])],
           install_requires=install_requires,
           platforms=['Linux'],
@@ -13,7 +13,7 @@
 -- 
 -- @Description: 
 -- This SQL file has all the PostgreSQL database definitions 
--- needed by NMAP2DB. It needs PostgreSQL >= 9.1
+-- needed by NMAP2DB. It needs PostgreSQL >= 10
 -- --------------------------------------------------
 
 -- DROP DATABASE nmap2db;
@@ -107,6 +107,10 @@ ALTER TABLE hostaddress OWNER TO nmap2db_role_rw;
 -- @state: State of the host (/host/status/@state).
 -- @state_reason: Reason of state of the host (/host/status/@reason).
 --
+-- Rows are only appended, so registered follows the physical
+-- order of the table and has a BRIN index. The hosts without
+-- hostname have a partial index for show_host_without_hostname.
+--
 -- ------------------------------------------------------------
 
 \echo '\n# [Creating table: host_info]\n'
@@ -135,11 +139,55 @@ CREATE TABLE host_info(
 ALTER TABLE host_info ADD PRIMARY KEY (report_id,hostaddr);
 ALTER TABLE host_info OWNER TO nmap2db_role_rw;
 
-CREATE INDEX host_info_registered_idx ON host_info(registered);
-CREATE INDEX host_info_scan_started_idx ON host_info(scan_started);
-CREATE INDEX host_info_scan_finished_idx ON host_info(scan_finished);
+CREATE INDEX host_info_registered_idx ON host_info USING brin(registered);
 CREATE INDEX host_info_hostaddr_idx ON host_info(hostaddr);
-CREATE INDEX host_info_state_idx ON host_info(state);
+CREATE INDEX host_info_without_hostname_idx ON host_info(hostaddr,registered) WHERE hostname = '{}';
+
+-- ------------------------------------------------------------
+-- Table: host_current
+--
+-- @Description: Last known state of every host scanned by
+--               nmap2db, one row per IP. It is updated by the
+--               triggers of host_info when a report is saved,
+--               so the current state of a host is found with
+--               an index lookup instead of a search in the
+--               history of host_info.
+--
+-- Attributes:
+--
+-- The attributes of host_info from the newest report of the
+-- host, by scan_finished (registered if it is not defined).
+--
+-- @updated: Timestamp when the row was last updated.
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating table: host_current]\n'
+
+CREATE TABLE host_current(
+  hostaddr INET NOT NULL,
+  report_id TEXT NOT NULL,
+  registered TIMESTAMP WITH TIME ZONE NOT NULL,
+  scan_jobid BIGINT,
+  scan_started TIMESTAMP WITH TIME ZONE,
+  scan_finished TIMESTAMP WITH TIME ZONE,
+  addrtype TEXT,
+  hostname TEXT [],
+  hostname_type TEXT [],
+  osclass_type TEXT [],
+  osclass_vendor TEXT [],
+  osclass_osfamily TEXT [],
+  osclass_osgen TEXT [],
+  osclass_accuracy INTEGER [],
+  osmatch_name TEXT [],
+  osmatch_accuracy INTEGER [],
+  state TEXT NOT NULL,
+  state_reason TEXT,
+  updated TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+ALTER TABLE host_current ADD PRIMARY KEY (hostaddr);
+ALTER TABLE host_current OWNER TO nmap2db_role_rw;
 
 
 -- ------------------------------------------------------------
@@ -220,6 +268,9 @@ ALTER TABLE network OWNER TO nmap2db_role_rw;
 -- @adjacent_hostaddr: IP-address of a subsequent host to @hostaddr
 -- @adjacent_hostname: Hostname of host with IP = @adjacent_hostaddr 
 -- @is_adjacent_a_router: @adjacent_hostaddr is a router [TRUE|FALSE] 
+-- @first_seen: Timestamp when the link was saved the first time.
+-- @last_seen: Timestamp when the link was saved the last time.
+-- @times_seen: Number of traceroutes where the link has been seen.
 --
 -- ------------------------------------------------------------
 
@@ -230,7 +281,10 @@ CREATE TABLE network_topology(
  hostname TEXT,
  adjacent_hostaddr INET NOT NULL,
  adjacent_hostname TEXT,
- is_adjacent_a_router BOOLEAN NOT NULL
+ is_adjacent_a_router BOOLEAN NOT NULL,
+ first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+ last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+ times_seen BIGINT NOT NULL DEFAULT 1
 );
 
 ALTER TABLE network_topology ADD PRIMARY KEY (hostaddr,adjacent_hostaddr);
@@ -282,6 +336,7 @@ ALTER TABLE scan_definition OWNER TO nmap2db_role_rw;
 -- @registered: Timestamp when the job was registered.
 -- @last_assignment: Timestamp when the job was last assigned to a nmap process.  
 -- @last_execution: Timestamp when the job was last executed.
+-- @last_completion: Timestamp when all the work units of the last execution were done.
 -- @execution_interval: Minimal interval between runs for this job.
 -- @active_status: Active status for a job [TRUE|FALSE].
 -- @network_addr: Network address. Must be defined in the table network.
@@ -295,6 +350,7 @@ CREATE TABLE scan_job(
   id BIGSERIAL,
   registered TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
   last_execution TIMESTAMP WITH TIME ZONE DEFAULT '1970-01-02',
+  last_completion TIMESTAMP WITH TIME ZONE,
   execution_interval INTERVAL NOT NULL DEFAULT '1 day',
   active_status BOOLEAN NOT NULL DEFAULT 'true',
   network_addr CIDR NOT NULL,
@@ -336,6 +392,71 @@ ALTER TABLE scan_job_error_log OWNER TO nmap2db_role_rw;
 CREATE INDEX scan_job_error_log_registered_idx ON scan_job_error_log(registered);
 
 
+-- ------------------------------------------------------------
+-- Table: scan_job_unit
+--
+-- @Description: Work units of the scan jobs being executed.
+--
+--		 When a scan job is due, the hosts of its network
+--		 are split in ranges of consecutive IPs. Every range
+--		 is a work unit that can be claimed by any scanner, 
+--		 so many scanners can share a large network.
+--
+--		 A scan job execution is complete when all its work
+--		 units are done.
+--
+-- Attributes:
+--
+-- @id: Work unit ID.
+-- @registered: Timestamp when the work unit was registered.
+-- @scan_jobid: Scan job ID of the work unit.
+-- @first_hostaddr: First IP of the range.
+-- @last_hostaddr: Last IP of the range.
+-- @status: Status of the work unit [pending|running|done].
+-- @claimed: Timestamp when the work unit was claimed by a scanner.
+-- @finished: Timestamp when the work unit was done.
+-- @checkpoint_hostaddr: Last IP of the range scanned and saved. All 
+--                       the IPs up to this one are done.
+-- @checkpointed: Timestamp of the last checkpoint of the scanner
+--                running the work unit.
+-- @worker_id: Scanner running the work unit.
+-- @lease_expires: Timestamp when the lease of the scanner on the
+--                 work unit expires. The lease is renewed by the
+--                 heartbeats of the scanner.
+--
+--		 A running work unit with an expired lease is claimed
+--		 again by another scanner, from the IP after 
+--		 checkpoint_hostaddr.
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating table: scan_job_unit]\n'
+
+CREATE TABLE scan_job_unit(
+  id BIGSERIAL,
+  registered TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  scan_jobid BIGINT NOT NULL,
+  first_hostaddr INET NOT NULL,
+  last_hostaddr INET NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  claimed TIMESTAMP WITH TIME ZONE,
+  finished TIMESTAMP WITH TIME ZONE,
+  checkpoint_hostaddr INET,
+  checkpointed TIMESTAMP WITH TIME ZONE,
+  worker_id BIGINT,
+  lease_expires TIMESTAMP WITH TIME ZONE,
+  CHECK (status IN ('pending','running','done'))
+);
+
+ALTER TABLE scan_job_unit ADD PRIMARY KEY (id);
+ALTER TABLE scan_job_unit OWNER TO nmap2db_role_rw;
+
+CREATE INDEX scan_job_unit_scan_jobid_idx ON scan_job_unit(scan_jobid);
+CREATE INDEX scan_job_unit_pending_idx ON scan_job_unit(id) WHERE status = 'pending';
+CREATE INDEX scan_job_unit_lease_expires_idx ON scan_job_unit(lease_expires) WHERE status = 'running';
+CREATE INDEX scan_job_unit_worker_id_idx ON scan_job_unit(worker_id) WHERE status = 'running';
+
+
 -- ------------------------------------------------------------
 -- Table: scan_report
 --
@@ -355,6 +476,8 @@ CREATE INDEX scan_job_error_log_registered_idx ON scan_job_error_log(registered)
 -- @elapsed_time: Scan duration (/nmaprun/runstats/finished/@elapsed)
 -- @scan_type: Scan type (nmaprun/scaninfo/@type)
 -- @scan_protocol: Scan protocol (/nmaprun/scaninfo/@protocol)
+-- @scan_protocols: Protocols of all the scans of the report, e.g. 
+--                  tcp and udp with -sS -sU (/nmaprun/scaninfo/@protocol)
 -- @scan_numservices: Number of services scanned (/nmaprun/scaninfo/@numservices)
 -- @nmap_args: Arguments used by NMAP to run the scan (/nmaprun/@args)
 -- @nmap_version: NMAP version used to run the scan (/nmaprun/@version)
@@ -364,6 +487,16 @@ CREATE INDEX scan_job_error_log_registered_idx ON scan_job_error_log(registered)
 -- @host_total: Total number of host scanned (/nmaprun/runstats/hosts/@total)
 --
 -- @xmlreport: NMAP XML output of the scan 
+-- @rawreport: NMAP XML output of the scan compressed with zlib. It is used 
+--             instead of @xmlreport when nmap2db_scan runs with 
+--             compress_raw_reports. 
+--
+--             Both are deleted by purge_raw_reports() after the retention
+--             period, the values extracted from them are kept.
+--
+-- registered has a BRIN index. purge_raw_reports() uses the
+-- partial index scan_report_raw_report_idx, that only has the
+-- reports with a raw XML report.
 --
 -- ------------------------------------------------------------
 
@@ -378,6 +511,7 @@ CREATE TABLE scan_report(
   elapsed_time NUMERIC,
   scan_type TEXT,
   scan_protocol TEXT,
+  scan_protocols TEXT[],
   scan_numservices INTEGER,
   nmap_args TEXT,
   nmap_version TEXT,
@@ -385,16 +519,54 @@ CREATE TABLE scan_report(
   host_up INTEGER,
   host_down INTEGER,
   host_total INTEGER,
-  xmlreport XML NOT NULL
+  xmlreport XML,
+  rawreport BYTEA
 );
 
 ALTER TABLE scan_report ADD PRIMARY KEY (report_id);
 ALTER TABLE scan_report OWNER TO nmap2db_role_rw;
 
-CREATE INDEX scan_report_registered_idx ON scan_report(registered);
-CREATE INDEX scan_report_started_idx ON scan_report(started);
-CREATE INDEX scan_report_finished_idx ON scan_report(finished);
-CREATE INDEX scan_report_elapsed_time_idx ON scan_report(elapsed_time);
+CREATE INDEX scan_report_registered_idx ON scan_report USING brin(registered);
+CREATE INDEX scan_report_raw_report_idx ON scan_report(registered) WHERE xmlreport IS NOT NULL OR rawreport IS NOT NULL;
+
+
+-- ------------------------------------------------------------
+-- Table: scanner_worker
+--
+-- @Description: Scanners (nmap2db_scan processes) running or 
+--               that have been running.
+--
+--		 A scanner registers when it starts and sends
+--		 heartbeats while it runs. Every heartbeat renews the
+--		 leases of the work units the scanner is running.
+--
+-- Attributes:
+--
+-- @id: Scanner ID.
+-- @registered: Timestamp when the scanner was registered.
+-- @hostname: Hostname of the server running the scanner.
+-- @pid: Process ID of the scanner.
+-- @last_heartbeat: Timestamp of the last heartbeat of the scanner.
+-- @status: Status of the scanner [running|stopped].
+-- @stopped: Timestamp when the scanner was stopped.
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating table: scanner_worker]\n'
+
+CREATE TABLE scanner_worker(
+  id BIGSERIAL,
+  registered TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  hostname TEXT NOT NULL,
+  pid INTEGER NOT NULL,
+  last_heartbeat TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  status TEXT NOT NULL DEFAULT 'running',
+  stopped TIMESTAMP WITH TIME ZONE,
+  CHECK (status IN ('running','stopped'))
+);
+
+ALTER TABLE scanner_worker ADD PRIMARY KEY (id);
+ALTER TABLE scanner_worker OWNER TO nmap2db_role_rw;
 
 
 -- ------------------------------------------------------------
@@ -424,6 +596,8 @@ CREATE INDEX scan_report_elapsed_time_idx ON scan_report(elapsed_time);
 -- @service_product_version: Service product version (/ports/port/service/@version).
 -- @service_product_extrainfo: Service product extra information (/ports/port/service/@extrainfo).
 --
+-- registered has a BRIN index, as in host_info.
+--
 -- ------------------------------------------------------------
 
 \echo '\n# [Creating table:service_info]\n'
@@ -447,12 +621,57 @@ CREATE TABLE service_info(
 ALTER TABLE service_info ADD PRIMARY KEY (report_id,hostaddr,port_protocol,port_id);
 ALTER TABLE service_info OWNER TO nmap2db_role_rw;
 
-CREATE INDEX service_info_registered_idx ON service_info(registered);
+CREATE INDEX service_info_registered_idx ON service_info USING brin(registered);
 CREATE INDEX service_info_hostaddr_idx ON service_info(hostaddr);
-CREATE INDEX service_info_port_protocol_idx ON service_info(port_protocol);
 CREATE INDEX service_info_port_id_idx ON service_info(port_id);
-CREATE INDEX service_info_port_state_idx ON service_info(port_state);
-CREATE INDEX service_info_service_idx ON service_info(service);
+
+-- ------------------------------------------------------------
+-- Table: service_current
+--
+-- @Description: Last known state of every port/service scanned
+--               by nmap2db, one row per IP, protocol and port.
+--               It is updated by the triggers of host_info and
+--               service_info when a report is saved.
+--
+--               When a newer report of a host is saved, the
+--               ports of the protocols scanned by the report
+--               (scan_report.scan_protocols) that are not in the
+--               report are deleted. The ports of other protocols
+--               keep the values of the last report that scanned
+--               them.
+--
+-- Attributes:
+--
+-- The attributes of service_info from the newest report of the
+-- port.
+--
+-- @updated: Timestamp when the row was last updated.
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating table:service_current]\n'
+
+CREATE TABLE service_current(
+  hostaddr INET NOT NULL,
+  port_protocol TEXT NOT NULL,
+  port_id INTEGER NOT NULL,
+  report_id TEXT NOT NULL,
+  registered TIMESTAMP WITH TIME ZONE NOT NULL,
+  scan_jobid BIGINT,
+  port_state TEXT,
+  port_state_reason TEXT,
+  service TEXT,
+  service_method TEXT,
+  service_product TEXT,
+  service_product_version TEXT,
+  service_product_extrainfo TEXT,
+  updated TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+ALTER TABLE service_current ADD PRIMARY KEY (hostaddr,port_protocol,port_id);
+ALTER TABLE service_current OWNER TO nmap2db_role_rw;
+
+CREATE INDEX service_current_port_id_idx ON service_current(port_id);
 
 
 -- ------------------------------------------------------------
@@ -480,9 +699,21 @@ ALTER TABLE service_info ADD CONSTRAINT report_id
 ALTER TABLE service_info ADD CONSTRAINT hostaddr 
    FOREIGN KEY (hostaddr) REFERENCES hostaddress (hostaddr) MATCH FULL ON DELETE CASCADE;
 
+ALTER TABLE host_current ADD CONSTRAINT hostaddr 
+   FOREIGN KEY (hostaddr) REFERENCES hostaddress (hostaddr) MATCH FULL ON DELETE CASCADE;
+
+ALTER TABLE service_current ADD CONSTRAINT hostaddr 
+   FOREIGN KEY (hostaddr) REFERENCES host_current (hostaddr) MATCH FULL ON DELETE CASCADE;
+
 ALTER TABLE scan_report ADD CONSTRAINT scan_jobid
    FOREIGN KEY (scan_jobid) REFERENCES scan_job (id) MATCH FULL ON DELETE CASCADE;
 
+ALTER TABLE scan_job_unit ADD CONSTRAINT scan_jobid
+   FOREIGN KEY (scan_jobid) REFERENCES scan_job (id) MATCH FULL ON DELETE CASCADE;
+
+ALTER TABLE scan_job_unit ADD CONSTRAINT worker_id
+   FOREIGN KEY (worker_id) REFERENCES scanner_worker (id) ON DELETE SET NULL;
+
 -- ------------------------------------------------------------
 -- Function: disable_delete()
 --
@@ -626,7 +857,7 @@ AS $$
        --
 
        EXECUTE 'DELETE FROM hostaddress 
-       	        WHERE hostaddr IN (SELECT expand_network($1))'
+       	        WHERE hostaddr <<= $1'
        USING OLD.network_addr;
 
        RETURN NULL;
@@ -718,6 +949,14 @@ AS $$
        -- This function can be used by a trigger to decrease the 
        -- attributte total_scans when a hostaddr is deleted from host_info
        --
+       -- If nmap2db.partition_maintenance is 'on', the rows are only 
+       -- moved between partitions of host_info and total_scans does 
+       -- not change.
+       --
+
+       IF current_setting('nmap2db.partition_maintenance',true) = 'on' THEN
+          RETURN NULL;
+       END IF;
 
        EXECUTE 'UPDATE hostaddress
        	        SET 
@@ -732,6 +971,184 @@ $$;
 ALTER FUNCTION decrease_total_scans() OWNER TO nmap2db_role_rw;
 
 
+-- ------------------------------------------------------------
+-- Function: update_host_current()
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function update_host_current]\n'
+
+CREATE OR REPLACE FUNCTION update_host_current() RETURNS TRIGGER 
+LANGUAGE plpgsql 
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+    BEGIN
+       --
+       -- This function can be used by a statement trigger to update 
+       -- host_current with the hosts inserted in host_info. Only the 
+       -- newest row of every host is used, and an existing row is 
+       -- only replaced by a newer one, so reports can be saved in 
+       -- any order.
+       --
+       -- The ports of the protocols scanned by the new report of a
+       -- host, all its scaninfo elements, are deleted from 
+       -- service_current. Reports saved before scan_protocols 
+       -- existed only have scan_protocol. The ports found by 
+       -- the report are inserted again by update_service_current() 
+       -- when the report is saved in service_info.
+       --
+       -- It runs with nmap2db.client_side_ingest too, the rows saved
+       -- with COPY by nmap2db_scan fire it as well.
+       --
+
+    WITH newest_hosts AS (
+      SELECT DISTINCT ON (a.hostaddr) a.*
+      FROM new_host_info a
+      ORDER BY a.hostaddr, coalesce(a.scan_finished,a.registered) DESC
+    ),
+    updated_hosts AS (
+      INSERT INTO host_current AS b (hostaddr,
+                                     report_id,
+                                     registered,
+                                     scan_jobid,
+                                     scan_started,
+                                     scan_finished,
+                                     addrtype,
+                                     hostname,
+                                     hostname_type,
+                                     osclass_type,
+                                     osclass_vendor,
+                                     osclass_osfamily,
+                                     osclass_osgen,
+                                     osclass_accuracy,
+                                     osmatch_name,
+                                     osmatch_accuracy,
+                                     state,
+                                     state_reason)
+      SELECT c.hostaddr,
+             c.report_id,
+             c.registered,
+             c.scan_jobid,
+             c.scan_started,
+             c.scan_finished,
+             c.addrtype,
+             c.hostname,
+             c.hostname_type,
+             c.osclass_type,
+             c.osclass_vendor,
+             c.osclass_osfamily,
+             c.osclass_osgen,
+             c.osclass_accuracy,
+             c.osmatch_name,
+             c.osmatch_accuracy,
+             c.state,
+             c.state_reason
+      FROM newest_hosts c
+      ON CONFLICT (hostaddr) DO UPDATE
+      SET report_id = EXCLUDED.report_id,
+          registered = EXCLUDED.registered,
+          scan_jobid = EXCLUDED.scan_jobid,
+          scan_started = EXCLUDED.scan_started,
+          scan_finished = EXCLUDED.scan_finished,
+          addrtype = EXCLUDED.addrtype,
+          hostname = EXCLUDED.hostname,
+          hostname_type = EXCLUDED.hostname_type,
+          osclass_type = EXCLUDED.osclass_type,
+          osclass_vendor = EXCLUDED.osclass_vendor,
+          osclass_osfamily = EXCLUDED.osclass_osfamily,
+          osclass_osgen = EXCLUDED.osclass_osgen,
+          osclass_accuracy = EXCLUDED.osclass_accuracy,
+          osmatch_name = EXCLUDED.osmatch_name,
+          osmatch_accuracy = EXCLUDED.osmatch_accuracy,
+          state = EXCLUDED.state,
+          state_reason = EXCLUDED.state_reason,
+          updated = now()
+      WHERE coalesce(b.scan_finished,b.registered) <= coalesce(EXCLUDED.scan_finished,EXCLUDED.registered)
+      RETURNING b.hostaddr, b.report_id
+    )
+    DELETE FROM service_current d
+    USING updated_hosts e
+    JOIN scan_report f ON f.report_id = e.report_id
+    WHERE d.hostaddr = e.hostaddr
+    AND d.port_protocol = ANY(coalesce(f.scan_protocols,ARRAY[f.scan_protocol]))
+    AND d.report_id <> e.report_id;
+
+    RETURN NULL;
+    END;
+$$;
+
+ALTER FUNCTION update_host_current() OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: update_service_current()
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function update_service_current]\n'
+
+CREATE OR REPLACE FUNCTION update_service_current() RETURNS TRIGGER 
+LANGUAGE plpgsql 
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+    BEGIN
+       --
+       -- This function can be used by a statement trigger to update 
+       -- service_current with the ports inserted in service_info. 
+       -- Only the ports of the report saved in host_current for the 
+       -- host are used, the ports of older reports are ignored.
+       --
+
+    INSERT INTO service_current AS a (hostaddr,
+                                      port_protocol,
+                                      port_id,
+                                      report_id,
+                                      registered,
+                                      scan_jobid,
+                                      port_state,
+                                      port_state_reason,
+                                      service,
+                                      service_method,
+                                      service_product,
+                                      service_product_version,
+                                      service_product_extrainfo)
+    SELECT b.hostaddr,
+           b.port_protocol,
+           b.port_id,
+           b.report_id,
+           b.registered,
+           b.scan_jobid,
+           b.port_state,
+           b.port_state_reason,
+           b.service,
+           b.service_method,
+           b.service_product,
+           b.service_product_version,
+           b.service_product_extrainfo
+    FROM new_service_info b
+    JOIN host_current c ON c.hostaddr = b.hostaddr AND c.report_id = b.report_id
+    ON CONFLICT (hostaddr,port_protocol,port_id) DO UPDATE
+    SET report_id = EXCLUDED.report_id,
+        registered = EXCLUDED.registered,
+        scan_jobid = EXCLUDED.scan_jobid,
+        port_state = EXCLUDED.port_state,
+        port_state_reason = EXCLUDED.port_state_reason,
+        service = EXCLUDED.service,
+        service_method = EXCLUDED.service_method,
+        service_product = EXCLUDED.service_product,
+        service_product_version = EXCLUDED.service_product_version,
+        service_product_extrainfo = EXCLUDED.service_product_extrainfo,
+        updated = now();
+
+    RETURN NULL;
+    END;
+$$;
+
+ALTER FUNCTION update_service_current() OWNER TO nmap2db_role_rw;
+
+
 -- ------------------------------------------------------------
 -- Function: update_scan_job_last_execution()
 --
@@ -764,6 +1181,50 @@ $$;
 ALTER FUNCTION update_scan_job_last_execution(BIGINT) OWNER TO nmap2db_role_rw;
 
 
+-- ------------------------------------------------------------
+-- Function: notify_scan_job()
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function notify_scan_job]\n'
+
+CREATE OR REPLACE FUNCTION notify_scan_job() RETURNS TRIGGER 
+LANGUAGE plpgsql 
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+    BEGIN
+       --
+       -- This function can be used by a trigger to send a notification 
+       -- on the channel nmap2db_scan_job when a scan job is registered, 
+       -- activated or gets a new execution interval. Idle nmap2db_scan 
+       -- processes wait for these notifications instead of polling 
+       -- the table scan_job.
+       --
+       -- Updates of last_execution do not send a notification, they 
+       -- happen every time a scan job is assigned to a scanner.
+       --
+
+       IF NEW.active_status IS TRUE THEN
+
+          IF TG_OP = 'INSERT' THEN
+	     PERFORM pg_notify('nmap2db_scan_job',NEW.id::text);
+
+	  ELSIF OLD.active_status IS FALSE 
+	  	OR OLD.execution_interval <> NEW.execution_interval 
+	  	OR OLD.last_execution > NEW.last_execution THEN
+	     PERFORM pg_notify('nmap2db_scan_job',NEW.id::text);
+	  END IF;
+
+       END IF;
+
+       RETURN NULL;
+    END;
+$$;
+
+ALTER FUNCTION notify_scan_job() OWNER TO nmap2db_role_rw;
+
+
 -- ------------------------------------------------------------
 -- Function: check_scan_job_network()
 --
@@ -826,20 +1287,70 @@ AS $$
        -- from a NMAP scaning. The information extracted is used to update some attributes
        -- in the table scan_report.
        --	    
+       -- If nmap2db.client_side_ingest is 'on', nmap2db_scan has already
+       -- extracted these values.
+       --
+
+       IF current_setting('nmap2db.client_side_ingest',true) = 'on' THEN
+          RETURN NEW;
+       END IF;
+
+       --
+       -- nmap2db_scan calculates the MD5 value of the report while
+       -- it reads the output of nmap. We only calculate it here 
+       -- if it is not defined.
+       --
+
+       IF NEW.report_id IS NULL THEN
+          NEW.report_id := md5(NEW.xmlreport::text);
+       END IF;
 
-       NEW.report_id := md5(NEW.xmlreport::text);
-       NEW.started := to_timestamp((xpath('/nmaprun/@start', NEW.xmlreport))[1]::text::integer);
-       NEW.finished := to_timestamp((xpath('/nmaprun/runstats/finished/@time', NEW.xmlreport))[1]::text::integer);
-       NEW.elapsed_time := (xpath('/nmaprun/runstats/finished/@elapsed', NEW.xmlreport))[1]::text::numeric;
-       NEW.scan_type := (xpath('/nmaprun/scaninfo/@type', NEW.xmlreport))[1]::text;
-       NEW.scan_protocol := (xpath('/nmaprun/scaninfo/@protocol', NEW.xmlreport))[1]::text;
-       NEW.scan_numservices := (xpath('/nmaprun/scaninfo/@numservices', NEW.xmlreport))[1]::text::integer;
-       NEW.nmap_args := (xpath('/nmaprun/@args', NEW.xmlreport))[1]::text;
-       NEW.nmap_version :=  (xpath('/nmaprun/@version', NEW.xmlreport))[1]::text;
-       NEW.xmloutputversion :=  (xpath('/nmaprun/@xmloutputversion', NEW.xmlreport))[1]::text;
-       NEW.host_up := (xpath('/nmaprun/runstats/hosts/@up', NEW.xmlreport))[1]::text::integer;
-       NEW.host_down := (xpath('/nmaprun/runstats/hosts/@down', NEW.xmlreport))[1]::text::integer;
-       NEW.host_total := (xpath('/nmaprun/runstats/hosts/@total', NEW.xmlreport))[1]::text::integer;
+       --
+       -- All the values are extracted in one XMLTABLE pass.
+       --
+
+       SELECT to_timestamp(a.started),
+              to_timestamp(a.finished),
+              a.elapsed_time,
+              a.scan_type,
+              a.scan_protocol,
+              (SELECT array_agg(DISTINCT b.protocol)
+               FROM XMLTABLE('/nmaprun/scaninfo' PASSING NEW.xmlreport
+                             COLUMNS protocol TEXT PATH '@protocol') AS b
+               WHERE b.protocol IS NOT NULL),
+              a.scan_numservices,
+              a.nmap_args,
+              a.nmap_version,
+              a.xmloutputversion,
+              a.host_up,
+              a.host_down,
+              a.host_total
+       INTO NEW.started,
+            NEW.finished,
+            NEW.elapsed_time,
+            NEW.scan_type,
+            NEW.scan_protocol,
+            NEW.scan_protocols,
+            NEW.scan_numservices,
+            NEW.nmap_args,
+            NEW.nmap_version,
+            NEW.xmloutputversion,
+            NEW.host_up,
+            NEW.host_down,
+            NEW.host_total
+       FROM XMLTABLE('/nmaprun' PASSING NEW.xmlreport
+                     COLUMNS started INTEGER PATH '@start',
+                             finished INTEGER PATH 'runstats/finished/@time',
+                             elapsed_time NUMERIC PATH 'runstats/finished/@elapsed',
+                             scan_type TEXT PATH 'scaninfo[1]/@type',
+                             scan_protocol TEXT PATH 'scaninfo[1]/@protocol',
+                             scan_numservices INTEGER PATH 'scaninfo[1]/@numservices',
+                             nmap_args TEXT PATH '@args',
+                             nmap_version TEXT PATH '@version',
+                             xmloutputversion TEXT PATH '@xmloutputversion',
+                             host_up INTEGER PATH 'runstats/hosts/@up',
+                             host_down INTEGER PATH 'runstats/hosts/@down',
+                             host_total INTEGER PATH 'runstats/hosts/@total') AS a;
 
        RETURN NEW;
     END;
@@ -860,19 +1371,6 @@ LANGUAGE plpgsql
 SECURITY INVOKER
 SET search_path = public, pg_temp
 AS $$
- DECLARE
-  hosts_scanned RECORD;
-  services_scanned RECORD;
-  traceroute_hops INTEGER;
-  loop_ INTEGER;
-  check_hostaddr INTEGER;
-  hostaddr_ INET;
-  hostname_ TEXT;
-  adjacent_hostaddr_ INET;
-  adjacent_hostname_ TEXT;
-  is_adjacent_a_router_ BOOLEAN;		     
-  hops XML [];
-  
     BEGIN
       --
       -- This function can be used by a trigger to extract information from a XML report
@@ -883,133 +1381,209 @@ AS $$
       -- If the report delivers traceroute information, the table network_topology gets
       -- updated if necessary.
       --
+      -- Every element type (host, hostname, osmatch, osclass, port and 
+      -- traceroute hop) is extracted with one XMLTABLE pass over the 
+      -- report, and every table is updated with one INSERT ... SELECT.
+      -- The hostname and OS values of a host are aggregated in arrays 
+      -- using the address of the host, which is unique in a report.
+      --
+      -- Hostnames, OS names and service names are converted to 
+      -- lowercase, they are used in case sensitive searches. All
+      -- the other values are saved as nmap reports them.
+      --
+      -- If nmap2db.client_side_ingest is 'on', nmap2db_scan saves these
+      -- values itself with COPY.
+      --
+
+    IF current_setting('nmap2db.client_side_ingest',true) = 'on' THEN
+       RETURN NULL;
+    END IF;
 
-    -- 
-    -- Main loop. We get all the hosts in the report.
+    --
+    -- Hosts
     --
 
-    FOR hosts_scanned IN SELECT host_scanned::xml FROM (SELECT unnest(xpath('//host', NEW.xmlreport)) AS host_scanned) AS foo LOOP
-
-    	EXECUTE 'INSERT INTO host_info (report_id,
-			     	        scan_jobid,
-     				        scan_started,
-				        scan_finished,
-				        hostaddr,
-				        addrtype,
-				        hostname,
-				        hostname_type,
-					osclass_type,
-					osclass_vendor,
-					osclass_osfamily,
-					osclass_osgen,
-					osclass_accuracy,
-					osmatch_name,
-					osmatch_accuracy,
-				        state,
-				        state_reason)
-                 VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17)'
-
-        USING NEW.report_id,
-	      NEW.scan_jobid,
-	      to_timestamp((xpath('/host/@starttime', hosts_scanned.host_scanned))[1]::text::integer),
-	      to_timestamp((xpath('/host/@endtime', hosts_scanned.host_scanned))[1]::text::integer), 	     
-	      (xpath('/host/address/@addr', hosts_scanned.host_scanned))[1]::text::inet,
-	      (xpath('/host/address/@addrtype', hosts_scanned.host_scanned))[1]::text,
-	      (xpath('/host/hostnames/hostname/@name', hosts_scanned.host_scanned)),
-	      (xpath('/host/hostnames/hostname/@type', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/osclass/@type', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/osclass/@vendor', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/osclass/@osfamily', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/osclass/@osgen', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/osclass/@accuracy', hosts_scanned.host_scanned))::text[]::integer[],
-	      (xpath('/host/os/osmatch/@name', hosts_scanned.host_scanned)),
-	      (xpath('/host/os/osmatch/@accuracy', hosts_scanned.host_scanned))::text[]::integer[],
-	      (xpath('/host/status/@state', hosts_scanned.host_scanned))[1]::text,
-	      (xpath('/host/status/@reason', hosts_scanned.host_scanned))[1]::text;
-
-	 --
-	 -- Service loop. We get all the services for a host
-	 --
-
-         FOR services_scanned IN SELECT service_scanned::xml FROM (SELECT unnest(xpath('//ports/port',hosts_scanned.host_scanned)) AS service_scanned) AS foo2 LOOP   	
-
-
-             EXECUTE 'INSERT INTO service_info (report_id,
-	     	     	     	  	        scan_jobid,
-				                hostaddr,
-                                                port_protocol,
-				                port_id,
-				                port_state,
-				                port_state_reason,
-				                service,
-				                service_method,
-				                service_product,
- 				                service_product_version,
- 				                service_product_extrainfo
-				               )
-	              VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12)'
-
-            USING NEW.report_id,
-	    	  NEW.scan_jobid,
-		  (xpath('/host/address/@addr', hosts_scanned.host_scanned))[1]::text::inet,
-	          (xpath('/port/@protocol', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/@portid', services_scanned.service_scanned))[1]::text::integer,
-	          (xpath('/port/state/@state', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/state/@reason', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/service/@name', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/service/@method', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/service/@product', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/service/@version', services_scanned.service_scanned))[1]::text,
-	          (xpath('/port/service/@extrainfo', services_scanned.service_scanned))[1]::text;
-
-	  END LOOP;
-
- 	 --
-	 -- If the host has status up and traceroute information, the table network_topology gets
-      	 -- updated if necessary
-	 --
-
-	 IF (xpath('/host/status/@state', hosts_scanned.host_scanned))[1]::text = 'up' THEN
-
-	   traceroute_hops := array_length(xpath('/host/trace/*',hosts_scanned.host_scanned),1);
-
-	   IF traceroute_hops > 1 THEN
-
-	         FOR loop_ IN 1..(traceroute_hops) LOOP
-		  hops[loop_]:= (xpath('/host/trace/*',hosts_scanned.host_scanned))[loop_];
-		 END LOOP;
-	   
-	 	 FOR loop_ IN 1..(traceroute_hops-1) LOOP
-	     
-	          hostaddr_:= unnest(xpath('/hop/@ipaddr',hops[loop_]))::text::inet;
-		  hostname_ :=  unnest(xpath('/hop/@host',hops[loop_]))::text;
-	     	  adjacent_hostaddr_ :=  unnest(xpath('/hop/@ipaddr',hops[loop_+1]))::text::inet;
-		  adjacent_hostname_ :=  unnest(xpath('/hop/@host',hops[loop_+1]))::text;
-		  
-		  IF loop_ != (traceroute_hops-1) THEN
-		    is_adjacent_a_router_ := TRUE;  
-		  ELSIF loop_ = (traceroute_hops-1) THEN
-		    is_adjacent_a_router_ := FALSE;	  
-		  END IF;
-
-	     	  SELECT cnt INTO check_hostaddr FROM (SELECT count(*) AS cnt FROM network_topology WHERE hostaddr = hostaddr_ AND adjacent_hostaddr = adjacent_hostaddr_) AS foo3;
-
-	     	  IF check_hostaddr = 0 THEN	 
-		 		    
-	     	     EXECUTE 'INSERT INTO network_topology (hostaddr,hostname,adjacent_hostaddr,adjacent_hostname,is_adjacent_a_router) VALUES ($1,$2,$3,$4,$5)'
-                     USING hostaddr_, 
-		       	   hostname_,
-		           adjacent_hostaddr_,
-			   adjacent_hostname_,
-			   is_adjacent_a_router_;
-	          END IF;
-
-	 	 END LOOP;
-
-           END IF;
-          END IF;
-    END LOOP;
-    
+    WITH hosts AS (
+      SELECT a.*
+      FROM XMLTABLE('//host' PASSING NEW.xmlreport
+                    COLUMNS host_ordinality FOR ORDINALITY,
+                            scan_started INTEGER PATH '@starttime',
+                            scan_finished INTEGER PATH '@endtime',
+                            hostaddr INET PATH 'address[1]/@addr',
+                            addrtype TEXT PATH 'address[1]/@addrtype',
+                            state TEXT PATH 'status/@state',
+                            state_reason TEXT PATH 'status/@reason') AS a
+    ),
+    hostnames AS (
+      SELECT b.hostaddr,
+             array_agg(lower(b.hostname) ORDER BY b.hostname_ordinality) FILTER (WHERE b.hostname IS NOT NULL) AS hostname,
+             array_agg(lower(b.hostname_type) ORDER BY b.hostname_ordinality) FILTER (WHERE b.hostname_type IS NOT NULL) AS hostname_type
+      FROM XMLTABLE('//host/hostnames/hostname' PASSING NEW.xmlreport
+                    COLUMNS hostname_ordinality FOR ORDINALITY,
+                            hostaddr INET PATH '../../address[1]/@addr',
+                            hostname TEXT PATH '@name',
+                            hostname_type TEXT PATH '@type') AS b
+      GROUP BY b.hostaddr
+    ),
+    osmatches AS (
+      SELECT c.hostaddr,
+             array_agg(lower(c.osmatch_name) ORDER BY c.osmatch_ordinality) FILTER (WHERE c.osmatch_name IS NOT NULL) AS osmatch_name,
+             array_agg(c.osmatch_accuracy ORDER BY c.osmatch_ordinality) FILTER (WHERE c.osmatch_accuracy IS NOT NULL) AS osmatch_accuracy
+      FROM XMLTABLE('//host/os/osmatch' PASSING NEW.xmlreport
+                    COLUMNS osmatch_ordinality FOR ORDINALITY,
+                            hostaddr INET PATH '../../address[1]/@addr',
+                            osmatch_name TEXT PATH '@name',
+                            osmatch_accuracy INTEGER PATH '@accuracy') AS c
+      GROUP BY c.hostaddr
+    ),
+    osclasses AS (
+      SELECT d.hostaddr,
+             array_agg(lower(d.osclass_type) ORDER BY d.osclass_ordinality) FILTER (WHERE d.osclass_type IS NOT NULL) AS osclass_type,
+             array_agg(lower(d.osclass_vendor) ORDER BY d.osclass_ordinality) FILTER (WHERE d.osclass_vendor IS NOT NULL) AS osclass_vendor,
+             array_agg(lower(d.osclass_osfamily) ORDER BY d.osclass_ordinality) FILTER (WHERE d.osclass_osfamily IS NOT NULL) AS osclass_osfamily,
+             array_agg(lower(d.osclass_osgen) ORDER BY d.osclass_ordinality) FILTER (WHERE d.osclass_osgen IS NOT NULL) AS osclass_osgen,
+             array_agg(d.osclass_accuracy ORDER BY d.osclass_ordinality) FILTER (WHERE d.osclass_accuracy IS NOT NULL) AS osclass_accuracy
+      FROM XMLTABLE('//host/os/osmatch/osclass' PASSING NEW.xmlreport
+                    COLUMNS osclass_ordinality FOR ORDINALITY,
+                            hostaddr INET PATH '../../../address[1]/@addr',
+                            osclass_type TEXT PATH '@type',
+                            osclass_vendor TEXT PATH '@vendor',
+                            osclass_osfamily TEXT PATH '@osfamily',
+                            osclass_osgen TEXT PATH '@osgen',
+                            osclass_accuracy INTEGER PATH '@accuracy') AS d
+      GROUP BY d.hostaddr
+    )
+    INSERT INTO host_info (report_id,
+                           scan_jobid,
+                           scan_started,
+                           scan_finished,
+                           hostaddr,
+                           addrtype,
+                           hostname,
+                           hostname_type,
+                           osclass_type,
+                           osclass_vendor,
+                           osclass_osfamily,
+                           osclass_osgen,
+                           osclass_accuracy,
+                           osmatch_name,
+                           osmatch_accuracy,
+                           state,
+                           state_reason)
+    SELECT NEW.report_id,
+           NEW.scan_jobid,
+           to_timestamp(e.scan_started),
+           to_timestamp(e.scan_finished),
+           e.hostaddr,
+           e.addrtype,
+           coalesce(f.hostname,'{}'),
+           coalesce(f.hostname_type,'{}'),
+           coalesce(h.osclass_type,'{}'),
+           coalesce(h.osclass_vendor,'{}'),
+           coalesce(h.osclass_osfamily,'{}'),
+           coalesce(h.osclass_osgen,'{}'),
+           coalesce(h.osclass_accuracy,'{}'),
+           coalesce(g.osmatch_name,'{}'),
+           coalesce(g.osmatch_accuracy,'{}'),
+           e.state,
+           e.state_reason
+    FROM hosts e
+    LEFT JOIN hostnames f ON f.hostaddr = e.hostaddr
+    LEFT JOIN osmatches g ON g.hostaddr = e.hostaddr
+    LEFT JOIN osclasses h ON h.hostaddr = e.hostaddr
+    ORDER BY e.host_ordinality;
+
+    --
+    -- Services
+    --
+
+    INSERT INTO service_info (report_id,
+                              scan_jobid,
+                              hostaddr,
+                              port_protocol,
+                              port_id,
+                              port_state,
+                              port_state_reason,
+                              service,
+                              service_method,
+                              service_product,
+                              service_product_version,
+                              service_product_extrainfo)
+    SELECT NEW.report_id,
+           NEW.scan_jobid,
+           a.hostaddr,
+           a.port_protocol,
+           a.port_id,
+           a.port_state,
+           a.port_state_reason,
+           lower(a.service),
+           a.service_method,
+           a.service_product,
+           a.service_product_version,
+           a.service_product_extrainfo
+    FROM XMLTABLE('//host/ports/port' PASSING NEW.xmlreport
+                  COLUMNS hostaddr INET PATH '../../address[1]/@addr',
+                          port_protocol TEXT PATH '@protocol',
+                          port_id INTEGER PATH '@portid',
+                          port_state TEXT PATH 'state/@state',
+                          port_state_reason TEXT PATH 'state/@reason',
+                          service TEXT PATH 'service/@name',
+                          service_method TEXT PATH 'service/@method',
+                          service_product TEXT PATH 'service/@product',
+                          service_product_version TEXT PATH 'service/@version',
+                          service_product_extrainfo TEXT PATH 'service/@extrainfo') AS a;
+
+    --
+    -- Network topology. The traceroute hops of the hosts with status 
+    -- up are extracted in one pass, and every hop is paired with the 
+    -- next hop of the same host. The adjacent hop is a router if it 
+    -- is not the last hop.
+    --
+    -- The links of all the hosts of the report are saved with one
+    -- upsert. A link can be in several traceroutes of the report, 
+    -- so they are grouped first (ON CONFLICT can not update a row 
+    -- twice), and inserted in the order of the primary key so 
+    -- concurrent scanners lock the rows in the same order.
+    --
+
+    WITH hops AS (
+      SELECT a.*
+      FROM XMLTABLE('//host[status/@state = ''up'']/trace/*' PASSING NEW.xmlreport
+                    COLUMNS hop_ordinality FOR ORDINALITY,
+                            host_hostaddr INET PATH '../../address[1]/@addr',
+                            hostaddr INET PATH '@ipaddr',
+                            hostname TEXT PATH '@host') AS a
+    ),
+    adjacent_hops AS (
+      SELECT b.hostaddr,
+             b.hostname,
+             lead(b.hostaddr) OVER w AS adjacent_hostaddr,
+             lead(b.hostname) OVER w AS adjacent_hostname,
+             lead(b.hop_ordinality,2) OVER w IS NOT NULL AS is_adjacent_a_router
+      FROM hops b
+      WINDOW w AS (PARTITION BY b.host_hostaddr ORDER BY b.hop_ordinality)
+    )
+    INSERT INTO network_topology (hostaddr,hostname,adjacent_hostaddr,adjacent_hostname,is_adjacent_a_router,first_seen,last_seen,times_seen)
+    SELECT c.hostaddr,
+           max(lower(c.hostname)),
+           c.adjacent_hostaddr,
+           max(lower(c.adjacent_hostname)),
+           bool_or(c.is_adjacent_a_router),
+           now(),
+           now(),
+           count(*)
+    FROM adjacent_hops c
+    WHERE c.hostaddr IS NOT NULL
+    AND c.adjacent_hostaddr IS NOT NULL
+    GROUP BY c.hostaddr,c.adjacent_hostaddr
+    ORDER BY c.hostaddr,c.adjacent_hostaddr
+    ON CONFLICT (hostaddr,adjacent_hostaddr) DO UPDATE
+    SET hostname = coalesce(EXCLUDED.hostname,network_topology.hostname),
+        adjacent_hostname = coalesce(EXCLUDED.adjacent_hostname,network_topology.adjacent_hostname),
+        is_adjacent_a_router = network_topology.is_adjacent_a_router OR EXCLUDED.is_adjacent_a_router,
+        last_seen = greatest(network_topology.last_seen,EXCLUDED.last_seen),
+        times_seen = network_topology.times_seen + EXCLUDED.times_seen;
+
     RETURN NULL;
     END;
 $$;
@@ -1032,53 +1606,32 @@ ALTER FUNCTION extract_hosts_and_services_values() OWNER TO nmap2db_role_rw;
 \echo '\n# [Creating function expand_network]\n'
 
 CREATE OR REPLACE FUNCTION expand_network(network_ CIDR) RETURNS SETOF INET 
-LANGUAGE plpgsql 
+LANGUAGE sql 
 SECURITY INVOKER
 SET search_path = public, pg_temp
 AS $$
- DECLARE
-  hostmask INTEGER [];
-  network INTEGER [];
-
-  byte_1 INTEGER;	
-  byte_2 INTEGER;
-  byte_3 INTEGER;
-  byte_4 INTEGER;
-
- BEGIN
   --
   -- This function can be used to generate all the IPs in a network.
-  -- It only supports IPv4. IPv6 is in the TODO list. 
+  --
+  -- IPv4 networks do not include the network and broadcast 
+  -- addresses (except /31 and /32). Only IPv6 networks with up 
+  -- to 65536 IPs (/112 or longer) are expanded.
+  --
+  -- nmap2db_scan does not use this function, the targets of 
+  -- a scan are generated by the scanner.
   --
 
-  IF family(network_) = 4 THEN
-
-   SELECT INTO hostmask host FROM (SELECT regexp_split_to_array(host(hostmask(network_)),E'\\.')::integer [] AS host) host;
-   SELECT INTO network net FROM (SELECT regexp_split_to_array(host(network(network_)),E'\\.')::integer [] AS net) net;
-
-   FOR byte_1 IN 0..hostmask[1] LOOP
-      FOR byte_2 IN 0..hostmask[2] LOOP
-          FOR byte_3 IN 0..hostmask[3] LOOP
-
-	      -- Do not generate network & broadcast values: 1..hostmask[4]-1
-
-              FOR byte_4 IN 1..hostmask[4]-1 LOOP 
-	           RETURN QUERY SELECT (network[1]+byte_1 || '.' ||  network[2]+byte_2 || '.' || network[3]+byte_3 || '.' || network[4]+byte_4)::inet; 
-              END LOOP;    
-          END LOOP;    
-      END LOOP;    
-   END LOOP;
-  
-   --
-   -- If the netmask of the network is /32 there is only an IP to return.
-   -- 
-
-   IF  hostmask[1] = 0 AND hostmask[2] = 0 AND  hostmask[3] = 0 AND  hostmask[4] = 0 THEN
-     RETURN QUERY SELECT (network[1] || '.' ||  network[2] || '.' || network[3] || '.' || network[4])::inet; 
-   END IF;
+  SELECT a.first_hostaddr + g.offset_
+  FROM (SELECT CASE WHEN family($1) = 4 AND masklen($1) < 31 THEN set_masklen($1::inet,32) + 1
+                    ELSE set_masklen($1::inet,CASE WHEN family($1) = 4 THEN 32 ELSE 128 END)
+               END AS first_hostaddr,
+               CASE WHEN family($1) = 4 AND masklen($1) < 31 THEN set_masklen(broadcast($1),32) - 1
+                    ELSE set_masklen(broadcast($1),CASE WHEN family($1) = 4 THEN 32 ELSE 128 END)
+               END AS last_hostaddr
+        WHERE family($1) = 4 OR masklen($1) >= 112) a,
+       generate_series(0, a.last_hostaddr - a.first_hostaddr) AS g(offset_)
+  ORDER BY g.offset_;
 
-  END IF;
-END;
 $$;
 
 ALTER FUNCTION expand_network(CIDR) OWNER TO nmap2db_role_rw;
@@ -1155,55 +1708,732 @@ ALTER FUNCTION get_next_scan_job() OWNER TO nmap2db_role_rw;
 
 
 -- ------------------------------------------------------------
--- Function: get_scan_job_network_addr()
+-- Function: claim_scan_jobs()
 --
 -- Parameters:
--- @scan_job_id (BIGINT): Scan job ID
+-- @max_jobs_ (INTEGER): Maximum number of scan jobs to claim
 --
--- Return: network_addr for a scan job
+-- Return: SET of (scan job ID, network_addr, scan_id, NMAP arguments)
 -- ------------------------------------------------------------
 
-\echo '\n# [Creating function get_scan_job_network_addr]\n'
+\echo '\n# [Creating function claim_scan_jobs]\n'
 
-CREATE OR REPLACE FUNCTION get_scan_job_network_addr(BIGINT) RETURNS CIDR 
-LANGUAGE sql
-SECURITY INVOKER
-SET search_path = public, pg_temp 
-AS $$
- -- 
- -- This function returns the network_addr for a scan job definition.
+CREATE OR REPLACE FUNCTION claim_scan_jobs(max_jobs_ INTEGER) RETURNS TABLE (scan_jobid BIGINT, network_addr CIDR, scan_id TEXT, args TEXT)
+ LANGUAGE sql
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+
+ --
+ -- This function assigns up to max_jobs_ scan jobs that have to be 
+ -- executed to the caller. The jobs with the highest delay according 
+ -- to the attribute execution_interval are assigned first.
+ --
+ -- Jobs locked by other scanners are skipped with SKIP LOCKED, so 
+ -- concurrent scanners never wait for each other. Everything a 
+ -- scanner needs to run the jobs is returned in one row set.
+ --
+ -- nmap2db_scan claims work units with claim_scan_job_units(). 
+ -- This function is kept for benchmarks/bench_claim_contention.py.
  --
 
-  SELECT a.network_addr 
-  FROM scan_job a 
-  WHERE a.id = $1;
+  WITH due_jobs AS (
+    SELECT a.id
+    FROM scan_job a
+    WHERE (now() - a.last_execution) >= a.execution_interval
+    AND a.active_status IS TRUE
+    ORDER BY (now() - a.last_execution) DESC
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE scan_job b
+  SET last_execution = now()
+  FROM due_jobs c, scan_definition d
+  WHERE b.id = c.id
+  AND b.scan_id = d.scan_id
+  RETURNING b.id, b.network_addr, b.scan_id, d.args;
 
 $$;
 
-ALTER FUNCTION get_scan_job_network_addr(BIGINT) OWNER TO nmap2db_role_rw;
+ALTER FUNCTION claim_scan_jobs(INTEGER) OWNER TO nmap2db_role_rw;
 
 
 -- ------------------------------------------------------------
--- Function: get_scan_job_args()
+-- Function: split_due_scan_jobs()
 --
 -- Parameters:
--- @scan_job_id (BIGINT): Scan job ID
+-- @unit_size_ (INTEGER): Maximum number of IPs in a work unit
 --
--- Return: NMAP arguments for a scan job
+-- Return: Number of work units registered
 -- ------------------------------------------------------------
 
-\echo '\n# [Creating function get_scan_job_args]\n'
+\echo '\n# [Creating function split_due_scan_jobs]\n'
+
+CREATE OR REPLACE FUNCTION split_due_scan_jobs(unit_size_ INTEGER) RETURNS BIGINT
+ LANGUAGE plpgsql 
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+ DECLARE
+  num_units BIGINT;
+ BEGIN
 
-CREATE OR REPLACE FUNCTION get_scan_job_args(BIGINT) RETURNS TEXT 
-LANGUAGE sql
-SECURITY INVOKER
-SET search_path = public, pg_temp 
-AS $$
  --
- -- This function returns the NMAP arguments for a scan job definition.
+ -- This function splits the scan jobs that are due in work units
+ -- of up to unit_size_ consecutive IPs. A scan job is not split 
+ -- again while it has work units that are not done.
+ --
+ -- IPv4 networks do not include the network and broadcast 
+ -- addresses (except /31 and /32). IPv6 networks get a 
+ -- single work unit with the whole network.
  --
 
-  SELECT b.args 
+  WITH due_jobs AS (
+    SELECT a.id,
+           a.network_addr
+    FROM scan_job a
+    WHERE (now() - a.last_execution) >= a.execution_interval
+    AND a.active_status IS TRUE
+    AND NOT EXISTS (SELECT 1 FROM scan_job_unit u WHERE u.scan_jobid = a.id AND u.status <> 'done')
+    ORDER BY (now() - a.last_execution) DESC
+    FOR UPDATE SKIP LOCKED
+  ),
+  executed_jobs AS (
+    UPDATE scan_job b
+    SET last_execution = now()
+    FROM due_jobs c
+    WHERE b.id = c.id
+    RETURNING b.id
+  ),
+  removed_units AS (
+    DELETE FROM scan_job_unit d
+    USING executed_jobs e
+    WHERE d.scan_jobid = e.id
+    AND d.status = 'done'
+  ),
+  host_ranges AS (
+    SELECT id,
+           CASE WHEN masklen(network_addr) < 31 THEN set_masklen(network_addr::inet,32) + 1
+                ELSE set_masklen(network_addr::inet,32)
+           END AS first_hostaddr,
+           CASE WHEN masklen(network_addr) < 31 THEN set_masklen(broadcast(network_addr),32) - 1
+                ELSE set_masklen(broadcast(network_addr),32)
+           END AS last_hostaddr
+    FROM due_jobs
+    WHERE family(network_addr) = 4
+  ),
+  new_units AS (
+    INSERT INTO scan_job_unit (scan_jobid,first_hostaddr,last_hostaddr)
+    SELECT f.id,
+           f.first_hostaddr + g.offset_,
+           f.first_hostaddr + least(g.offset_ + unit_size_ - 1, f.last_hostaddr - f.first_hostaddr)
+    FROM host_ranges f,
+         generate_series(0, f.last_hostaddr - f.first_hostaddr, unit_size_) AS g(offset_)
+    UNION ALL
+    SELECT h.id,
+           set_masklen(h.network_addr::inet,128),
+           set_masklen(broadcast(h.network_addr),128)
+    FROM due_jobs h
+    WHERE family(h.network_addr) = 6
+    RETURNING 1
+  )
+  SELECT count(*) INTO num_units FROM new_units;
+
+  --
+  -- Wake up idle scanners so they can share the new work units.
+  --
+
+  IF num_units > 0 THEN
+    PERFORM pg_notify('nmap2db_scan_job','units');
+  END IF;
+
+  RETURN num_units;
+ END;
+$$;
+
+ALTER FUNCTION split_due_scan_jobs(INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: claim_scan_job_units()
+--
+-- Parameters:
+-- @max_units_ (INTEGER): Maximum number of work units to claim
+-- @unit_size_ (INTEGER): Maximum number of IPs in a work unit
+-- @worker_id_ (BIGINT): Scanner ID
+-- @lease_duration_ (INTERVAL): Duration of the lease on the 
+--                              claimed work units
+--
+-- Return: SET of (work unit ID, scan job ID, first IP to scan, 
+--         last IP, scan_id, NMAP arguments)
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function claim_scan_job_units]\n'
+
+CREATE OR REPLACE FUNCTION claim_scan_job_units(max_units_ INTEGER, unit_size_ INTEGER, worker_id_ BIGINT, lease_duration_ INTERVAL) RETURNS TABLE (unit_id BIGINT, scan_jobid BIGINT, first_hostaddr INET, last_hostaddr INET, scan_id TEXT, args TEXT)
+ LANGUAGE plpgsql 
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+ BEGIN
+
+ --
+ -- This function splits the scan jobs that are due in work units
+ -- and assigns up to max_units_ pending work units to the caller.
+ -- Work units locked by other scanners are skipped.
+ --
+ -- The caller gets a lease of lease_duration_ on the work units,
+ -- renewed by its heartbeats. Running work units with an expired
+ -- lease are claimed again at once, their scanner has stopped or
+ -- crashed. The new scanner starts with the IP after the last 
+ -- checkpoint, so the IPs already done are not scanned again and
+ -- the rest of the range is not skipped.
+ --
+
+  PERFORM split_due_scan_jobs(unit_size_);
+
+  RETURN QUERY
+  WITH pending_units AS (
+    SELECT a.id
+    FROM scan_job_unit a
+    WHERE a.status = 'pending'
+    OR (a.status = 'running' AND a.lease_expires < now())
+    ORDER BY a.id
+    LIMIT max_units_
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE scan_job_unit b
+  SET status = 'running',
+      claimed = now(),
+      checkpointed = NULL,
+      worker_id = worker_id_,
+      lease_expires = now() + lease_duration_
+  FROM pending_units c, scan_job d, scan_definition e
+  WHERE b.id = c.id
+  AND b.scan_jobid = d.id
+  AND d.scan_id = e.scan_id
+  RETURNING b.id, b.scan_jobid, coalesce(b.checkpoint_hostaddr + 1,b.first_hostaddr), b.last_hostaddr, d.scan_id, e.args;
+
+ END;
+$$;
+
+ALTER FUNCTION claim_scan_job_units(INTEGER,INTEGER,BIGINT,INTERVAL) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: register_scanner_worker()
+--
+-- Parameters:
+-- @hostname_ (TEXT): Hostname of the server running the scanner
+-- @pid_ (INTEGER): Process ID of the scanner
+--
+-- Return: Scanner ID
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function register_scanner_worker]\n'
+
+CREATE OR REPLACE FUNCTION register_scanner_worker(hostname_ TEXT, pid_ INTEGER) RETURNS BIGINT
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+
+  INSERT INTO scanner_worker (hostname,pid)
+  VALUES ($1,$2)
+  RETURNING id;
+
+$$;
+
+ALTER FUNCTION register_scanner_worker(TEXT,INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: scanner_worker_heartbeat()
+--
+-- Parameters:
+-- @worker_id_ (BIGINT): Scanner ID
+-- @lease_duration_ (INTERVAL): New duration of the leases of
+--                              the scanner
+--
+-- Return: Number of work units with a renewed lease
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function scanner_worker_heartbeat]\n'
+
+CREATE OR REPLACE FUNCTION scanner_worker_heartbeat(worker_id_ BIGINT, lease_duration_ INTERVAL) RETURNS BIGINT
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function registers a heartbeat of a scanner and renews 
+ -- the leases on the work units it is running. Work units that
+ -- have been claimed again by another scanner after the lease
+ -- expired are not renewed.
+ --
+
+  UPDATE scanner_worker
+  SET last_heartbeat = now(),
+      status = 'running',
+      stopped = NULL
+  WHERE id = $1;
+
+  WITH renewed_units AS (
+    UPDATE scan_job_unit
+    SET lease_expires = now() + $2
+    WHERE worker_id = $1
+    AND status = 'running'
+    RETURNING 1
+  )
+  SELECT count(*) FROM renewed_units;
+
+$$;
+
+ALTER FUNCTION scanner_worker_heartbeat(BIGINT,INTERVAL) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: unregister_scanner_worker()
+--
+-- Parameters:
+-- @worker_id_ (BIGINT): Scanner ID
+--
+-- Return: Number of work units returned to the queue
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function unregister_scanner_worker]\n'
+
+CREATE OR REPLACE FUNCTION unregister_scanner_worker(worker_id_ BIGINT) RETURNS BIGINT
+ LANGUAGE plpgsql 
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+ DECLARE
+  num_units BIGINT;
+ BEGIN
+
+ --
+ -- This function marks a scanner as stopped. The work units it 
+ -- was running go back to the queue at once, other scanners 
+ -- resume them from their last checkpoint.
+ --
+
+  UPDATE scanner_worker
+  SET status = 'stopped',
+      stopped = now()
+  WHERE id = worker_id_;
+
+  WITH released_units AS (
+    UPDATE scan_job_unit
+    SET status = 'pending',
+        worker_id = NULL,
+        lease_expires = NULL
+    WHERE worker_id = worker_id_
+    AND status = 'running'
+    RETURNING 1
+  )
+  SELECT count(*) INTO num_units FROM released_units;
+
+  --
+  -- Wake up idle scanners so they can take the released work units.
+  --
+
+  IF num_units > 0 THEN
+    PERFORM pg_notify('nmap2db_scan_job','units');
+  END IF;
+
+  RETURN num_units;
+ END;
+$$;
+
+ALTER FUNCTION unregister_scanner_worker(BIGINT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: release_scan_job_unit()
+--
+-- Parameters:
+-- @unit_id_ (BIGINT): Work unit ID
+-- @worker_id_ (BIGINT): Scanner ID
+--
+-- Return: TRUE if the scanner was running the work unit
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function release_scan_job_unit]\n'
+
+CREATE OR REPLACE FUNCTION release_scan_job_unit(unit_id_ BIGINT, worker_id_ BIGINT) RETURNS BOOLEAN
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function is used by a scanner that can not run a work
+ -- unit. The heartbeats of the scanner do not renew the lease
+ -- on the work unit anymore, and the work unit is claimed again
+ -- from its last checkpoint when the lease expires, as if the 
+ -- scanner had stopped. The lease is not cut short, so a work 
+ -- unit that fails again is not claimed in a loop.
+ --
+
+  WITH released_units AS (
+    UPDATE scan_job_unit
+    SET worker_id = NULL
+    WHERE id = $1
+    AND worker_id = $2
+    AND status = 'running'
+    RETURNING 1
+  )
+  SELECT count(*) > 0 FROM released_units;
+
+$$;
+
+ALTER FUNCTION release_scan_job_unit(BIGINT,BIGINT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: checkpoint_scan_job_unit()
+--
+-- Parameters:
+-- @unit_id_ (BIGINT): Work unit ID
+-- @worker_id_ (BIGINT): Scanner running the work unit
+-- @hostaddr_ (INET): Last IP scanned and saved. NULL if there 
+--                    are not new IPs done.
+--
+-- Return: FALSE if the scanner does not hold the lease on the
+--         work unit anymore
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function checkpoint_scan_job_unit]\n'
+
+CREATE OR REPLACE FUNCTION checkpoint_scan_job_unit(unit_id_ BIGINT, worker_id_ BIGINT, hostaddr_ INET) RETURNS BOOLEAN
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function saves the progress of a running work unit. All
+ -- the IPs of the range up to hostaddr_ are done. The checkpoint
+ -- never goes back, checkpoints can arrive out of order from the
+ -- spool of a scanner.
+ --
+ -- Only the scanner holding the lease can save a checkpoint. A 
+ -- scanner that has lost its lease, or drains its spool after 
+ -- another scanner has claimed the work unit again, can not move 
+ -- the checkpoint of the other scanner forward.
+ --
+
+  WITH checkpointed_units AS (
+    UPDATE scan_job_unit
+    SET checkpoint_hostaddr = greatest(checkpoint_hostaddr,$3),
+        checkpointed = now()
+    WHERE id = $1
+    AND worker_id = $2
+    AND status = 'running'
+    RETURNING 1
+  )
+  SELECT count(*) > 0 FROM checkpointed_units;
+
+$$;
+
+ALTER FUNCTION checkpoint_scan_job_unit(BIGINT,BIGINT,INET) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: finish_scan_job_unit()
+--
+-- Parameters:
+-- @unit_id_ (BIGINT): Work unit ID
+-- @worker_id_ (BIGINT): Scanner running the work unit
+--
+-- Return: TRUE if all the work units of the scan job are done,
+--         NULL if the scanner does not hold the lease on the 
+--         work unit anymore
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function finish_scan_job_unit]\n'
+
+CREATE OR REPLACE FUNCTION finish_scan_job_unit(unit_id_ BIGINT, worker_id_ BIGINT) RETURNS BOOLEAN
+ LANGUAGE plpgsql 
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+ DECLARE
+  scan_jobid_ BIGINT;
+  job_completed BOOLEAN;
+ BEGIN
+
+ --
+ -- This function marks a work unit as done. If it was the last work 
+ -- unit of its scan job, the execution of the scan job is complete.
+ --
+ -- The scan job row is locked first, so two scanners finishing the 
+ -- last two work units at the same time can not miss the completion.
+ --
+ -- If the scan job is already due when it is complete, the scanners 
+ -- waiting for work get a notification.
+ --
+ -- Only the scanner holding the lease can finish a work unit. If 
+ -- another scanner has claimed it again, the work unit is not done
+ -- until that scanner finishes it.
+ --
+
+  SELECT a.scan_jobid INTO scan_jobid_ FROM scan_job_unit a WHERE a.id = unit_id_;
+
+  IF scan_jobid_ IS NULL THEN
+    RETURN FALSE;
+  END IF;
+
+  PERFORM 1 FROM scan_job WHERE id = scan_jobid_ FOR UPDATE;
+
+  UPDATE scan_job_unit
+  SET status = 'done',
+      finished = now()
+  WHERE id = unit_id_
+  AND worker_id = worker_id_
+  AND status = 'running';
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT NOT EXISTS (SELECT 1 FROM scan_job_unit WHERE scan_jobid = scan_jobid_ AND status <> 'done') INTO job_completed;
+
+  IF job_completed THEN
+    UPDATE scan_job SET last_completion = now() WHERE id = scan_jobid_;
+
+    --
+    -- A scan job that took longer than its execution interval is
+    -- due at once. The idle scanners are not waiting for it.
+    --
+
+    IF EXISTS (SELECT 1 FROM scan_job WHERE id = scan_jobid_ AND active_status IS TRUE AND (now() - last_execution) >= execution_interval) THEN
+      PERFORM pg_notify('nmap2db_scan_job',scan_jobid_::text);
+    END IF;
+  END IF;
+
+  RETURN job_completed;
+ END;
+$$;
+
+ALTER FUNCTION finish_scan_job_unit(BIGINT,BIGINT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_known_hostaddrs()
+--
+-- Parameters:
+-- @first_hostaddr_ (INET): First IP in the range
+-- @last_hostaddr_ (INET): Last IP in the range
+-- @max_hostaddrs_ (INTEGER): Maximum number of IPs returned
+--
+-- Return: SET of up to max_hostaddrs_ IPs registered in the range
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_known_hostaddrs]\n'
+
+CREATE OR REPLACE FUNCTION get_known_hostaddrs(first_hostaddr_ INET, last_hostaddr_ INET, max_hostaddrs_ INTEGER) RETURNS SETOF TEXT
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function returns the IPs in a range that are registered 
+ -- in hostaddress. nmap2db_scan uses it for IPv6 work units that 
+ -- are too large to scan every IP. The IPs of these networks are
+ -- not generated when the network is registered, they have to be
+ -- registered with register_hostaddrs() (register_hostaddr in the
+ -- nmap2db shell).
+ --
+ -- The IPs are returned in order, so the work unit checkpoints
+ -- can be used with them. nmap2db_scan reads them in pages of 
+ -- max_hostaddrs_ IPs, every page starts after the last IP of 
+ -- the previous one.
+ --
+
+  SELECT host(a.hostaddr)
+  FROM hostaddress a
+  WHERE a.hostaddr >= $1
+  AND a.hostaddr <= $2
+  ORDER BY a.hostaddr
+  LIMIT $3;
+
+$$;
+
+ALTER FUNCTION get_known_hostaddrs(INET,INET,INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_next_scan_job_due()
+--
+-- Parameters:
+--
+-- Return: Seconds until the next active scan job is due or 
+--         the next lease on a work unit expires. 0 if a job is 
+--         already due or there are pending work units, and NULL
+--         if there are not active scan jobs.
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_next_scan_job_due]\n'
+
+CREATE OR REPLACE FUNCTION get_next_scan_job_due() RETURNS NUMERIC
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ -- 
+ -- This function is used by nmap2db_scan to know how long it can 
+ -- sleep waiting for a notification before the next scan job is due.
+ --
+ -- Scan jobs with work units not done are not split again when they
+ -- are due (split_due_scan_jobs()), so they are not used here. 
+ -- finish_scan_job_unit() sends a notification when such a job is
+ -- complete and already due.
+ --
+
+  SELECT CASE 
+          WHEN EXISTS (SELECT 1 FROM scan_job_unit WHERE status = 'pending') THEN 0
+          ELSE least((SELECT greatest(0,extract(epoch FROM min(a.last_execution + a.execution_interval - now())))::numeric
+                      FROM scan_job a
+                      WHERE a.active_status IS TRUE
+                      AND NOT EXISTS (SELECT 1 FROM scan_job_unit u WHERE u.scan_jobid = a.id AND u.status <> 'done')),
+                     (SELECT greatest(0,extract(epoch FROM min(lease_expires - now())))::numeric
+                      FROM scan_job_unit
+                      WHERE status = 'running'))
+         END;
+
+$$;
+
+ALTER FUNCTION get_next_scan_job_due() OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_scan_backlog()
+--
+-- Parameters:
+-- @unit_size_ (INTEGER): Maximum number of IPs in a work unit
+--
+-- Return: (work units waiting for a scanner, work units running)
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_scan_backlog]\n'
+
+CREATE OR REPLACE FUNCTION get_scan_backlog(unit_size_ INTEGER) RETURNS TABLE (waiting_units BIGINT, running_units BIGINT)
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ -- 
+ -- This function is used by nmap2db_supervisor to decide how many 
+ -- scanners it runs. The work units waiting for a scanner are the
+ -- pending ones, the running ones with an expired lease and the 
+ -- ones the due scan jobs will get when they are split.
+ --
+
+  SELECT (SELECT count(*) 
+          FROM scan_job_unit 
+          WHERE status = 'pending' 
+          OR (status = 'running' AND lease_expires < now()))
+         +
+         (SELECT coalesce(sum(CASE WHEN family(a.network_addr) = 4 
+                                   THEN ceil(2 ^ (32 - masklen(a.network_addr)) / unit_size_)
+                                   ELSE 1
+                              END),0)::bigint
+          FROM scan_job a
+          WHERE (now() - a.last_execution) >= a.execution_interval
+          AND a.active_status IS TRUE
+          AND NOT EXISTS (SELECT 1 FROM scan_job_unit u WHERE u.scan_jobid = a.id AND u.status <> 'done')),
+         (SELECT count(*) 
+          FROM scan_job_unit 
+          WHERE status = 'running' 
+          AND lease_expires >= now());
+
+$$;
+
+ALTER FUNCTION get_scan_backlog(INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_scanner_worker_units()
+--
+-- Parameters:
+-- @hostname_ (TEXT): Hostname of the server running the scanners
+--
+-- Return: SET of (PID, scanner ID, work units running) of the 
+--         scanners running in a server
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_scanner_worker_units]\n'
+
+CREATE OR REPLACE FUNCTION get_scanner_worker_units(hostname_ TEXT) RETURNS TABLE (pid INTEGER, worker_id BIGINT, running_units BIGINT)
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+
+  SELECT a.pid,
+         a.id,
+         count(b.id)
+  FROM scanner_worker a
+  LEFT JOIN scan_job_unit b ON b.worker_id = a.id AND b.status = 'running'
+  WHERE a.hostname = $1
+  AND a.status = 'running'
+  GROUP BY a.id;
+
+$$;
+
+ALTER FUNCTION get_scanner_worker_units(TEXT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_scan_job_network_addr()
+--
+-- Parameters:
+-- @scan_job_id (BIGINT): Scan job ID
+--
+-- Return: network_addr for a scan job
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_scan_job_network_addr]\n'
+
+CREATE OR REPLACE FUNCTION get_scan_job_network_addr(BIGINT) RETURNS CIDR 
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ -- 
+ -- This function returns the network_addr for a scan job definition.
+ --
+
+  SELECT a.network_addr 
+  FROM scan_job a 
+  WHERE a.id = $1;
+
+$$;
+
+ALTER FUNCTION get_scan_job_network_addr(BIGINT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_scan_job_args()
+--
+-- Parameters:
+-- @scan_job_id (BIGINT): Scan job ID
+--
+-- Return: NMAP arguments for a scan job
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_scan_job_args]\n'
+
+CREATE OR REPLACE FUNCTION get_scan_job_args(BIGINT) RETURNS TEXT 
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function returns the NMAP arguments for a scan job definition.
+ --
+
+  SELECT b.args 
   FROM scan_job a 
   INNER JOIN scan_definition b 
   ON a.scan_id = b.scan_id 
@@ -1249,32 +2479,215 @@ ALTER FUNCTION get_active_scan_job_networks() OWNER TO nmap2db_role_rw;
 -- Function: save_scan_report()
 --
 -- Parameters:
+-- @scan_jobid (BIGINT): Scan job ID
 -- @xmlreport (XML): XML report from a NMAP scan
+-- @report_id (TEXT): MD5 value of the XML report. If it is NULL
+--                    it is calculated by extract_report_values()
 --
--- Return: Report ID for the scan report saved in the database
+-- Return: VOID
 -- ------------------------------------------------------------
 
 \echo '\n# [Creating function save_scan_report]\n'
 
-CREATE OR REPLACE FUNCTION save_scan_report(scan_jobid BIGINT, xmlreport XML) RETURNS VOID
+CREATE OR REPLACE FUNCTION save_scan_report(scan_jobid BIGINT, xmlreport XML, report_id TEXT DEFAULT NULL) RETURNS VOID
 LANGUAGE plpgsql
 SECURITY INVOKER
 SET search_path = public, pg_temp 
 AS $$
+DECLARE
+ report_saved BOOLEAN;
 BEGIN
  --
- -- This function saves in the database the XML report from a NMAP scan 
+ -- This function saves in the database the XML report from a NMAP scan.
+ --
+ -- The report is saved as it is. Only the extracted values that are 
+ -- used in searches (hostnames, OS names and service names) are 
+ -- converted to lowercase by the triggers of scan_report.
+ --
+ -- A report ID already saved is not saved again. With native 
+ -- partitioning the primary key of scan_report includes registered,
+ -- so it does not reject a report saved again. The advisory lock
+ -- serializes two sessions saving the same report.
  --
 
-  EXECUTE 'INSERT INTO scan_report (scan_jobid,xmlreport) VALUES ($1,$2)'
-  USING scan_jobid,
-  	lower(xmlreport::text)::xml;
+  IF report_id IS NOT NULL THEN
+    PERFORM pg_advisory_xact_lock(hashtext(report_id));
+
+    EXECUTE 'SELECT EXISTS (SELECT 1 FROM scan_report WHERE report_id = $1)'
+    INTO report_saved
+    USING report_id;
+
+    IF report_saved THEN
+      RETURN;
+    END IF;
+  END IF;
+
+  EXECUTE 'INSERT INTO scan_report (report_id,scan_jobid,xmlreport) VALUES ($1,$2,$3)'
+  USING report_id,
+  	scan_jobid,
+  	xmlreport;
 
   RETURN;
 END;
 $$;
 
-ALTER FUNCTION save_scan_report(BIGINT,XML) OWNER TO nmap2db_role_rw;
+ALTER FUNCTION save_scan_report(BIGINT,XML,TEXT) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: purge_raw_reports()
+--
+-- Parameters:
+-- @retention_ (INTERVAL): Retention period of the raw reports
+--
+-- Return: Number of raw reports deleted
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function purge_raw_reports]\n'
+
+CREATE OR REPLACE FUNCTION purge_raw_reports(retention_ INTERVAL) RETURNS BIGINT
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+ --
+ -- This function deletes the raw XML reports (xmlreport and 
+ -- rawreport) registered before the retention period. The 
+ -- values extracted from them in scan_report, host_info, 
+ -- service_info and network_topology are kept.
+ --
+
+  WITH purged_reports AS (
+    UPDATE scan_report
+    SET xmlreport = NULL,
+        rawreport = NULL
+    WHERE registered < now() - $1
+    AND (xmlreport IS NOT NULL OR rawreport IS NOT NULL)
+    RETURNING 1
+  )
+  SELECT count(*) FROM purged_reports;
+
+$$;
+
+ALTER FUNCTION purge_raw_reports(INTERVAL) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: rebuild_current_state()
+--
+-- Return: Number of hosts in host_current
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function rebuild_current_state]\n'
+
+CREATE OR REPLACE FUNCTION rebuild_current_state() RETURNS BIGINT
+LANGUAGE plpgsql
+SECURITY INVOKER
+SET search_path = public, pg_temp 
+AS $$
+DECLARE
+ hosts_ BIGINT;
+BEGIN
+ --
+ -- This function builds host_current and service_current again 
+ -- from host_info and service_info, with the same rules used by 
+ -- update_host_current() and update_service_current(). It is used 
+ -- to fill them in a database upgraded from an older version of 
+ -- nmap2db, or after reports have been deleted.
+ --
+ -- A port is kept if no newer report of the host has scanned its
+ -- protocol without finding it.
+ --
+
+  LOCK TABLE host_current, service_current IN EXCLUSIVE MODE;
+
+  DELETE FROM service_current;
+  DELETE FROM host_current;
+
+  INSERT INTO host_current (hostaddr,
+                            report_id,
+                            registered,
+                            scan_jobid,
+                            scan_started,
+                            scan_finished,
+                            addrtype,
+                            hostname,
+                            hostname_type,
+                            osclass_type,
+                            osclass_vendor,
+                            osclass_osfamily,
+                            osclass_osgen,
+                            osclass_accuracy,
+                            osmatch_name,
+                            osmatch_accuracy,
+                            state,
+                            state_reason)
+  SELECT DISTINCT ON (a.hostaddr)
+         a.hostaddr,
+         a.report_id,
+         a.registered,
+         a.scan_jobid,
+         a.scan_started,
+         a.scan_finished,
+         a.addrtype,
+         a.hostname,
+         a.hostname_type,
+         a.osclass_type,
+         a.osclass_vendor,
+         a.osclass_osfamily,
+         a.osclass_osgen,
+         a.osclass_accuracy,
+         a.osmatch_name,
+         a.osmatch_accuracy,
+         a.state,
+         a.state_reason
+  FROM host_info a
+  ORDER BY a.hostaddr, coalesce(a.scan_finished,a.registered) DESC;
+
+  GET DIAGNOSTICS hosts_ = ROW_COUNT;
+
+  INSERT INTO service_current (hostaddr,
+                               port_protocol,
+                               port_id,
+                               report_id,
+                               registered,
+                               scan_jobid,
+                               port_state,
+                               port_state_reason,
+                               service,
+                               service_method,
+                               service_product,
+                               service_product_version,
+                               service_product_extrainfo)
+  SELECT DISTINCT ON (b.hostaddr,b.port_protocol,b.port_id)
+         b.hostaddr,
+         b.port_protocol,
+         b.port_id,
+         b.report_id,
+         b.registered,
+         b.scan_jobid,
+         b.port_state,
+         b.port_state_reason,
+         b.service,
+         b.service_method,
+         b.service_product,
+         b.service_product_version,
+         b.service_product_extrainfo
+  FROM service_info b
+  JOIN host_info c ON c.report_id = b.report_id AND c.hostaddr = b.hostaddr
+  WHERE NOT EXISTS (SELECT 1
+                    FROM host_info d
+                    JOIN scan_report e ON e.report_id = d.report_id
+                    WHERE d.hostaddr = b.hostaddr
+                    AND b.port_protocol = ANY(coalesce(e.scan_protocols,ARRAY[e.scan_protocol]))
+                    AND coalesce(d.scan_finished,d.registered) > coalesce(c.scan_finished,c.registered))
+  ORDER BY b.hostaddr, b.port_protocol, b.port_id, coalesce(c.scan_finished,c.registered) DESC;
+
+  RETURN hosts_;
+END;
+$$;
+
+ALTER FUNCTION rebuild_current_state() OWNER TO nmap2db_role_rw;
 
 
 -- ------------------------------------------------------------
@@ -1282,13 +2695,15 @@ ALTER FUNCTION save_scan_report(BIGINT,XML) OWNER TO nmap2db_role_rw;
 --
 -- Parameters:
 -- @mode (TEXT): Output mode [normal|full]
+-- @seen_within (INTERVAL): Only links seen in this period of time.
+--                          All the links if it is NULL.
 --
 -- Return: DOT output for generating a network topology graph with Graphviz.
 -- ------------------------------------------------------------
 
 \echo '\n# [Creating function generate_topology_dot_output]\n'
 
-CREATE OR REPLACE FUNCTION generate_topology_dot_output(mode TEXT) RETURNS TEXT 
+CREATE OR REPLACE FUNCTION generate_topology_dot_output(mode TEXT, seen_within INTERVAL DEFAULT NULL) RETURNS TEXT 
 LANGUAGE plpgsql
 SECURITY INVOKER
 SET search_path = public, pg_temp 
@@ -1304,6 +2719,10 @@ BEGIN
   -- Mode = normal generates a graph with only the nodes that are routers.
   -- Mode = full generates a graph with all the nodes (routers and end nodes)
   --
+  -- If seen_within is defined, only the links seen by a traceroute in this
+  -- period of time are used, e.g. '30 days' leaves out the routes that 
+  -- do not exist anymore.
+  --
   -- The output generated can be sent with a unix pipe (|) to this command to generate
   -- a PNG file named network_topology.png: "dot -Tpng -o network_topology.png"
   --
@@ -1326,6 +2745,7 @@ BEGIN
 	  AS dot_output
     FROM network_topology
     WHERE is_adjacent_a_router IS TRUE
+    AND (seen_within IS NULL OR last_seen >= now() - seen_within)
 
     )LOOP
 
@@ -1348,6 +2768,7 @@ BEGIN
 	  || '";' 
 	  AS dot_output
     FROM network_topology
+    WHERE (seen_within IS NULL OR last_seen >= now() - seen_within)
 
     )LOOP
 
@@ -1363,7 +2784,7 @@ BEGIN
 END;
 $$;
 
-ALTER FUNCTION generate_topology_dot_output(TEXT) OWNER TO nmap2db_role_rw;
+ALTER FUNCTION generate_topology_dot_output(TEXT,INTERVAL) OWNER TO nmap2db_role_rw;
 
 -- ------------------------------------------------------------
 -- Function: xml_host_info()
@@ -1469,6 +2890,24 @@ CREATE TRIGGER decrease_total_scans
 AFTER DELETE ON host_info
     FOR EACH ROW EXECUTE PROCEDURE decrease_total_scans();
 
+CREATE TRIGGER update_host_current
+AFTER INSERT ON host_info
+    REFERENCING NEW TABLE AS new_host_info
+    FOR EACH STATEMENT EXECUTE PROCEDURE update_host_current();
+
+
+-- ------------------------------------------------------------
+-- Triggers: table service_info
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating triggers table: service_info]\n'
+
+CREATE TRIGGER update_service_current
+AFTER INSERT ON service_info
+    REFERENCING NEW TABLE AS new_service_info
+    FOR EACH STATEMENT EXECUTE PROCEDURE update_service_current();
+
 
 
 -- ------------------------------------------------------------
@@ -1486,6 +2925,10 @@ CREATE TRIGGER remove_network
 AFTER DELETE ON network
     FOR EACH ROW EXECUTE PROCEDURE remove_scan_job_network();
 
+CREATE TRIGGER notify_scan_job
+AFTER INSERT OR UPDATE ON scan_job
+    FOR EACH ROW EXECUTE PROCEDURE notify_scan_job();
+
 
 -- ------------------------------------------------------------
 -- Privileges
@@ -1573,6 +3016,45 @@ $$;
 ALTER FUNCTION register_network(CIDR,TEXT) OWNER TO nmap2db_role_rw;
 
 
+-- ------------------------------------------------------------
+-- Function: register_hostaddrs()
+--
+-- Parameters:
+-- @hostaddrs_ (INET[]): IPs to register
+--
+-- Return: Number of IPs registered
+-- ------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION register_hostaddrs(hostaddrs_ INET[]) RETURNS BIGINT
+ LANGUAGE sql
+ SECURITY INVOKER 
+ SET search_path = public, pg_temp
+ AS $$
+ --
+ -- This function registers single IPs in hostaddress. The IPs of 
+ -- IPv6 networks shorter than /112 are not generated when the 
+ -- network is registered, and only the IPs registered in 
+ -- hostaddress are scanned in them.
+ --
+ -- Only the IPs of a registered network are registered, IPs that
+ -- are already registered are ignored.
+ --
+
+  WITH new_hostaddrs AS (
+    INSERT INTO hostaddress (hostaddr)
+    SELECT DISTINCT host(a.hostaddr)::inet
+    FROM unnest(hostaddrs_) AS a(hostaddr)
+    WHERE EXISTS (SELECT 1 FROM network b WHERE b.network_addr >>= a.hostaddr)
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+  )
+  SELECT count(*) FROM new_hostaddrs;
+
+$$;
+
+ALTER FUNCTION register_hostaddrs(INET[]) OWNER TO nmap2db_role_rw;
+
+
 -- ------------------------------------------------------------
 -- Function: register_job_scan()
 --
@@ -1641,6 +3123,7 @@ ALTER VIEW show_scan_definitions OWNER TO nmap2db_role_rw;
 CREATE OR REPLACE VIEW show_scan_jobs AS
 SELECT id AS "ID",
        last_execution AS "Last execution",
+       last_completion AS "Last completion",
        network_addr AS "Network",
        scan_id AS "ScanID",
        execution_interval AS "Interval",
@@ -1654,6 +3137,25 @@ ORDER BY network_addr,scan_id,execution_interval,"Status";
 ALTER VIEW show_scan_jobs OWNER TO nmap2db_role_rw;
 
 
+CREATE OR REPLACE VIEW show_scanner_workers AS
+SELECT a.id AS "WorkerID",
+       a.hostname AS "Hostname",
+       a.pid AS "PID",
+       a.registered AS "Registered",
+       date_trunc('second',now() - a.last_heartbeat) AS "Last heartbeat",
+       a.status AS "Status",
+       count(b.id) AS "Work units",
+       min(b.lease_expires) AS "Lease expires"
+FROM scanner_worker a
+LEFT JOIN scan_job_unit b ON b.worker_id = a.id AND b.status = 'running'
+WHERE a.status = 'running'
+OR a.stopped > now() - INTERVAL '1 day'
+GROUP BY a.id
+ORDER BY a.hostname,a.pid;
+
+ALTER VIEW show_scanner_workers OWNER TO nmap2db_role_rw;
+
+
 CREATE OR REPLACE VIEW show_host_reports AS
 SELECT a.report_id AS "ReportID",
        c.scan_id AS "ScanID",
@@ -1741,6 +3243,32 @@ ORDER BY port_id,port_protocol,hostaddr;
 
 ALTER VIEW show_ports OWNER TO nmap2db_role_rw;
 
+CREATE OR REPLACE VIEW show_current_ports AS
+SELECT a.hostaddr AS "IPaddress",
+       array_to_string(b.hostname,' ') AS "Hostname",
+       a.port_id AS "Port",
+       a.port_protocol AS "Prot",
+       a.port_state AS "State",
+       a.service AS "Service",
+       a.service_product AS "Product",
+       a.service_product_version AS "Prod.ver",
+       left(a.service_product_extrainfo,50) AS "Prod.info",
+       coalesce(b.scan_finished,b.registered) AS "Last scan"
+FROM service_current a
+JOIN host_current b ON b.hostaddr = a.hostaddr;
+
+ALTER VIEW show_current_ports OWNER TO nmap2db_role_rw;
+
+CREATE OR REPLACE VIEW show_current_os AS
+SELECT hostaddr AS "IPaddress",
+       array_to_string(hostname,',','*') AS "Hostname",
+       array_to_string(osmatch_name[1:2],',','*') AS "OSname",
+       state AS "State",
+       coalesce(scan_finished,registered) AS "Last scan"
+FROM host_current;
+
+ALTER VIEW show_current_os OWNER TO nmap2db_role_rw;
+
 
 
 COMMIT;
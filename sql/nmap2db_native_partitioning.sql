@@ -0,0 +1,541 @@
+-- --------------------------------------------------
+-- NMAP2DB
+--
+-- NMAP2DB is a set of scripts that can be used to run
+-- automatic NMAP scans of a network and save the results
+-- in a database for further analysis.
+--
+-- @File:
+-- nmap2db_native_partitioning.sql
+--
+-- @Author:
+-- Rafael Martinez Guerrero / rafael@postgresql.org.es
+--
+-- @Description:
+-- This file converts the tables scan_report, host_info and
+-- service_info to native range partitioning by registered, one
+-- partition per month, and installs the functions that create
+-- the partitions ahead of time. It needs PostgreSQL >= 13, the
+-- script stops at once with an older version.
+--
+-- It can be run after nmap2db.sql in a new database, or in an
+-- existing database with or without the partitioning of
+-- nmap2db_table_partition.sql. The existing rows are copied to
+-- the new tables in one transaction, the scanners have to be
+-- stopped and the database needs free space for a copy of the
+-- three tables.
+--
+-- Rows are saved in a DEFAULT partition if the partition of
+-- their month does not exist, they are moved to the partition
+-- of their month when it is created.
+--
+-- Old partitions can be archived and dropped with the
+-- purge_history command of the nmap2db shell.
+--
+-- Primary keys of partitioned tables have to include the
+-- partition key, registered is added to them. host_info and
+-- service_info do not reference scan_report any more, the
+-- partitions of a month of the three tables are kept and
+-- removed together.
+-- --------------------------------------------------
+
+
+\set ON_ERROR_STOP on
+
+\connect nmap2db postgres
+
+DO $$
+BEGIN
+  IF current_setting('server_version_num')::INTEGER < 130000 THEN
+     RAISE EXCEPTION 'Native partitioning of nmap2db needs PostgreSQL >= 13, this server runs %',current_setting('server_version');
+  END IF;
+END;
+$$;
+
+BEGIN;
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_class WHERE oid = 'scan_report'::regclass AND relkind = 'p') THEN
+     RAISE EXCEPTION 'scan_report is already partitioned';
+  END IF;
+END;
+$$;
+
+
+-- ------------------------------------------------------------
+-- Function: decrease_total_scans()
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function decrease_total_scans]\n'
+
+CREATE OR REPLACE FUNCTION decrease_total_scans() RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+    BEGIN
+       --
+       -- This function can be used by a trigger to decrease the
+       -- attributte total_scans when a hostaddr is deleted from host_info
+       --
+       -- If nmap2db.partition_maintenance is 'on', the rows are only
+       -- moved between partitions of host_info and total_scans does
+       -- not change.
+       --
+
+       IF current_setting('nmap2db.partition_maintenance',true) = 'on' THEN
+          RETURN NULL;
+       END IF;
+
+       EXECUTE 'UPDATE hostaddress
+       	        SET
+		total_scans = total_scans - 1
+		WHERE hostaddr = $1'
+       USING OLD.hostaddr;
+
+       RETURN NULL;
+    END;
+$$;
+
+ALTER FUNCTION decrease_total_scans() OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: create_nmap2db_partition()
+--
+-- Parameters:
+-- @table_name_ (TEXT): scan_report, host_info or service_info
+-- @month_ (DATE): Month of the partition
+--
+-- Return: TRUE if the partition has been created
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function create_nmap2db_partition]\n'
+
+CREATE OR REPLACE FUNCTION create_nmap2db_partition(table_name_ TEXT, month_ DATE) RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+ v_partition_table TEXT := table_name_ || '_' || to_char(month_,'YYYY_MM');
+ v_default_table TEXT := table_name_ || '_default';
+ v_check_constraint TEXT := table_name_ || '_' || to_char(month_,'YYYY_MM') || '_registered_check';
+
+ v_date_from TIMESTAMP WITH TIME ZONE := date_trunc('month',month_);
+ v_date_to TIMESTAMP WITH TIME ZONE := date_trunc('month',month_) + '1 month'::interval;
+
+ BEGIN
+   --
+   -- This function creates the partition of a month of
+   -- scan_report, host_info or service_info.
+   --
+   -- The partition is created as a table with a CHECK constraint
+   -- for its range and then attached, so the parent table only
+   -- gets a SHARE UPDATE EXCLUSIVE lock and inserts are not
+   -- blocked. The rows of the month saved in the DEFAULT partition
+   -- are moved to the new partition before it is attached.
+   --
+
+   IF table_name_ NOT IN ('scan_report','host_info','service_info') THEN
+      RAISE EXCEPTION 'Table % is not partitioned by nmap2db',table_name_;
+   END IF;
+
+   IF to_regclass(v_partition_table) IS NOT NULL THEN
+      RETURN FALSE;
+   END IF;
+
+   EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS, CONSTRAINT %I CHECK (registered >= %L AND registered < %L))',
+                  v_partition_table,table_name_,v_check_constraint,v_date_from,v_date_to);
+
+   EXECUTE format('ALTER TABLE %I OWNER TO nmap2db_role_rw',v_partition_table);
+
+   IF to_regclass(v_default_table) IS NOT NULL THEN
+
+      EXECUTE format('LOCK TABLE %I IN ACCESS EXCLUSIVE MODE',v_default_table);
+
+      PERFORM set_config('nmap2db.partition_maintenance','on',true);
+
+      EXECUTE format('WITH moved_rows AS (DELETE FROM %I WHERE registered >= %L AND registered < %L RETURNING *) INSERT INTO %I SELECT * FROM moved_rows',
+                     v_default_table,v_date_from,v_date_to,v_partition_table);
+
+      PERFORM set_config('nmap2db.partition_maintenance','off',true);
+   END IF;
+
+   EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                  table_name_,v_partition_table,v_date_from,v_date_to);
+
+   EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I',v_partition_table,v_check_constraint);
+   EXECUTE format('GRANT SELECT ON %I TO nmap2db_role_ro',v_partition_table);
+
+   RETURN TRUE;
+ END;
+$$;
+
+ALTER FUNCTION create_nmap2db_partition(TEXT,DATE) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: create_nmap2db_partitions()
+--
+-- Parameters:
+-- @months_ahead_ (INTEGER): Number of months after the current
+--                           one with partitions
+--
+-- Return: Number of partitions created
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function create_nmap2db_partitions]\n'
+
+CREATE OR REPLACE FUNCTION create_nmap2db_partitions(months_ahead_ INTEGER DEFAULT 3) RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+ v_month DATE;
+ v_table_name TEXT;
+ v_created INTEGER := 0;
+
+ BEGIN
+   --
+   -- This function creates the partitions of scan_report, host_info
+   -- and service_info for the current month and the next
+   -- months_ahead_ months, if they do not exist.
+   --
+   -- It is run by nmap2db_scan and nmap2db_supervisor when they
+   -- start, and by nmap2db_supervisor every hour. Concurrent calls
+   -- wait for each other.
+   --
+
+   PERFORM pg_advisory_xact_lock(hashtext('create_nmap2db_partitions'));
+
+   FOR v_month IN SELECT generate_series(date_trunc('month',now()),
+                                         date_trunc('month',now()) + months_ahead_ * '1 month'::interval,
+                                         '1 month'::interval)::DATE
+   LOOP
+     FOREACH v_table_name IN ARRAY ARRAY['scan_report','host_info','service_info']
+     LOOP
+       IF create_nmap2db_partition(v_table_name,v_month) THEN
+          v_created := v_created + 1;
+       END IF;
+     END LOOP;
+   END LOOP;
+
+   RETURN v_created;
+ END;
+$$;
+
+ALTER FUNCTION create_nmap2db_partitions(INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: get_expired_nmap2db_partitions()
+--
+-- Parameters:
+-- @retention_months_ (INTEGER): Number of full months kept
+--                               before the current one
+--
+-- Return: Month, table and name of the partitions older than
+--         the retention period
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function get_expired_nmap2db_partitions]\n'
+
+CREATE OR REPLACE FUNCTION get_expired_nmap2db_partitions(retention_months_ INTEGER) RETURNS TABLE (partition_month DATE, table_name TEXT, partition_name TEXT)
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public, pg_temp
+AS $$
+  --
+  -- The month of a partition is taken from its name, the
+  -- partitions are created by create_nmap2db_partition().
+  -- The DEFAULT partitions are never expired.
+  --
+
+  SELECT to_date(right(b.relname,7),'YYYY_MM'),
+         c.relname::TEXT,
+         b.relname::TEXT
+  FROM pg_inherits a
+  JOIN pg_class b ON b.oid = a.inhrelid
+  JOIN pg_class c ON c.oid = a.inhparent
+  WHERE c.relname IN ('scan_report','host_info','service_info')
+  AND b.relname ~ '_[0-9]{4}_[0-9]{2}$'
+  AND to_date(right(b.relname,7),'YYYY_MM') + '1 month'::interval <= date_trunc('month',now()) - retention_months_ * '1 month'::interval
+  ORDER BY 1,2;
+$$;
+
+ALTER FUNCTION get_expired_nmap2db_partitions(INTEGER) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Function: drop_nmap2db_partitions()
+--
+-- Parameters:
+-- @month_ (DATE): Month of the partitions
+--
+-- Return: Number of host scans deleted
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating function drop_nmap2db_partitions]\n'
+
+CREATE OR REPLACE FUNCTION drop_nmap2db_partitions(month_ DATE) RETURNS BIGINT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+ v_table_name TEXT;
+ v_partition_table TEXT;
+ v_host_info_table TEXT := 'host_info_' || to_char(month_,'YYYY_MM');
+ v_scans BIGINT := 0;
+
+ BEGIN
+   --
+   -- This function detaches and drops the partitions of a month of
+   -- scan_report, host_info and service_info.
+   --
+   -- No row triggers are fired. total_scans in hostaddress is 
+   -- decreased with one UPDATE by the number of scans of every 
+   -- host in the partition of host_info, instead of once per row
+   -- by decrease_total_scans(). host_current and service_current 
+   -- keep the last known state of the hosts.
+   --
+
+   IF month_ >= date_trunc('month',now()) THEN
+      RAISE EXCEPTION 'The partitions of the current month can not be dropped';
+   END IF;
+
+   PERFORM pg_advisory_xact_lock(hashtext('create_nmap2db_partitions'));
+
+   IF to_regclass(v_host_info_table) IS NOT NULL THEN
+
+      EXECUTE format('SELECT count(*) FROM %I',v_host_info_table) INTO v_scans;
+
+      EXECUTE format('WITH scans AS (SELECT hostaddr, count(*) AS total FROM %I GROUP BY hostaddr) ' ||
+                     'UPDATE hostaddress a SET total_scans = greatest(a.total_scans - b.total,0) ' ||
+                     'FROM scans b WHERE a.hostaddr = b.hostaddr',v_host_info_table);
+   END IF;
+
+   FOREACH v_table_name IN ARRAY ARRAY['service_info','host_info','scan_report']
+   LOOP
+     v_partition_table := v_table_name || '_' || to_char(month_,'YYYY_MM');
+
+     IF to_regclass(v_partition_table) IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I',v_table_name,v_partition_table);
+        EXECUTE format('DROP TABLE %I',v_partition_table);
+     END IF;
+   END LOOP;
+
+   RETURN v_scans;
+ END;
+$$;
+
+ALTER FUNCTION drop_nmap2db_partitions(DATE) OWNER TO nmap2db_role_rw;
+
+
+-- ------------------------------------------------------------
+-- Views
+--
+-- The views that use scan_report, host_info or service_info
+-- are saved, dropped and created again with the new tables.
+-- ------------------------------------------------------------
+
+\echo '\n# [Saving views]\n'
+
+CREATE TEMP TABLE nmap2db_partitioning_views ON COMMIT DROP AS
+SELECT DISTINCT c.oid,
+       c.relname,
+       pg_get_viewdef(c.oid) AS definition,
+       pg_get_userbyid(c.relowner) AS owner
+FROM pg_depend a
+JOIN pg_rewrite b ON b.oid = a.objid
+JOIN pg_class c ON c.oid = b.ev_class
+WHERE a.classid = 'pg_rewrite'::regclass
+AND a.refobjid IN ('scan_report'::regclass,'host_info'::regclass,'service_info'::regclass)
+AND c.relkind = 'v';
+
+DO $$
+DECLARE
+ v_view RECORD;
+BEGIN
+  FOR v_view IN SELECT relname FROM nmap2db_partitioning_views ORDER BY oid DESC LOOP
+    EXECUTE format('DROP VIEW %I',v_view.relname);
+  END LOOP;
+END;
+$$;
+
+
+-- ------------------------------------------------------------
+-- Tables
+--
+-- The old tables, and their children if they were partitioned
+-- with nmap2db_table_partition.sql, are renamed with the suffix
+-- _unpartitioned and deleted when their rows have been copied.
+-- ------------------------------------------------------------
+
+\echo '\n# [Renaming old tables]\n'
+
+DO $$
+DECLARE
+ v_table RECORD;
+BEGIN
+  FOR v_table IN SELECT b.relname
+                 FROM pg_inherits a
+                 JOIN pg_class b ON b.oid = a.inhrelid
+                 WHERE a.inhparent IN ('scan_report'::regclass,'host_info'::regclass,'service_info'::regclass)
+  LOOP
+    EXECUTE format('ALTER TABLE %I RENAME TO %I',v_table.relname,v_table.relname || '_unpartitioned');
+  END LOOP;
+END;
+$$;
+
+ALTER TABLE scan_report RENAME TO scan_report_unpartitioned;
+ALTER TABLE host_info RENAME TO host_info_unpartitioned;
+ALTER TABLE service_info RENAME TO service_info_unpartitioned;
+
+DROP FUNCTION IF EXISTS create_nmap2db_partitions_tables();
+
+\echo '\n# [Creating partitioned tables]\n'
+
+CREATE TABLE scan_report (LIKE scan_report_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (registered);
+CREATE TABLE host_info (LIKE host_info_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (registered);
+CREATE TABLE service_info (LIKE service_info_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (registered);
+
+ALTER TABLE scan_report OWNER TO nmap2db_role_rw;
+ALTER TABLE host_info OWNER TO nmap2db_role_rw;
+ALTER TABLE service_info OWNER TO nmap2db_role_rw;
+
+CREATE TABLE scan_report_default PARTITION OF scan_report DEFAULT;
+CREATE TABLE host_info_default PARTITION OF host_info DEFAULT;
+CREATE TABLE service_info_default PARTITION OF service_info DEFAULT;
+
+ALTER TABLE scan_report_default OWNER TO nmap2db_role_rw;
+ALTER TABLE host_info_default OWNER TO nmap2db_role_rw;
+ALTER TABLE service_info_default OWNER TO nmap2db_role_rw;
+
+\echo '\n# [Creating partitions]\n'
+
+DO $$
+DECLARE
+ v_month DATE;
+ v_table_name TEXT;
+BEGIN
+  FOR v_month IN SELECT generate_series(date_trunc('month',coalesce(least((SELECT min(registered) FROM scan_report_unpartitioned),
+                                                                          (SELECT min(registered) FROM host_info_unpartitioned),
+                                                                          (SELECT min(registered) FROM service_info_unpartitioned)),now())),
+                                        date_trunc('month',now()),
+                                        '1 month'::interval)::DATE
+  LOOP
+    FOREACH v_table_name IN ARRAY ARRAY['scan_report','host_info','service_info']
+    LOOP
+      PERFORM create_nmap2db_partition(v_table_name,v_month);
+    END LOOP;
+  END LOOP;
+
+  PERFORM create_nmap2db_partitions(3);
+END;
+$$;
+
+\echo '\n# [Copying rows]\n'
+
+INSERT INTO scan_report SELECT * FROM scan_report_unpartitioned;
+INSERT INTO host_info SELECT * FROM host_info_unpartitioned;
+INSERT INTO service_info SELECT * FROM service_info_unpartitioned;
+
+DROP TABLE service_info_unpartitioned CASCADE;
+DROP TABLE host_info_unpartitioned CASCADE;
+DROP TABLE scan_report_unpartitioned CASCADE;
+
+
+-- ------------------------------------------------------------
+-- Constraints and indexes
+--
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating constraints and indexes]\n'
+
+ALTER TABLE scan_report ADD PRIMARY KEY (report_id,registered);
+ALTER TABLE host_info ADD PRIMARY KEY (report_id,hostaddr,registered);
+ALTER TABLE service_info ADD PRIMARY KEY (report_id,hostaddr,port_protocol,port_id,registered);
+
+ALTER TABLE scan_report ADD CONSTRAINT scan_jobid
+   FOREIGN KEY (scan_jobid) REFERENCES scan_job (id) MATCH FULL ON DELETE CASCADE;
+
+ALTER TABLE host_info ADD CONSTRAINT hostaddr
+   FOREIGN KEY (hostaddr) REFERENCES hostaddress (hostaddr) MATCH FULL ON DELETE CASCADE;
+
+ALTER TABLE service_info ADD CONSTRAINT hostaddr
+   FOREIGN KEY (hostaddr) REFERENCES hostaddress (hostaddr) MATCH FULL ON DELETE CASCADE;
+
+CREATE INDEX scan_report_registered_idx ON scan_report USING brin(registered);
+CREATE INDEX scan_report_raw_report_idx ON scan_report(registered) WHERE xmlreport IS NOT NULL OR rawreport IS NOT NULL;
+
+CREATE INDEX host_info_registered_idx ON host_info USING brin(registered);
+CREATE INDEX host_info_hostaddr_idx ON host_info(hostaddr);
+CREATE INDEX host_info_without_hostname_idx ON host_info(hostaddr,registered) WHERE hostname = '{}';
+
+CREATE INDEX service_info_registered_idx ON service_info USING brin(registered);
+CREATE INDEX service_info_hostaddr_idx ON service_info(hostaddr);
+CREATE INDEX service_info_port_id_idx ON service_info(port_id);
+
+
+-- ------------------------------------------------------------
+-- Triggers
+--
+-- Row triggers of a partitioned table are created in all its
+-- partitions. Statement triggers with transition tables fire
+-- for the rows inserted in all the partitions.
+-- ------------------------------------------------------------
+
+\echo '\n# [Creating triggers]\n'
+
+CREATE TRIGGER extract_report_values
+BEFORE INSERT ON scan_report
+    FOR EACH ROW EXECUTE PROCEDURE extract_report_values();
+
+CREATE TRIGGER extract_hosts_and_services_values
+AFTER INSERT ON scan_report
+   FOR EACH ROW EXECUTE PROCEDURE extract_hosts_and_services_values();
+
+CREATE TRIGGER update_last_scanned
+AFTER INSERT ON host_info
+    FOR EACH ROW EXECUTE PROCEDURE update_last_scanned();
+
+CREATE TRIGGER decrease_total_scans
+AFTER DELETE ON host_info
+    FOR EACH ROW EXECUTE PROCEDURE decrease_total_scans();
+
+CREATE TRIGGER update_host_current
+AFTER INSERT ON host_info
+    REFERENCING NEW TABLE AS new_host_info
+    FOR EACH STATEMENT EXECUTE PROCEDURE update_host_current();
+
+CREATE TRIGGER update_service_current
+AFTER INSERT ON service_info
+    REFERENCING NEW TABLE AS new_service_info
+    FOR EACH STATEMENT EXECUTE PROCEDURE update_service_current();
+
+
+\echo '\n# [Creating views]\n'
+
+DO $$
+DECLARE
+ v_view RECORD;
+BEGIN
+  FOR v_view IN SELECT relname,definition,owner FROM nmap2db_partitioning_views ORDER BY oid LOOP
+    EXECUTE format('CREATE VIEW %I AS %s',v_view.relname,v_view.definition);
+    EXECUTE format('ALTER VIEW %I OWNER TO %I',v_view.relname,v_view.owner);
+  END LOOP;
+END;
+$$;
+
+GRANT SELECT ON all tables in schema public to nmap2db_role_ro;
+
+COMMIT;
+
+ANALYZE scan_report;
+ANALYZE host_info;
+ANALYZE service_info;
@@ -15,6 +15,10 @@
 -- This file installs all the functions necessary to
 -- manage partitions of host_info, service_info and
 -- scan_report tables
+--
+-- It is kept for older installations. With PostgreSQL >= 13 use
+-- nmap2db_native_partitioning.sql, which does not need a monthly
+-- job.
 -- --------------------------------------------------
 
 
@@ -69,10 +73,8 @@ DECLARE
 		'FOREIGN KEY (scan_jobid) REFERENCES scan_job (id) MATCH FULL ON DELETE CASCADE, ' ||
 		'CHECK (registered >= ''' || v_date_from || ''' AND registered < ''' || v_date_to || ''')) INHERITS (scan_report)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_started_idx ON ' || v_partition_table || '(started)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_finished_idx ON ' || v_partition_table || '(finished)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_elapsed_time_idx ON ' || v_partition_table || '(elapsed_time)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_raw_report_idx ON ' || v_partition_table || '(registered) WHERE xmlreport IS NOT NULL OR rawreport IS NOT NULL';
 
 	EXECUTE 'CREATE TRIGGER extract_report_values BEFORE INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE extract_report_values()';
 	EXECUTE 'CREATE TRIGGER extract_hosts_and_services_values AFTER INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE extract_hosts_and_services_values()';
@@ -96,10 +98,8 @@ DECLARE
 		'CHECK (registered >= ''' || v_date_from + '1 month'::interval || 
 		''' AND registered < ''' || v_date_to + '1 month'::interval || ''')) INHERITS (scan_report)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_started_idx ON ' || v_partition_table || '(started)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_finished_idx ON ' || v_partition_table || '(finished)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_elapsed_time_idx ON ' || v_partition_table || '(elapsed_time)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_raw_report_idx ON ' || v_partition_table || '(registered) WHERE xmlreport IS NOT NULL OR rawreport IS NOT NULL';
 
 	EXECUTE 'CREATE TRIGGER extract_report_values BEFORE INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE extract_report_values()';
 	EXECUTE 'CREATE TRIGGER extract_hosts_and_services_values AFTER INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE extract_hosts_and_services_values()';
@@ -143,14 +143,13 @@ DO INSTEAD INSERT INTO ' || 'scan_report_' || EXTRACT(YEAR FROM v_date_from + '1
 		' CHECK (registered >= ''' || v_date_from || 
 		''' AND registered < ''' || v_date_to || ''')) INHERITS (host_info)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_scan_started_idx ON ' || v_partition_table || '(scan_started)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_scan_finished_idx ON ' || v_partition_table || '(scan_finished)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_hostaddr_idx ON ' || v_partition_table || '(hostaddr)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_state_idx ON ' || v_partition_table || '(state)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_without_hostname_idx ON ' || v_partition_table || '(hostaddr,registered) WHERE hostname = ''{}''';
 
 	EXECUTE 'CREATE TRIGGER update_last_scanned AFTER INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE update_last_scanned();';
 	EXECUTE 'CREATE TRIGGER decrease_total_scans AFTER DELETE ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE decrease_total_scans()';
+	EXECUTE 'CREATE TRIGGER update_host_current AFTER INSERT ON ' || v_partition_table || ' REFERENCING NEW TABLE AS new_host_info FOR EACH STATEMENT EXECUTE PROCEDURE update_host_current()';
 
    END IF; 
 
@@ -174,14 +173,13 @@ DO INSTEAD INSERT INTO ' || 'scan_report_' || EXTRACT(YEAR FROM v_date_from + '1
 		' CHECK (registered >= ''' || v_date_from + '1 month'::interval || 
 		''' AND registered < ''' || v_date_to + '1 month'::interval || ''')) INHERITS (host_info)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_scan_started_idx ON ' || v_partition_table || '(scan_started)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_scan_finished_idx ON ' || v_partition_table || '(scan_finished)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_hostaddr_idx ON ' || v_partition_table || '(hostaddr)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_state_idx ON ' || v_partition_table || '(state)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_without_hostname_idx ON ' || v_partition_table || '(hostaddr,registered) WHERE hostname = ''{}''';
     
 	EXECUTE 'CREATE TRIGGER update_last_scanned AFTER INSERT ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE update_last_scanned();';
 	EXECUTE 'CREATE TRIGGER decrease_total_scans AFTER DELETE ON ' || v_partition_table || ' FOR EACH ROW EXECUTE PROCEDURE decrease_total_scans()';
+	EXECUTE 'CREATE TRIGGER update_host_current AFTER INSERT ON ' || v_partition_table || ' REFERENCING NEW TABLE AS new_host_info FOR EACH STATEMENT EXECUTE PROCEDURE update_host_current()';
    END IF;
        
    --
@@ -220,12 +218,11 @@ DO INSTEAD INSERT INTO ' || 'host_info_' || EXTRACT(YEAR FROM v_date_from + '1 m
 	'FOREIGN KEY (hostaddr) REFERENCES hostaddress (hostaddr) MATCH FULL ON DELETE CASCADE,' || 
 	'CHECK (registered >= ''' || v_date_from || ''' AND registered < ''' || v_date_to || ''')) INHERITS (service_info)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_hostaddr_idx ON ' || v_partition_table || '(hostaddr)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_protocol_idx ON ' || v_partition_table || '(port_protocol)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_id_idx ON ' || v_partition_table || '(port_id)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_state_idx ON ' || v_partition_table || '(port_state)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_service_idx ON ' || v_partition_table || '(service)';
+
+	EXECUTE 'CREATE TRIGGER update_service_current AFTER INSERT ON ' || v_partition_table || ' REFERENCING NEW TABLE AS new_service_info FOR EACH STATEMENT EXECUTE PROCEDURE update_service_current()';
 
      END IF;
      
@@ -248,12 +245,11 @@ DO INSTEAD INSERT INTO ' || 'host_info_' || EXTRACT(YEAR FROM v_date_from + '1 m
 	'CHECK (registered >= ''' || v_date_from + '1 month'::interval || 
 	''' AND registered < ''' || v_date_to + '1 month'::interval || ''')) INHERITS (service_info)';
 	
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || '(registered)';
+	EXECUTE 'CREATE INDEX ' || v_partition_table || '_registered_idx ON ' || v_partition_table || ' USING brin(registered)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_hostaddr_idx ON ' || v_partition_table || '(hostaddr)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_protocol_idx ON ' || v_partition_table || '(port_protocol)';
 	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_id_idx ON ' || v_partition_table || '(port_id)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_port_state_idx ON ' || v_partition_table || '(port_state)';
-	EXECUTE 'CREATE INDEX ' || v_partition_table || '_service_idx ON ' || v_partition_table || '(service)';
+
+	EXECUTE 'CREATE TRIGGER update_service_current AFTER INSERT ON ' || v_partition_table || ' REFERENCING NEW TABLE AS new_service_info FOR EACH STATEMENT EXECUTE PROCEDURE update_service_current()';
 
      END IF;
 
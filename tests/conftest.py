@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Fixtures shared by the tests of the nmap2db package.
+#
+# The tests do not need a database or nmap. The XML reports are
+# written by benchmarks/fake_nmap.
+#
+
+import os
+import sys
+import logging
+import subprocess
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_NMAP = os.path.join(ROOT_DIR,'benchmarks','fake_nmap')
+
+sys.path.insert(0,ROOT_DIR)
+
+
+class test_logs():
+    """Logger used by the classes that need a logs object"""
+
+    def __init__(self):
+        self.logger = logging.getLogger('nmap2db_tests')
+
+
+@pytest.fixture
+def logs():
+    return test_logs()
+
+
+@pytest.fixture
+def fake_nmap_report():
+    """Get the XML report written by fake_nmap for a list of targets"""
+
+    def run_fake_nmap(targets,ports=3,hops=3,os_matches=1,down=0):
+        env = dict(os.environ)
+        env.update({'FAKE_NMAP_PORTS':str(ports),
+                    'FAKE_NMAP_HOPS':str(hops),
+                    'FAKE_NMAP_OS_MATCHES':str(os_matches),
+                    'FAKE_NMAP_DOWN':str(down),
+                    'FAKE_NMAP_SEED':'1'})
+
+        return subprocess.check_output([sys.executable,FAKE_NMAP,'-oX','-','-sS'] + targets,env=env)
+
+    return run_fake_nmap
@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# The nmap processes are shell commands that wait for a file
+# before they exit, so every test decides in which order they
+# finish. The targets are the positional parameters of the
+# command and are ignored.
+#
+
+import os
+import time
+
+import pytest
+
+from nmap2db.scan_pool import *
+
+
+@pytest.fixture
+def pool(logs):
+    pool = nmap2db_scan_pool(10,logs,0.01)
+
+    yield pool
+
+    pool.terminate_all()
+
+
+@pytest.fixture
+def release_dir(tmpdir):
+    return str(tmpdir)
+
+
+def nmap_command(release_dir,name,exit_code=0):
+    """Command that exits with exit_code when the file name exists in release_dir"""
+
+    release_file = os.path.join(release_dir,name)
+
+    return ['sh','-c','while [ ! -e "%s" ]; do sleep 0.01; done; exit %s' % (release_file,exit_code)]
+
+
+def release(release_dir,name):
+    open(os.path.join(release_dir,name),'w').close()
+
+
+def wait_for(pool,process):
+    """Collect the finished processes until process has finished"""
+
+    deadline = time.time() + 10
+
+    while process.finished == None and time.time() < deadline:
+        for finished in pool.wait(1):
+            finished.close()
+
+
+def test_checkpoint_follows_submission_order(pool,release_dir):
+    pool.open_unit(1,7)
+
+    first = pool.submit(7,['10.0.0.1','10.0.0.2'],nmap_command(release_dir,'first'),1)
+    second = pool.submit(7,['10.0.0.3','10.0.0.4'],nmap_command(release_dir,'second'),1)
+    third = pool.submit(7,['10.0.0.5'],nmap_command(release_dir,'third'),1)
+
+    #
+    # The later processes finish first. The checkpoint can not
+    # move until the first one has finished too.
+    #
+
+    release(release_dir,'third')
+    wait_for(pool,third)
+    release(release_dir,'second')
+    wait_for(pool,second)
+
+    assert pool.pop_checkpoints(0) == [(1,None)]
+
+    release(release_dir,'first')
+    wait_for(pool,first)
+
+    assert pool.pop_checkpoints(0) == [(1,'10.0.0.5')]
+
+
+def test_checkpoint_stops_before_a_failed_process(pool,release_dir):
+    pool.open_unit(1,7)
+
+    first = pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'first'),1)
+    failed = pool.submit(7,['10.0.0.2'],nmap_command(release_dir,'failed',1),1)
+    third = pool.submit(7,['10.0.0.3'],nmap_command(release_dir,'third'),1)
+    pool.close_unit(1)
+
+    for name, process in [('first',first),('failed',failed),('third',third)]:
+        release(release_dir,name)
+        wait_for(pool,process)
+
+    assert pool.is_failed_unit(1)
+    assert pool.pop_checkpoints(0) == [(1,'10.0.0.1')]
+    assert pool.pop_completed_units() == []
+    assert pool.pop_failed_units() == [(1,7,'10.0.0.1')]
+    assert pool.get_num_units() == 0
+
+
+def test_unit_completed_when_closed_and_finished(pool,release_dir):
+    pool.open_unit(1,7)
+    process = pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'first'),1)
+
+    release(release_dir,'first')
+    wait_for(pool,process)
+
+    #
+    # Targets can still be submitted until the unit is closed.
+    #
+
+    assert pool.pop_completed_units() == []
+
+    pool.close_unit(1)
+
+    assert pool.pop_completed_units() == [(1,7)]
+    assert pool.pop_failed_units() == []
+    assert pool.get_num_units() == 0
+
+
+def test_unit_not_completed_while_running(pool,release_dir):
+    pool.open_unit(1,7)
+    pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'first'),1)
+    pool.close_unit(1)
+
+    assert pool.pop_completed_units() == []
+    assert pool.get_num_units(7) == 1
+
+
+def test_units_are_independent(pool,release_dir):
+    pool.open_unit(1,7)
+    pool.open_unit(2,8)
+
+    slow = pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'slow'),1)
+    fast = pool.submit(8,['10.1.0.1'],nmap_command(release_dir,'fast'),2)
+
+    release(release_dir,'fast')
+    wait_for(pool,fast)
+
+    assert sorted(pool.pop_checkpoints(0)) == [(1,None),(2,'10.1.0.1')]
+
+    release(release_dir,'slow')
+    wait_for(pool,slow)
+
+
+def test_discard_unit(pool,release_dir):
+    pool.open_unit(1,7)
+    process = pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'first'),1)
+
+    pool.discard_unit(1)
+
+    #
+    # The process of a discarded unit still runs and is
+    # collected, but the unit is not tracked anymore.
+    #
+
+    release(release_dir,'first')
+    wait_for(pool,process)
+
+    assert process.get_returncode() == 0
+    assert pool.pop_checkpoints(0) == []
+    assert pool.get_num_units() == 0
+
+
+def test_pop_checkpoints_interval(pool):
+    pool.open_unit(1,7)
+
+    assert pool.pop_checkpoints(3600) == []
+    assert pool.pop_checkpoints(0) == [(1,None)]
+
+
+def test_free_slots(logs,release_dir):
+    pool = nmap2db_scan_pool(2,logs,0.01)
+
+    try:
+        pool.submit(7,['10.0.0.1'],nmap_command(release_dir,'first'))
+        assert pool.has_free_slot()
+
+        pool.submit(7,['10.0.0.2'],nmap_command(release_dir,'second'))
+        assert not pool.has_free_slot()
+        assert pool.get_num_running() == 2
+
+    finally:
+        pool.terminate_all()
@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+
+import pytest
+
+from nmap2db.spool import *
+
+
+@pytest.fixture
+def spool_dir(tmpdir):
+    return os.path.join(str(tmpdir),'spool')
+
+
+@pytest.fixture
+def spool(spool_dir,logs):
+    return nmap2db_spool(spool_dir,logs)
+
+
+def test_spool_directory_mode(spool,spool_dir):
+    assert stat.S_IMODE(os.stat(spool_dir).st_mode) == 0700
+
+
+def test_append_entries(spool):
+    report_entry = spool.append_report(7,'abc123','<nmaprun/>')
+    unit_entry = spool.append_unit(11,3)
+    checkpoint_entry = spool.append_checkpoint(11,3,'10.0.0.5')
+    release_entry = spool.append_release(12,3)
+
+    assert spool.list_entries() == [report_entry,unit_entry,checkpoint_entry,release_entry]
+
+    assert spool.read_entry(report_entry) == ('report',['7','abc123'],'<nmaprun/>')
+    assert spool.read_entry(unit_entry) == ('unit',['11','3'],'')
+    assert spool.read_entry(checkpoint_entry) == ('checkpoint',['11','3','10.0.0.5'],'')
+    assert spool.read_entry(release_entry) == ('release',['12','3'],'')
+
+
+def test_append_checkpoint_without_ip(spool):
+    entry_name = spool.append_checkpoint(11,3,None)
+
+    assert spool.read_entry(entry_name) == ('checkpoint',['11','3','None'],'')
+
+
+def test_entries_survive_a_new_spool(spool,spool_dir,logs):
+
+    #
+    # Entries left by a scanner that stopped are drained
+    # by the next one using the same directory.
+    #
+
+    entry_name = spool.append_report(7,'abc123','<nmaprun/>')
+
+    assert nmap2db_spool(spool_dir,logs).list_entries() == [entry_name]
+
+
+def test_drain(spool):
+    for report_id in ['a','b','c']:
+        spool.append_report(1,report_id,'<nmaprun/>')
+
+    drained = []
+
+    for entry_name in spool.list_entries():
+        kind, values, data = spool.read_entry(entry_name)
+        drained.append(values[1])
+        spool.remove_entry(entry_name)
+
+    assert drained == ['a','b','c']
+    assert spool.is_empty()
+
+
+def test_remove_entry_twice(spool):
+    entry_name = spool.append_unit(11,3)
+
+    spool.remove_entry(entry_name)
+    spool.remove_entry(entry_name)
+
+    assert spool.is_empty()
+
+
+def test_reject_entry(spool,spool_dir):
+    entry_name = spool.append_report(1,'a','not XML')
+
+    spool.reject_entry(entry_name)
+
+    assert spool.is_empty()
+    assert os.path.exists(os.path.join(spool_dir,entry_name + '.rejected'))
+
+
+def test_no_temporary_files_left(spool,spool_dir):
+    spool.append_report(1,'a','<nmaprun/>')
+
+    assert [name for name in os.listdir(spool_dir) if name.endswith('.tmp')] == []
+
+
+def test_lock(spool,spool_dir,logs):
+    other_spool = nmap2db_spool(spool_dir,logs)
+
+    assert spool.lock()
+    assert not other_spool.lock()
+
+    spool.unlock()
+
+    assert other_spool.lock()
+    other_spool.unlock()
+
+
+def test_drain_retry_interval(spool):
+    assert spool.can_drain()
+
+    spool.drain_failed(3600)
+    assert not spool.can_drain()
+
+    spool.drain_done()
+    assert spool.can_drain()
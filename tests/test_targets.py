@@ -0,0 +1,76 @@
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+
+from nmap2db.targets import *
+
+
+def test_get_address_family():
+    assert get_address_family('10.0.0.1') == 4
+    assert get_address_family('2001:db8::1') == 6
+
+
+def test_address_conversion():
+    assert address_to_int('0.0.1.2') == 258
+    assert address_to_int('10.0.0.0/24') == address_to_int('10.0.0.0')
+    assert int_to_address(258,4) == '0.0.1.2'
+
+    for address in ['0.0.0.0','192.168.1.255','::','2001:db8::1:0','ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff']:
+        assert int_to_address(address_to_int(address),get_address_family(address)) == address
+
+
+def test_iter_range_targets_ipv4():
+    assert list(iter_range_targets('10.0.0.254','10.0.1.1')) == ['10.0.0.254','10.0.0.255','10.0.1.0','10.0.1.1']
+    assert list(iter_range_targets('10.0.0.1','10.0.0.1')) == ['10.0.0.1']
+    assert list(iter_range_targets('10.0.0.2','10.0.0.1')) == []
+
+
+def test_iter_range_targets_ipv6():
+    assert list(iter_range_targets('2001:db8::fffe','2001:db8::1:1')) == ['2001:db8::fffe','2001:db8::ffff','2001:db8::1:0','2001:db8::1:1']
+
+
+def test_iter_range_targets_is_lazy():
+
+    #
+    # A /64 can not be generated in a list, the first IPs
+    # have to be available at once.
+    #
+
+    targets = iter_range_targets('2001:db8::','2001:db8::ffff:ffff:ffff:ffff')
+
+    assert list(itertools.islice(targets,3)) == ['2001:db8::','2001:db8::1','2001:db8::2']
+
+
+def test_get_range_size():
+    assert get_range_size('10.0.0.0','10.0.0.255') == 256
+    assert get_range_size('2001:db8::','2001:db8::ffff:ffff:ffff:ffff') == 2 ** 64
+
+
+def test_can_expand_range_ipv4():
+    assert can_expand_range('10.0.0.0','10.255.255.255')
+
+
+def test_can_expand_range_ipv6_limit():
+    last_hostaddr = int_to_address(address_to_int('2001:db8::') + MAX_EXPANDED_ADDRESSES - 1,6)
+
+    assert can_expand_range('2001:db8::',last_hostaddr)
+    assert not can_expand_range('2001:db8::',int_to_address(address_to_int(last_hostaddr) + 1,6))
+    assert not can_expand_range('2001:db8::','2001:db8::ffff:ffff:ffff:ffff')
@@ -0,0 +1,158 @@
+#
+# Copyright (c) 2014 Rafael Martinez Guerrero (PostgreSQL-es)
+# rafael@postgresql.org.es / http://www.postgresql.org.es/
+#
+# This file is part of Nmap2db
+# https://github.com/rafaelma/nmap2db
+#
+# Nmap2db is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nmap2db is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Nmap2db.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from xml.etree import ElementTree
+
+from nmap2db.xml_report import *
+
+TARGETS = ['198.18.0.1','198.18.0.2','198.18.0.3']
+
+
+def get_report_values(report):
+    return dict(zip(SCAN_REPORT_COLUMNS,report.report_row))
+
+
+# ############################################
+# split_nmap_report()
+# ############################################
+
+def test_split_nmap_report_one_report_per_host(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS)
+    host_reports = split_nmap_report(xml_report)
+
+    assert len(host_reports) == len(TARGETS)
+
+    for target, host_report in zip(TARGETS,host_reports):
+        root = ElementTree.fromstring(host_report)
+
+        assert root.tag == 'nmaprun'
+        assert [host.find('address').get('addr') for host in root.findall('host')] == [target]
+        assert root.find('scaninfo').get('protocol') == 'tcp'
+        assert root.find('runstats/hosts').attrib == {'up':'1','down':'0','total':'1'}
+
+
+def test_split_nmap_report_keeps_nmaprun_attributes(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS)
+    root = ElementTree.fromstring(xml_report)
+
+    for host_report in split_nmap_report(xml_report):
+        assert ElementTree.fromstring(host_report).attrib == root.attrib
+
+
+def test_split_nmap_report_without_hosts(fake_nmap_report):
+    assert split_nmap_report(fake_nmap_report(TARGETS,down=1)) == []
+
+
+# ############################################
+# nmap_report
+# ############################################
+
+def test_nmap_report_rows(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS,ports=3,hops=3)
+    report = nmap_report(42,xml_report)
+    values = get_report_values(report)
+
+    assert report.report_id == get_report_id(xml_report)
+    assert values['report_id'] == report.report_id
+    assert values['scan_jobid'] == 42
+    assert values['scan_protocol'] == 'tcp'
+    assert values['scan_protocols'] == ['tcp']
+    assert values['host_up'] == 3
+    assert values['host_total'] == 3
+    assert values['xmlreport'] == xml_report
+    assert values['rawreport'] == None
+
+    hosts = [dict(zip(HOST_INFO_COLUMNS,row)) for row in report.host_rows]
+
+    assert [host['hostaddr'] for host in hosts] == TARGETS
+    assert all([host['report_id'] == report.report_id for host in hosts])
+    assert all([host['state'] == 'up' for host in hosts])
+
+    services = [dict(zip(SERVICE_INFO_COLUMNS,row)) for row in report.service_rows]
+
+    assert len(services) == 3 * len(TARGETS)
+    assert all([service['port_protocol'] == 'tcp' for service in services])
+
+    assert len(report.report_row) == len(SCAN_REPORT_COLUMNS)
+    assert all([len(row) == len(HOST_INFO_COLUMNS) for row in report.host_rows])
+    assert all([len(row) == len(SERVICE_INFO_COLUMNS) for row in report.service_rows])
+
+
+def test_nmap_report_lowercase_values(fake_nmap_report):
+    report = nmap_report(1,fake_nmap_report(TARGETS))
+
+    for row in report.host_rows:
+        host = dict(zip(HOST_INFO_COLUMNS,row))
+
+        assert host['hostname'] == [name.lower() for name in host['hostname']]
+        assert host['osclass_vendor'] == [vendor.lower() for vendor in host['osclass_vendor']]
+
+
+def test_nmap_report_topology_rows(fake_nmap_report):
+    report = nmap_report(1,fake_nmap_report(TARGETS[:1],hops=3))
+    links = [dict(zip(NETWORK_TOPOLOGY_COLUMNS,row)) for row in report.topology_rows]
+
+    #
+    # Three hops are two links. Only the first adjacent hop
+    # is a router, the last one is the host.
+    #
+
+    assert len(links) == 2
+    assert links[0]['adjacent_hostaddr'] == links[1]['hostaddr']
+    assert links[1]['adjacent_hostaddr'] == TARGETS[0]
+    assert [link['is_adjacent_a_router'] for link in links] == [True,False]
+
+
+def test_nmap_report_skips_hops_without_ipaddr(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS[:1],hops=3)
+    xml_report = re.sub(r'(<hop ttl="2") ipaddr="[^"]*"',r'\1',xml_report)
+
+    report = nmap_report(1,xml_report)
+
+    assert report.topology_rows == []
+
+
+def test_nmap_report_all_scan_protocols(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS[:1])
+    xml_report = xml_report.replace('<verbose','<scaninfo type="udp" protocol="udp" numservices="1000" services="1-1000"/>\n<verbose',1)
+
+    values = get_report_values(nmap_report(1,xml_report))
+
+    assert values['scan_protocol'] == 'tcp'
+    assert values['scan_protocols'] == ['tcp','udp']
+
+
+def test_nmap_report_compressed(fake_nmap_report):
+    xml_report = fake_nmap_report(TARGETS)
+    values = get_report_values(nmap_report(1,xml_report,True))
+
+    assert values['xmlreport'] == None
+    assert decompress_raw_report(values['rawreport']) == xml_report
+
+
+def test_nmap_report_of_split_reports(fake_nmap_report):
+    for target, host_report in zip(TARGETS,split_nmap_report(fake_nmap_report(TARGETS))):
+        report = nmap_report(1,host_report)
+
+        assert report.report_id == get_report_id(host_report)
+        assert [row[HOST_INFO_COLUMNS.index('hostaddr')] for row in report.host_rows] == [target]
+        assert get_report_values(report)['host_total'] == 1